@@ -1,4 +1,4 @@
-from typing import Callable, Union, Any, Optional, List
+from typing import Callable, Dict, Union, Any, Optional, List, Tuple
 import ast
 import codecs
 from functools import partial
@@ -8,8 +8,11 @@ import re
 
 from lxml import etree
 
+from pyastrx.axml.python.symbols import module_symbols
 from pyastrx.axml.python.things2ast import txt2ast
 from pyastrx.data_typing import ASTrXType, FileInfo, AXML
+from pyastrx.xml.fused import FusedMatcher
+from pyastrx.xml.xpath_compiler import compile_fused_rules
 
 
 def set_encoded_literal(
@@ -23,6 +26,37 @@ def set_encoded_literal(
         set_fn("")  # Null byte - failover to empty string
 
 
+def type_location(infered_type: ASTrXType) -> List[int]:
+    loc = infered_type["location"]
+    return [
+        loc["start"]["line"],
+        loc["start"]["column"],
+        loc["stop"]["line"],
+        loc["stop"]["column"]
+    ]
+
+
+def set_type(
+    xml_node: etree._Element, field_value: Any, infered_type: ASTrXType
+) -> None:
+    """Set the attributes of an inferred type in a xml node."""
+    set_encoded_literal(
+        partial(xml_node.set, "type"), infered_type["annotation"]
+    )
+    for attr_name in ("name", "node_name", "fullname"):
+        value = getattr(field_value, attr_name, None)
+        if value is None:
+            continue
+        xml_node.set(attr_name, value)
+
+    attrs = infered_type.get("attrs", None)
+
+    if attrs is None:
+        return
+    for attr in attrs:
+        xml_node.set(attr, "1")
+
+
 def encode_type(
     xml_node: etree._Element,
     field_name: str,
@@ -36,30 +70,9 @@ def encode_type(
 
     while i < num_types:
         infered_type = infered_types[i]
-        annotation = infered_type["annotation"]
-        loc = infered_type["location"]
-        location = [
-            loc["start"]["line"],
-            loc["start"]["column"],
-            loc["stop"]["line"],
-            loc["stop"]["column"]
-        ]
+        location = type_location(infered_type)
         if all(a == b for a, b in zip(location, el_loc)):
-            set_encoded_literal(
-                partial(xml_node.set, "type"), annotation
-            )
-            for attr_name in ("name", "node_name", "fullname"):
-                value = getattr(field_value, attr_name, None)
-                if value is None:
-                    continue
-                xml_node.set(attr_name, value)
-
-            attrs = infered_type.get("attrs", None)
-
-            if attrs is None:
-                continue
-            for attr in attrs:
-                xml_node.set(attr, "1")
+            set_type(xml_node, field_value, infered_type)
             encoded = True
             break
         i += 1
@@ -77,23 +90,31 @@ def transformer_ast_node_field(
         field_value: Any, field_name: str, xml_node: etree._Element,
         infered_types: Optional[List[ASTrXType]] = None,
         txt_lines: Optional[List[str]] = None,
-        el_loc: Optional[List[int]] = None
+        el_loc: Optional[List[int]] = None,
+        matcher: Optional[FusedMatcher] = None,
 ) -> None:
     if field_name == "annotation" and infered_types:
         return
     if isinstance(field_value, ast.AST):
         field = etree.SubElement(xml_node, field_name)
+        if matcher is not None:
+            position = matcher.enter(field_name)
         field.append(
             ast2xml(
                 field_value,
                 infered_types=infered_types,
                 txt_lines=txt_lines,
-                el_loc_parent=el_loc
+                el_loc_parent=el_loc,
+                matcher=matcher,
             )
         )
+        if matcher is not None:
+            matcher.exit(field, position)
 
     elif isinstance(field_value, list):
         field = etree.SubElement(xml_node, field_name)
+        if matcher is not None:
+            position = matcher.enter(field_name)
         for item in field_value:
             if isinstance(item, ast.AST):
                 field.append(
@@ -101,12 +122,17 @@ def transformer_ast_node_field(
                         item,
                         infered_types=infered_types,
                         txt_lines=txt_lines,
-                        el_loc_parent=el_loc
+                        el_loc_parent=el_loc,
+                        matcher=matcher,
                     )
                 )
             else:
                 subfield: etree._Element = etree.SubElement(field, "item")
                 set_encoded_literal(partial(setattr, subfield, "text"), item)
+                if matcher is not None:
+                    matcher.exit(subfield, matcher.enter("item"))
+        if matcher is not None:
+            matcher.exit(field, position)
     elif field_value is not None:
         set_encoded_literal(
             partial(xml_node.set, field_name), field_value)
@@ -129,6 +155,20 @@ def transformer_ast_node_field(
         )
 
 
+# nodes located at their name, like the tokens of pyre
+_NAMED_NODES = ("FunctionDef", "ClassDef", "arg")
+_LOCATION_ATTRS = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+
+
+def name_cols(name: Any, txt_line: str) -> Optional[Tuple[int, int]]:
+    """The columns of the name of a definition in its line."""
+    rc = re.compile(f"{name}(?!([0-9]|\\_|^a-zA-Z))") # noqa
+    r_result = rc.search(txt_line)
+    if r_result is None:
+        return None
+    return r_result.start(), r_result.end()
+
+
 def encode_location(
         node: Union[ast.AST, ast.Module], xml_node: etree._Element,
         txt_lines: Optional[List[str]] = None) -> None:
@@ -140,25 +180,21 @@ def encode_location(
     # the below code is used because the location obtained from the
     # pyre is based on the tokens position for some types of nodes like
     # ClassDef, FunctionDef, etc.
-    if node.__class__.__name__ in (
-            "FunctionDef", "ClassDef", "arg") and txt_lines:
+    if node.__class__.__name__ in _NAMED_NODES and txt_lines:
         value = getattr(node, "name", None)
         if value is None:
             value = getattr(node, "arg", None)
         lineno = node.lineno
-        txt_line = txt_lines[lineno-1]
-        rc = re.compile(f"{value}(?!([0-9]|\\_|^a-zA-Z))") # noqa
-        r_result = rc.search(txt_line)
-        if r_result is None:
+        cols = name_cols(value, txt_lines[lineno-1])
+        if cols is None:
             return
 
-        end_col_offset = r_result.end()
-        col_offset = r_result.start()
+        col_offset, end_col_offset = cols
         setattr(node, "end_lineno", lineno)
         setattr(node, "end_col_offset", end_col_offset)
         setattr(node, "col_offset", col_offset)
 
-    for attr in ("lineno", "col_offset", "end_lineno", "end_col_offset"):
+    for attr in _LOCATION_ATTRS:
         value = getattr(node, attr, None)
         if value is None:
             continue
@@ -169,13 +205,21 @@ def ast2xml(
         node: ast.AST,
         txt_lines: Optional[List[str]] = None,
         infered_types: Optional[List[ASTrXType]] = None,
-        el_loc_parent: Optional[List[int]] = None
+        el_loc_parent: Optional[List[int]] = None,
+        matcher: Optional[FusedMatcher] = None,
 ) -> etree._Element:
-    """Convert supplied AST node to XML."""
+    """Convert supplied AST node to XML.
+
+    If a matcher is given, the fused rules are matched during
+    the conversion.
+
+    """
 
     #  ast_node_name can be for example "FunctionDef", "ClassDef"...
     ast_node_name = node.__class__.__name__
     xml_node = etree.Element(ast_node_name)
+    if matcher is not None:
+        position = matcher.enter(ast_node_name)
     node_field_names = []
     node_field_values = []
     for attr in node._fields:
@@ -187,13 +231,8 @@ def ast2xml(
     encode_location(
         node, xml_node, txt_lines)
 
-
     try:
-        el_loc = [
-                int(xml_node.get(attr, 0))
-                for attr in (
-                    "lineno", "col_offset", "end_lineno", "end_col_offset")
-        ]
+        el_loc = [int(xml_node.get(attr, 0)) for attr in _LOCATION_ATTRS]
     except TypeError:
         if el_loc_parent:
             el_loc = el_loc_parent
@@ -205,21 +244,109 @@ def ast2xml(
             field_value, field_name, xml_node,
             infered_types=infered_types,
             txt_lines=txt_lines,
-            el_loc=el_loc
+            el_loc=el_loc,
+            matcher=matcher,
         )
 
+    if matcher is not None:
+        matcher.exit(xml_node, position)
     return xml_node
 
 
+def annotate_axml(
+        xml_ast: etree._Element, txt: str,
+        infered_types: List[ASTrXType]) -> None:
+    """Merge the inferred types into the xml of a python source
+    converted without them.
+
+    The result is the xml converted with the types, see
+    `ast2xml`: the definitions are located at their names, the
+    `annotation` fields are removed and the nodes with a literal field
+    get the attributes of the type at their location.
+
+    """
+    if not infered_types:
+        return
+    types_by_location: Dict[Tuple[int, ...], ASTrXType] = {}
+    for file_type in infered_types:
+        types_by_location.setdefault(
+            tuple(type_location(file_type)), file_type)
+    txt_lines = txt.split("\n")
+    nodes = [xml_ast]
+    while nodes:
+        xml_node = nodes.pop()
+        if xml_node.tag in _NAMED_NODES:
+            name = xml_node.get("name", xml_node.get("arg"))
+            lineno = int(xml_node.get("lineno", 0))
+            cols = None
+            if name is not None and 0 < lineno <= len(txt_lines):
+                cols = name_cols(name, txt_lines[lineno - 1])
+            if cols is None:
+                for attr in _LOCATION_ATTRS:
+                    xml_node.attrib.pop(attr, "")
+            else:
+                xml_node.set("col_offset", str(cols[0]))
+                xml_node.set("end_lineno", str(lineno))
+                xml_node.set("end_col_offset", str(cols[1]))
+        el_loc = tuple(
+            int(xml_node.get(attr, 0)) for attr in _LOCATION_ATTRS)
+        infered_type = types_by_location.get(el_loc)
+        # only the nodes with a literal field are annotated
+        if infered_type is not None and any(
+                attr not in _LOCATION_ATTRS and attr != "type"
+                for attr in xml_node.attrib):
+            set_type(xml_node, None, infered_type)
+        for field in list(xml_node):
+            if field.tag == "annotation":
+                xml_node.remove(field)
+                continue
+            nodes.extend(child for child in field if child.tag != "item")
+
+
+def annotate_file_info(
+        info: FileInfo,
+        infered_types: Optional[List[ASTrXType]]) -> FileInfo:
+    """Merge the inferred types into the xml of a `FileInfo`, see
+    `annotate_axml`."""
+    if not infered_types:
+        return info
+    axml = info.axml
+    if isinstance(axml, bytes):
+        xml_ast = etree.fromstring(axml)
+        annotate_axml(xml_ast, info.txt, infered_types)
+        info.axml = etree.tostring(xml_ast, encoding="utf-8")
+        return info
+    if isinstance(axml, etree._ElementTree):
+        axml = axml.getroot()
+    annotate_axml(axml, info.txt, infered_types)
+    return info
+
+
+def txt2axml(
+        txt: str, filename: str = "<unknown>",
+        normalize_ast: bool = True) -> etree._Element:
+    """Convert a python source to xml, without inferred types."""
+    return ast2xml(txt2ast(txt, filename, normalize_ast))
+
+
 def file2axml(
         filename: str,
         infered_types: Optional[List[ASTrXType]],
         specification_name: str,
         normalize_ast: bool = True,
         baxml: bool = False,
+        fused_xpaths: Optional[Tuple[str, ...]] = None,
 ) -> FileInfo:
     """Construct the FileInfo obj from a python file.
 
+    Args:
+        fused_xpaths: the rules to be matched during the conversion,
+            the ones that can not be fused are ignored. Their matches
+            are stored in `FileInfo.fused_spans`.
+
+    The module level symbols of the file are stored in
+    `FileInfo.symbols`, see `pyastrx.axml.python.symbols`.
+
     """
     file_path = str(Path(filename).resolve())
     with open(file_path, "r", encoding='utf-8') as f:
@@ -229,11 +356,21 @@ def file2axml(
     txt_lines = None
     if infered_types:
         txt_lines = txt.split("\n")
+    matcher = None
+    if fused_xpaths:
+        fused_rules = compile_fused_rules(fused_xpaths)
+        if len(fused_rules) > 0:
+            matcher = FusedMatcher(fused_rules)
     xml_ast = ast2xml(
         parsed_ast,
         txt_lines=txt_lines,
-        infered_types=infered_types
+        infered_types=infered_types,
+        matcher=matcher,
     )
+    fused_spans = {}
+    if matcher is not None:
+        fused_spans = matcher.spans()
+    symbols = module_symbols(parsed_ast, file_path)
     if baxml:
         xml_ast = etree.tostring(xml_ast, encoding="utf-8")
 
@@ -242,7 +379,10 @@ def file2axml(
         axml=xml_ast,
         txt=txt,
         language="python",
-        specification_name=specification_name
+        specification_name=specification_name,
+        normalize_ast=normalize_ast,
+        fused_spans=fused_spans,
+        symbols=symbols,
     )
 
     return info
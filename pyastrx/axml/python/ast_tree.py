@@ -0,0 +1,320 @@
+"""A virtual XML tree over the python AST.
+
+The nodes of this module mirror the elements and attributes that
+`ast2xml` creates for a python file, without the inferred types.
+The elements keep a reference to their AST objects and the attribute
+nodes are created on demand. This allows to evaluate xpath rules
+without the conversion to lxml.
+
+"""
+import ast
+import codecs
+import re
+from numbers import Number
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pyastrx.axml.python.things2ast import txt2ast
+from pyastrx.data_typing import FileInfo
+
+_LOCATION_ATTRS = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+# lxml refuses the control characters, ast2xml stores "" instead
+_NOT_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def encode_literal(literal: Any) -> str:
+    """The same value that `set_encoded_literal` stores in lxml."""
+    literal_type = type(literal)
+    if literal_type is int:
+        return str(literal)
+    if literal_type is str and literal.isascii() \
+            and _NOT_XML_RE.search(literal) is None:
+        return literal
+    if isinstance(literal, Number):
+        literal = str(literal)
+    try:
+        encoded = codecs.encode(literal, "ascii", "xmlcharrefreplace")
+    except Exception:
+        return ""
+    text = encoded.decode("ascii") if isinstance(encoded, bytes) \
+        else encoded
+    if not isinstance(text, str) or _NOT_XML_RE.search(text):
+        return ""
+    return text
+
+
+class Node:
+    """Base class of the nodes of the virtual tree.
+
+    Attributes:
+        parent: the parent node, None for the document node
+        key: a tuple that sorts the nodes in document order
+
+    """
+    __slots__ = ("parent", "key")
+    kind = ""
+    tag: Optional[str] = None
+
+    def __init__(self, parent: Optional["Node"], key: Tuple[int, ...]):
+        self.parent = parent
+        self.key = key
+
+    def getparent(self) -> Optional["Node"]:
+        return self.parent
+
+    def string_value(self) -> str:
+        return ""
+
+    def iter_children(self) -> List["Node"]:
+        return []
+
+    def iter_attributes(self) -> List["AttributeNode"]:
+        return []
+
+    def iter_descendants(self) -> Iterator["Node"]:
+        """The descendants in document order."""
+        stack = list(reversed(self.iter_children()))
+        while stack:
+            node = stack.pop()
+            yield node
+            children = node.iter_children()
+            if children:
+                stack.extend(reversed(children))
+
+
+class AttributeNode(Node):
+    __slots__ = ("name", "value")
+    kind = "attribute"
+
+    def __init__(
+        self, parent: "ElementNode", key: Tuple[int, ...],
+        name: str, value: str,
+    ) -> None:
+        super().__init__(parent, key)
+        self.name = name
+        self.value = value
+
+    def string_value(self) -> str:
+        return self.value
+
+
+class TextNode(Node):
+    __slots__ = ("text",)
+    kind = "text"
+
+    def __init__(
+        self, parent: "ElementNode", key: Tuple[int, ...], text: str
+    ) -> None:
+        super().__init__(parent, key)
+        self.text = text
+
+    def string_value(self) -> str:
+        return self.text
+
+
+class ElementNode(Node):
+    """An element of the virtual tree.
+
+    The role of an element is NODE for the elements named after the
+    class of an AST node, FIELD for the elements named after a field
+    with AST nodes or a list (e.g. `body`) and ITEM for the `item`
+    elements of the literals inside of a list.
+
+    Attributes:
+        order: the position of the element in document order
+        end: the order of its last descendant
+
+    """
+    __slots__ = ("tag", "source", "role", "order", "end", "children",
+                 "_attributes", "_values")
+    kind = "element"
+    NODE = 0
+    FIELD = 1
+    ITEM = 2
+
+    def __init__(
+        self, parent: Optional[Node], order: int,
+        tag: str, source: Any, role: int,
+    ) -> None:
+        # the base __init__ is not called, millions of them are created
+        self.parent = parent
+        self.key = (order,)
+        self.tag = tag
+        self.source = source
+        self.role = role
+        self.order = order
+        self.end = order
+        self.children: List[Node] = []
+        self._attributes: Optional[Dict[str, AttributeNode]] = None
+        self._values: Optional[Dict[str, str]] = None
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.attribute_values().get(name, default)
+
+    def attribute_values(self) -> Dict[str, str]:
+        if self._values is not None:
+            return self._values
+        values: Dict[str, str] = {}
+        if self.role == ElementNode.NODE:
+            node = self.source
+            for attr in _LOCATION_ATTRS:
+                value = getattr(node, attr, None)
+                if value is not None:
+                    values[attr] = encode_literal(value)
+            for field_name in node._fields:
+                value = getattr(node, field_name, None)
+                if value is None or isinstance(value, (ast.AST, list)):
+                    continue
+                values[field_name] = encode_literal(value)
+                if self.tag == "Constant":
+                    values["type"] = encode_literal(type(value).__name__)
+        self._values = values
+        return values
+
+    def attribute(self, name: str) -> Optional[AttributeNode]:
+        """The attribute node with this name, created on demand."""
+        if self._attributes is None:
+            self._attributes = {}
+        node = self._attributes.get(name)
+        if node is None:
+            values = self.attribute_values()
+            if name not in values:
+                return None
+            position = list(values).index(name) + 1
+            node = AttributeNode(
+                self, (self.order, position), name, values[name])
+            self._attributes[name] = node
+        return node
+
+    def iter_attributes(self) -> List[AttributeNode]:
+        return [
+            self.attribute(name)  # type: ignore
+            for name in self.attribute_values()]
+
+    def iter_children(self) -> List[Node]:
+        return self.children
+
+    def string_value(self) -> str:
+        if self.role == ElementNode.ITEM:
+            return encode_literal(self.source)
+        return "".join(
+            node.string_value() for node in self.iter_descendants()
+            if node.kind == "text")
+
+
+class DocumentNode(Node):
+    """The document node of the virtual tree of an AST.
+
+    All the elements are created in a single traversal of the AST,
+    which also numbers them in document order and groups them by tag.
+
+    """
+    __slots__ = ("root", "by_tag")
+    kind = "document"
+
+    def __init__(self, tree: ast.AST, first_order: int = 0) -> None:
+        """
+        Args:
+            first_order: the order of the root element, the trees of
+                several files are numbered in disjoint ranges
+
+        """
+        super().__init__(None, ())
+        self.by_tag: Dict[str, List[ElementNode]] = {}
+        self.root = self._build(tree, first_order)
+
+    def _build(self, tree: ast.AST, first_order: int) -> ElementNode:
+        by_tag = self.by_tag
+        order = first_order
+        root = ElementNode(
+            self, order, tree.__class__.__name__, tree, ElementNode.NODE)
+        # (element, True) marks the end of the subtree of the element
+        stack: List[Tuple[ElementNode, bool]] = [(root, False)]
+        while stack:
+            element, finished = stack.pop()
+            if finished:
+                element.end = order - 1
+                continue
+            element.order = order
+            element.key = (order,)
+            tag: str = element.tag  # type: ignore
+            if tag in by_tag:
+                by_tag[tag].append(element)
+            else:
+                by_tag[tag] = [element]
+            children: List[Node] = element.children
+            role = element.role
+            if role == ElementNode.NODE:
+                node = element.source
+                for field_name in node._fields:
+                    value = getattr(node, field_name, None)
+                    if isinstance(value, (list, ast.AST)):
+                        children.append(ElementNode(
+                            element, 0, field_name, value,
+                            ElementNode.FIELD))
+            elif role == ElementNode.FIELD:
+                values = element.source
+                if isinstance(values, ast.AST):
+                    values = [values]
+                for value in values:
+                    if isinstance(value, ast.AST):
+                        children.append(ElementNode(
+                            element, 0, value.__class__.__name__, value,
+                            ElementNode.NODE))
+                    else:
+                        children.append(ElementNode(
+                            element, 0, "item", value, ElementNode.ITEM))
+            else:
+                text = encode_literal(element.source)
+                if text:
+                    order += 1
+                    children.append(TextNode(element, (order,), text))
+            stack.append((element, True))
+            if role != ElementNode.ITEM:
+                for child in reversed(children):
+                    stack.append((child, False))  # type: ignore
+            order += 1
+        return root
+
+    def iter_children(self) -> List[Node]:
+        return [self.root]
+
+    def elements_by_tag(self) -> Dict[str, List[ElementNode]]:
+        """The elements of each tag in document order."""
+        return self.by_tag
+
+    def string_value(self) -> str:
+        return self.root.string_value()
+
+
+def txt2document(
+    txt: str, filename: str = "<unknown>", normalize_ast: bool = True,
+    first_order: int = 0,
+) -> DocumentNode:
+    """Parse a python source in a virtual tree."""
+    return DocumentNode(txt2ast(txt, filename, normalize_ast), first_order)
+
+
+def file2info(
+    filename: str,
+    specification_name: str,
+    normalize_ast: bool = True,
+    **kwargs: Any,
+) -> FileInfo:
+    """Construct a FileInfo obj without the xml of the file.
+
+    The AST backend parses the source again in each search, the xml
+    is only created if some rule can not be evaluated over the AST.
+
+    """
+    file_path = str(Path(filename).resolve())
+    with open(file_path, "r", encoding='utf-8') as f:
+        txt = f.read()
+    return FileInfo(
+        filename=file_path,
+        axml=b"",
+        txt=txt,
+        language="python",
+        specification_name=specification_name,
+        normalize_ast=normalize_ast,
+    )
@@ -0,0 +1,131 @@
+"""The symbols defined and imported by a python module.
+
+The symbols are extracted from the same AST the AXML is built from,
+only the module body and the bodies of its classes are visited. The
+classes are matched by name, this works for the `ast` and the `gast`
+trees.
+
+"""
+import ast
+from pathlib import Path
+from typing import Any, Dict, List
+
+from pyastrx.data_typing import ModuleSymbols, SymbolDefinition
+
+_FUNCTIONS = ("FunctionDef", "AsyncFunctionDef")
+
+
+def module_name(filename: str) -> str:
+    """The fully qualified name of the module of a file.
+
+    The parent folders with an `__init__.py` are the packages of
+    the module.
+
+    """
+    path = Path(filename).resolve()
+    parts: List[str] = []
+    if path.name != "__init__.py":
+        parts.append(path.stem)
+    folder = path.parent
+    while (folder / "__init__.py").exists() and folder.parent != folder:
+        parts.append(folder.name)
+        folder = folder.parent
+    return ".".join(reversed(parts))
+
+
+def is_deprecated(node: Any) -> bool:
+    """True if a definition has a `deprecated` decorator, e.g.
+    `@deprecated`, `@warnings.deprecated("...")`."""
+    for decorator in getattr(node, "decorator_list", []):
+        if decorator.__class__.__name__ == "Call":
+            decorator = decorator.func
+        kind = decorator.__class__.__name__
+        if kind == "Name" and decorator.id == "deprecated":
+            return True
+        if kind == "Attribute" and decorator.attr == "deprecated":
+            return True
+    return False
+
+
+def resolve_import(module: str, package: str, level: int) -> str:
+    """The absolute name of a `from` import."""
+    if level == 0:
+        return module
+    base = package.split(".") if package else []
+    if level > 1:
+        base = base[:len(base) - level + 1]
+    if module:
+        base.append(module)
+    return ".".join(base)
+
+
+def add_assign_targets(
+    targets: List[Any], lineno: int,
+    definitions: Dict[str, SymbolDefinition],
+) -> None:
+    for target in targets:
+        kind = target.__class__.__name__
+        if kind == "Name":
+            definitions[target.id] = SymbolDefinition("variable", lineno)
+        elif kind in ("Tuple", "List"):
+            add_assign_targets(target.elts, lineno, definitions)
+
+
+def module_symbols(tree: Any, filename: str) -> ModuleSymbols:
+    """Extract the symbols of a parsed module.
+
+    Args:
+        tree: the `ast` or `gast` module
+        filename: the file of the module, used to get its name and
+            to resolve the relative imports
+
+    """
+    name = module_name(filename)
+    package = name
+    if Path(filename).name != "__init__.py":
+        package = name.rpartition(".")[0]
+    symbols = ModuleSymbols(name)
+    definitions = symbols.definitions
+    for node in getattr(tree, "body", []):
+        kind = node.__class__.__name__
+        if kind in _FUNCTIONS:
+            definitions[node.name] = SymbolDefinition(
+                "function", node.lineno, is_deprecated(node))
+        elif kind == "ClassDef":
+            definitions[node.name] = SymbolDefinition(
+                "class", node.lineno, is_deprecated(node))
+            for child in node.body:
+                if child.__class__.__name__ in _FUNCTIONS:
+                    definitions[f"{node.name}.{child.name}"] = \
+                        SymbolDefinition(
+                            "function", child.lineno, is_deprecated(child))
+        elif kind == "Assign":
+            add_assign_targets(node.targets, node.lineno, definitions)
+        elif kind == "AnnAssign":
+            add_assign_targets([node.target], node.lineno, definitions)
+        elif kind == "Import":
+            for alias in node.names:
+                if alias.asname:
+                    symbols.imports[alias.asname] = alias.name
+                else:
+                    head = alias.name.split(".")[0]
+                    symbols.imports[head] = head
+        elif kind == "ImportFrom":
+            source = resolve_import(
+                node.module or "", package, node.level or 0)
+            for alias in node.names:
+                if alias.name == "*":
+                    continue
+                symbols.imports[alias.asname or alias.name] = \
+                    f"{source}.{alias.name}" if source else alias.name
+    return symbols
+
+
+def symbols_from_txt(txt: str, filename: str) -> ModuleSymbols:
+    """Extract the symbols of a python source, empty if it can not
+    be parsed."""
+    try:
+        tree = ast.parse(txt, filename)
+    except (SyntaxError, ValueError):
+        return ModuleSymbols(module_name(filename))
+    return module_symbols(tree, filename)
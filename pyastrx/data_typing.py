@@ -3,9 +3,11 @@ stuff to deal with data typing.
 
 """
 import sys
-from dataclasses import dataclass, is_dataclass
+from array import array
+from dataclasses import dataclass, field, is_dataclass
 import json
-from typing import Dict, List, NewType, Tuple, Union, Any, Optional
+from typing import (
+    Dict, List, NamedTuple, NewType, Tuple, Union, Any, Optional)
 if sys.version_info[1] < 10:
     from typing_extensions import TypeAlias
 else:
@@ -30,6 +32,36 @@ class DataClassJSONEncoder(json.JSONEncoder):
 AXML: TypeAlias = Union[etree._Element, etree._ElementTree, bytes]
 
 
+@dataclass
+class SymbolDefinition:
+    """A definition of the module level or a method of a class.
+
+    Attributes:
+        kind: function, class or variable
+        lineno: line of the definition
+        deprecated: it has a `deprecated` decorator
+
+    """
+    kind: str
+    lineno: int
+    deprecated: bool = False
+
+
+@dataclass
+class ModuleSymbols:
+    """The symbols that a python module defines and imports.
+
+    Attributes:
+        module: the fully qualified name of the module
+        definitions: the definitions by name, methods as `Class.name`
+        imports: the fully qualified name bound to each imported name
+
+    """
+    module: str
+    definitions: Dict[str, SymbolDefinition] = field(default_factory=dict)
+    imports: Dict[str, str] = field(default_factory=dict)
+
+
 @dataclass
 class FileInfo:
     filename: str
@@ -37,6 +69,21 @@ class FileInfo:
     txt: str
     specification_name: str
     language: str
+    # offset of the beginning of each line in txt
+    line_offsets: "array[int]" = field(default_factory=lambda: array("I"))
+    # the AST was normalized with gast
+    normalize_ast: bool = True
+    # spans of the rules matched during the conversion, by xpath
+    fused_spans: Dict[str, List[Optional["Span"]]] = field(
+        default_factory=dict)
+    # module level symbols, see `pyastrx.axml.python.symbols`
+    symbols: Optional[ModuleSymbols] = None
+    # number of elements of each tag, empty until a search over the
+    # repo document counts them, see `pyastrx.search.repo_document`
+    tag_counts: Dict[str, int] = field(default_factory=dict)
+    # the types of its specification were inferred when the file was
+    # converted, see `Repo.should_infer`
+    inferred: bool = False
 
 
 @dataclass
@@ -52,10 +99,19 @@ class RuleInfo:
 RulesDict = NewType('RulesDict', Dict[str, RuleInfo])
 
 
+class Span(NamedTuple):
+    """The code location of a match."""
+    lineno: int
+    col_offset: int
+    end_lineno: int
+    end_col_offset: int
+
+
 @dataclass
 class Match:
     cols_by_line: Dict[int, List[int]]
     num_matches: int = 0
+    spans_by_line: Dict[int, List[Span]] = field(default_factory=dict)
 
 
 Expression2Match = NewType('Expression2Match', Dict[str, Match])
@@ -66,7 +122,8 @@ CodeContext = NewType('CodeContext', List[Tuple[int, str]])
 
 @dataclass
 class MatchesByLine:
-    code_context: CodeContext
+    # the code context is extracted only when a report needs it
+    code_context: Optional[CodeContext]
     match_by_expr: Expression2Match
 
 
@@ -85,10 +142,75 @@ class MatchParams:
     allow_dict: Union[Dict[str, List[str]], None] = None
 
 
+@dataclass
+class ExtensionStats:
+    """Counters of a `pyastrx:` xpath function.
+
+    Attributes:
+        calls: number of calls
+        seconds: time spent inside of the function
+
+    """
+    calls: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class SearchLimits:
+    """Grep-like limits that allow the search to stop early.
+
+    Attributes:
+        files_with_matches: only report which files have a match
+        first_match: stop at the first match of each file
+        count: only report the number of matches, no code context
+        max_matches: maximum number of matches per rule and file
+
+    """
+    files_with_matches: bool = False
+    first_match: bool = False
+    count: bool = False
+    max_matches: Optional[int] = None
+
+
 @dataclass
 class InferenceConfig:
+    """The `inference` block of pyastrx.yaml.
+
+    Attributes:
+        follow_imports: how mypy follows the imports of the inferred
+            files, see the `--follow-imports` option of mypy
+        modules: only the files of the modules matching these
+            patterns, e.g. `pkg.models.*`, are inferred. Empty to
+            infer all the files.
+        max_closure: maximum number of loaded files imported, directly
+            or not, by the inferred files. Over it mypy does not
+            follow the imports.
+
+    """
     what: Literal["pyre", "mypy"] = "pyre"
     run: bool = False
+    follow_imports: Literal["normal", "silent", "skip", "error"] = "normal"
+    modules: List[str] = field(default_factory=list)
+    max_closure: Optional[int] = None
+
+
+@dataclass
+class InferenceStats:
+    """The files of the inferences since the specifications were
+    loaded.
+
+    Attributes:
+        inferred: number of files sent to the inference engine
+        cached: number of files with their types in the cache
+        excluded: number of files outside of `InferenceConfig.modules`
+        skipped: the loaded files imported by the inferred files and
+            not followed, see `InferenceConfig.max_closure`
+
+    """
+    inferred: int = 0
+    cached: int = 0
+    excluded: int = 0
+    skipped: List[str] = field(default_factory=list)
 
 
 @dataclass
@@ -119,6 +241,9 @@ class Config:
     pagination: bool = True
     vscode_output: bool = False
     quiet: bool = False
+    ordered_output: bool = False
+    search_limits: SearchLimits = field(default_factory=SearchLimits)
+    watch: bool = False
 
 
 class PyreLoc(TypedDict):
@@ -4,7 +4,8 @@ The Command Line Interface for PyASTrix.
 
 """
 import argparse
-from typing import List
+from functools import partial
+from typing import Callable, List, Optional, Tuple
 from pathlib import Path
 import time
 
@@ -21,34 +22,89 @@ from pyastrx.data_typing import (
     RuleInfo,
     RulesDict,
     InferenceConfig,
+    SearchLimits,
     Specifications,
     Specification,
 )
 from pyastrx.frontend.manager import Manager
 from pyastrx.frontend.state_machine import Context, StartState
+from pyastrx.frontend.watch import WatchQueue
 from pyastrx.search.main import Repo
 
 
 class Handler(PatternMatchingEventHandler):
-    def __init__(self, manager: Manager):
+    """Send the paths of the events to a `WatchQueue`, its thread
+    processes them in batches.
+
+    Attributes:
+        reload_config: parse pyastrx.yaml again when it is modified
+
+    """
+    def __init__(
+        self, manager: Manager,
+        reload_config: Optional[
+            Callable[[], Tuple[Config, MatchParams, InferenceConfig]]
+        ] = None,
+    ):
         self.manager = manager
+        self.reload_config = reload_config
         patterns = ["*.yaml", "*.py"]
         super().__init__(patterns=patterns, ignore_directories=True)
-        self.last_event_time = time.time()
+        self.queue = WatchQueue(self.process)
 
     def on_modified(self, event):
-        if time.time() - self.last_event_time < 1:
+        if event.event_type == "moved":
+            self.queue.put(event.src_path, event.dest_path)
             return
-        self.last_event_time = time.time()
+        self.queue.put(event.src_path)
 
+    on_created = on_modified
+    on_deleted = on_modified
+    on_moved = on_modified
+
+    def process(self, files: List[str], cancelled: Callable[[], bool]):
         rprint("=======================================")
-        rprint(f"[green]Modified {event.src_path}[/green]")
+        if len(files) == 1:
+            rprint(f"[green]Modified {files[0]}[/green]")
+        else:
+            rprint(f"[green]Modified {len(files)} files[/green]")
         rprint(f"When: {time.ctime(time.time())}")
         rprint("======================================= \n")
-        self.manager.load_specitications()
-        self.manager.search()
+        if any(Path(file).name == "pyastrx.yaml" for file in files):
+            files = [f for f in files if Path(f).name != "pyastrx.yaml"]
+            if self.reload_config is None:
+                self.manager.load_specitications()
+                self.manager.search()
+                return
+            try:
+                config, match_params, inference = self.reload_config()
+            except (yaml.YAMLError, ValueError, TypeError, KeyError) as e:
+                rprint(f"[red]Invalid pyastrx.yaml, the rules were not reloaded: {e}[/red]")  # noqa
+            else:
+                # only the new and modified rules are evaluated
+                self.manager.reload_config(config, match_params, inference)
+            if len(files) == 0:
+                return
+        # only the changed files are loaded and searched again
+        self.manager.update_files(files, cancelled)
+
+
+def reload_config(
+    args: argparse.Namespace
+) -> Tuple[Config, MatchParams, InferenceConfig]:
+    """Parse pyastrx.yaml again, e.g. in the watch mode.
+
+    Returns:
+        The config of the search, the match params and the inference
+        config
 
-    on_created = on_modified
+    """
+    yaml_config = get_config_from_yaml()
+    return (
+        config_from_yaml(yaml_config, args),
+        MatchParams(**yaml_config.get("match_params", {})),
+        InferenceConfig(**yaml_config.get("inference", {})),
+    )
 
 
 def multiLine2line(multi_line_xpath: str) -> str:
@@ -154,6 +210,58 @@ def construct_base_argparse() -> argparse.ArgumentParser:
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "--ordered",
+        help="print the files in the order they were loaded instead of"
+        + " as soon as their search finishes",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--files-with-matches",
+        help="only print the names of the files with at least one match",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--first-match",
+        help="stop searching a file after its first match",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--count",
+        help="only print the number of matches of each file",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--max-matches",
+        help="maximum number of matches of each rule in a file",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--fused",
+        help="match the simple rules while the python files are"
+        + " converted to xml, the other rules are searched as usual",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--backend",
+        help="xml converts the python files to xml and searches with"
+        + " lxml, ast evaluates the rules directly over the python AST",
+        choices=["xml", "ast"],
+        default="xml",
+    )
+    parser.add_argument(
+        "--extension-stats",
+        help="count the calls and the time of the pyastrx: xpath"
+        + " functions and print them after the search",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "--expr",
         help="search expression",
@@ -206,9 +314,10 @@ def get_extensions_from_spec(lang_spec: str) -> List[str]:
         )  # noqa
 
 
-def invoke_pyastrx(args: argparse.Namespace) -> None:
+def config_from_yaml(yaml_config: dict, args: argparse.Namespace) -> Config:
+    """Create the config of the search from pyastrx.yaml and the
+    command line arguments."""
     rules: RulesDict
-    yaml_config = get_config_from_yaml()
     config = {}
     for k, v in yaml_config.items():
         if k not in __default_conf:
@@ -271,6 +380,7 @@ def invoke_pyastrx(args: argparse.Namespace) -> None:
 
     if args.no_interface or args.watch:
         config["interactive"] = False
+    config["watch"] = args.watch
 
     if "vscode_output" in yaml_config:
         config["vscode_output"] = yaml_config["vscode_output"]
@@ -278,6 +388,14 @@ def invoke_pyastrx(args: argparse.Namespace) -> None:
     if args.vscode_output:
         config["vscode_output"] = True
 
+    config["ordered_output"] = args.ordered
+    config["search_limits"] = SearchLimits(
+        files_with_matches=args.files_with_matches,
+        first_match=args.first_match,
+        count=args.count,
+        max_matches=args.max_matches,
+    )
+
     rules = RulesDict(rules_dict)
 
     config["rules"] = rules
@@ -310,21 +428,36 @@ def invoke_pyastrx(args: argparse.Namespace) -> None:
         }
     )
     config["specifications"] = specfications
-    config_pyastrx = Config(**config)
+    return Config(**config)
+
+
+def invoke_pyastrx(args: argparse.Namespace) -> None:
+    yaml_config = get_config_from_yaml()
+    config_pyastrx = config_from_yaml(yaml_config, args)
+    rules = config_pyastrx.rules
     match_params = MatchParams(**yaml_config.get("match_params", {}))
 
     inference = InferenceConfig(**yaml_config.get("inference", {}))
 
     file_cache: bool = yaml_config.get("file_cache", True)
-    repo = Repo(match_params, inference, file_cache=file_cache)
+    repo = Repo(
+        match_params, inference, file_cache=file_cache,
+        fused_rules=rules if args.fused else None,
+        backend=args.backend,
+        profile_extensions=args.extension_stats,
+        # the interactive mode can search any expression
+        inference_rules=None if config_pyastrx.interactive else rules,
+    )
     if not config_pyastrx.interactive or args.watch:
         manager = Manager(config_pyastrx, repo)
         manager.load_specitications()
         num_matches = manager.search()[0]
         if args.watch:
-            event_handler = Handler(manager)
+            event_handler = Handler(
+                manager, partial(reload_config, args=args))
             observer = Observer()
             observer.schedule(event_handler, path=".", recursive=True)
+            event_handler.queue.start()
             observer.start()
             try:
                 while True:
@@ -332,6 +465,7 @@ def invoke_pyastrx(args: argparse.Namespace) -> None:
             except KeyboardInterrupt:
                 observer.stop()
             observer.join()
+            event_handler.queue.stop()
         elif config_pyastrx.linter:
             exit_code = 1 if num_matches > 0 else 0
             exit(exit_code)
@@ -1,11 +1,17 @@
 import json
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from functools import partial
+from typing import (
+    Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union)
 
 from rich import print as rprint
 from pyastrx.data_typing import (
+    CodeContext,
     Config,
     Files2Matches,
+    InferenceConfig,
+    Lines2Matches,
+    MatchParams,
     RuleInfo,
     RulesDict,
     DataClassJSONEncoder,
@@ -13,16 +19,24 @@ from pyastrx.data_typing import (
 from pyastrx.report import humanize as humanized_report
 from pyastrx.report.stdout import rich_paging
 from pyastrx.search.main import Repo
+from pyastrx.search.xml_search import merge_by_line
+from pyastrx.xml.xpath_extensions import __all_lxml_ext__
 
 from dataclasses import dataclass
 
 
+class SearchCancelled(Exception):
+    """The search was superseded by newer changes of the files."""
+
+
 @dataclass
 class MatchNode:
     match_str: str
     context: str
     line: int
     col: int
+    end_line: int = 0
+    end_col: int = 0
 
 
 @dataclass
@@ -31,71 +45,91 @@ class FileNode:
     match: Union[MatchNode, None] = None
 
 
-def matches2vscode_ext(rules, file2matches, filter_rules):
-    rules_infos = {
-        k: v.__dict__
-        for k, v in rules.items() if filter_rules[k] > 0}
-    rule_map = {k: i for i, k in enumerate(rules_infos.keys())}
-    files2save = {
-        file: v.matches
-        for file, v in file2matches.items()
-        if len(v.num_matches_by_expr) > 0
-    }
-    rule_nodes = [
-        {
+def vscode_rule_nodes(rules: RulesDict) -> Dict[str, Dict[str, Any]]:
+    """Create the rule nodes of the VSCode extension output.
+
+    The files are appended later, one by one, through
+    add_vscode_file_matches.
+
+    """
+    return {
+        expr: {
             "expression": expr,
-            "name": rule_info["name"],
-            "severity": rule_info["severity"],
-            "description": rule_info["description"],
-            "why": rule_info["why"],
-            "use_in_linter": rule_info["use_in_linter"],
+            "name": rule_info.name,
+            "severity": rule_info.severity,
+            "description": rule_info.description,
+            "why": rule_info.why,
+            "use_in_linter": rule_info.use_in_linter,
             "files": [],
             "rules": [],
         }
-        for expr, rule_info in rules_infos.items()
-    ]
-
-    for (file_name, matches_by_file) in files2save.items():
-        for (line_number_str, matches_by_line) in matches_by_file.items():
-            line_number = int(line_number_str)
-            code_context = matches_by_line.code_context
-            match_by_expr = matches_by_line.match_by_expr
-            for (expr, match_pos) in match_by_expr.items():
-                rule_id = rule_map.get(expr)
-                matchNode = MatchNode(
-                    match_str="",
-                    context="",
-                    line=0,
-                    col=0,
-                )
+        for expr, rule_info in rules.items()
+    }
 
-                fileNode = FileNode(
-                    file=file_name,
-                    match=matchNode,
-                )
-                context = ""
-                match_str = ""
-                cols = match_pos.cols_by_line[line_number]
-                # iterate over code_contexy Array and
-                for line_number_ctx, line_code in code_context:
-                    context += line_code + "\n"
-                    if line_number != line_number_ctx:
-                        continue
-                    match_str = line_code
-                    lenLine = len(line_code)
-                    carrets = " " * lenLine
-                    for j in range(len(cols)):
-                        carrets = carrets[: cols[j]] + "^" + carrets[cols[j] + 1 :] # noqa
-                    context += carrets + "\n"
-
-                fileNode.match.match_str = match_str
-                fileNode.match.context = context
-                fileNode.match.line = line_number
-                fileNode.match.col = cols[0]
-                # convert all dataclass to dict
-                if rule_id is not None:
-                    rule_nodes[rule_id]["files"].append(fileNode.__dict__)
-    return rule_nodes
+
+def add_vscode_file_matches(
+        rule_nodes: Dict[str, Dict[str, Any]],
+        file_name: str, line2matches: Lines2Matches,
+        context_of: Optional[Callable[[int], CodeContext]] = None) -> None:
+    """Append the matches of a file to the VSCode rule nodes."""
+    if len(line2matches.num_matches_by_expr) == 0:
+        return
+    for (line_number_str, matches_by_line) in line2matches.matches.items():
+        line_number = int(line_number_str)
+        code_context = matches_by_line.code_context
+        if code_context is None:
+            code_context = CodeContext([])
+            if context_of is not None:
+                code_context = context_of(line_number)
+        match_by_expr = matches_by_line.match_by_expr
+        for (expr, match_pos) in match_by_expr.items():
+            matchNode = MatchNode(
+                match_str="",
+                context="",
+                line=0,
+                col=0,
+            )
+
+            fileNode = FileNode(
+                file=file_name,
+                match=matchNode,
+            )
+            context = ""
+            match_str = ""
+            cols = match_pos.cols_by_line[line_number]
+            # iterate over code_contexy Array and
+            for line_number_ctx, line_code in code_context:
+                context += line_code + "\n"
+                if line_number != line_number_ctx:
+                    continue
+                match_str = line_code
+                lenLine = len(line_code)
+                carrets = " " * lenLine
+                for j in range(len(cols)):
+                    carrets = carrets[: cols[j]] + "^" + carrets[cols[j] + 1 :] # noqa
+                context += carrets + "\n"
+
+            matchNode.match_str = match_str
+            matchNode.context = context
+            matchNode.line = line_number
+            matchNode.col = cols[0]
+            spans = match_pos.spans_by_line.get(line_number, [])
+            if len(spans) > 0:
+                matchNode.end_line = spans[0].end_lineno
+                matchNode.end_col = spans[0].end_col_offset
+            # convert all dataclass to dict
+            if expr in rule_nodes:
+                rule_nodes[expr]["files"].append(fileNode.__dict__)
+
+
+def matches2vscode_ext(
+        rules: RulesDict, file2matches: Files2Matches,
+        filter_rules: Dict[str, int]) -> List[Dict[str, Any]]:
+    rule_nodes = vscode_rule_nodes(RulesDict({
+        k: v for k, v in rules.items() if filter_rules[k] > 0}))
+    for file_name, line2matches in file2matches.items():
+        add_vscode_file_matches(rule_nodes, file_name, line2matches)
+    return list(rule_nodes.values())
 
 
 class Manager:
@@ -105,6 +139,11 @@ class Manager:
         self._expression = ""
         self._current_rule: RulesDict = RulesDict({})
         self.selected_rules: List[str] = []
+        # the matches of the previous searches in the watch mode
+        self.results: Dict[str, Lines2Matches] = {}
+        self._retained_rules: Tuple[str, ...] = ()
+        # the files whose retained matches are outdated
+        self._stale: Dict[str, None] = {}
 
     @property
     def expression(self) -> str:
@@ -120,13 +159,22 @@ class Manager:
     def set_xpath_selection(self, xpath_keys: List[str]) -> None:
         self.selected_rules = xpath_keys
 
+    def expression_rules(self, xpath: str) -> RulesDict:
+        """The rule of an expression. A new expression without a
+        `[specification]` mark is searched in all the files, as the
+        expressions of the command line."""
+        if xpath in self.config.rules.keys():
+            return RulesDict({xpath: self.config.rules[xpath]})
+        for name in self.config.specifications:
+            if xpath.startswith(f"[{name}]"):
+                return RulesDict({xpath: RuleInfo(specification_name=name)})
+        return RulesDict({
+            f"[inline]{xpath}": RuleInfo(specification_name="inline")})
+
     def set_rule(self, xpath: str) -> bool:
         self.expression = xpath
-        if xpath in self.config.rules.keys():
-            self._current_rule = RulesDict({xpath: self.config.rules[xpath]})
-            return True
-        self._current_rule = RulesDict({xpath: RuleInfo()})
-        return False
+        self._current_rule = self.expression_rules(xpath)
+        return xpath in self.config.rules.keys()
 
     def get_current_rules(self) -> RulesDict:
         if self._expression:
@@ -168,59 +216,270 @@ class Manager:
     def is_folder(self) -> bool:
         return len(self.repo.get_files()) > 1
 
-    def search(self) -> Tuple[int, Dict[int, Tuple[str, str]], Dict[str, int]]:
-        rules = self.get_current_rules()
-        is_unique_file = self.is_unique_file()
+    def iter_matches(
+            self, rules: RulesDict) -> Iterator[Tuple[str, Lines2Matches]]:
         config = self.config
-        num_matches = 0
-        str_by_file = {}
-        parent_folder = Path(".").resolve()
-        filter_rules = {k: 0 for k in rules.keys()}
-        file2matches: Files2Matches
-        if is_unique_file:
+        if self.is_unique_file():
             file = self.repo.get_file()
             line2matches = self.repo.search_file(
                 file,
                 rules,
-                before_context=config.before_context,
-                after_context=config.after_context,
+                limits=config.search_limits,
             )
-            file2matches = Files2Matches({file: line2matches})
+            yield file, line2matches
+            return
+        # the interactive mode needs a stable order to select the files
+        ordered = config.ordered_output or config.interactive
+        yield from self.repo.iter_search(
+            rules,
+            parallel=config.parallel,
+            limits=config.search_limits,
+            ordered=ordered,
+        )
 
-        else:
-            file2matches = self.repo.search_files(
-                rules,
-                before_context=config.before_context,
-                after_context=config.after_context,
-                parallel=config.parallel,
-            )
+    def iter_retained(
+        self, rules: RulesDict, files: Optional[List[str]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[Tuple[str, Lines2Matches]]:
+        """Search the rules only in the files and merge their matches
+        with the ones retained from the previous searches. All the
+        loaded files are searched the first time or if the rules
+        changed.
+
+        Args:
+            cancelled: checked after each file, the files not searched
+                yet are searched by the next call.
+
+        Yields:
+            The retained matches in the order of the loaded files
+
+        Raises:
+            SearchCancelled: if cancelled returns True
+
+        """
+        config = self.config
+        if files is None or tuple(rules) != self._retained_rules:
+            self.results = {}
+            self._stale = {}
+            self._retained_rules = tuple(rules)
+            files = self.repo.get_files()
+        self._stale.update(dict.fromkeys(files))
+        for file in self._stale:
+            self.results.pop(file, None)
+        loaded = [file for file in self._stale if file in self.repo.cache]
+        if cancelled is not None and cancelled():
+            raise SearchCancelled()
+        for file, line2matches in self.repo.iter_search(
+            rules,
+            parallel=config.parallel and len(loaded) > 1,
+            limits=config.search_limits,
+            files=loaded,
+        ):
+            del self._stale[file]
+            if len(line2matches.matches) > 0:
+                self.results[file] = line2matches
+            if cancelled is not None and cancelled():
+                raise SearchCancelled()
+        self._stale = {}
+        for file in self.repo.get_files():
+            if file in self.results:
+                yield file, self.results[file]
+
+    def update_files(
+        self, files: List[str],
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Tuple[int, Dict[int, Tuple[str, str]], Dict[str, int]]:
+        """Load again the modified files and search the rules only in
+        them, and in the files whose matches depend on them, see
+        `Repo.reload_files`. The report has all the retained matches.
+
+        Raises:
+            SearchCancelled: if cancelled returns True before the
+                search finishes, see `iter_retained`
+
+        """
+        rules = self.get_current_rules()
+        # the files stay stale until they are searched, the files of a
+        # batch that failed to load are loaded again with the next one
+        self._stale.update(dict.fromkeys(files))
+        affected = self.repo.reload_files(list(self._stale))
+        affected.extend(self.repo.get_symbol_dependents(affected, rules))
+        return self.search(affected, cancelled)
+
+    def reload_config(
+        self, config: Config,
+        match_params: Optional[MatchParams] = None,
+        inference: Optional[InferenceConfig] = None,
+    ) -> Tuple[int, Dict[int, Tuple[str, str]], Dict[str, int]]:
+        """Use the rules of a new config, e.g. after pyastrx.yaml was
+        edited in the watch mode, and report the matches.
+
+        Only the new and modified rules are evaluated over the loaded
+        files, the matches of the removed rules are dropped. The files
+        are loaded again and searched with all the rules if the
+        specifications or the inference config changed, if the types of
+        another specification must be inferred or if the grep-like
+        limits relate the rules. All the rules are searched again if
+        the lists of the match params changed.
+
+        Args:
+            match_params: the new lists, None keeps the current ones
+            inference: the new inference config, None keeps the
+                current one
+
+        """
+        specifications_changed = \
+            config.specifications != self.config.specifications
+        limits = config.search_limits
+        self.config = config
+        rules = self.get_current_rules()
+        lists_changed = False
+        if match_params is not None \
+                and match_params != self.repo.match_params:
+            self.repo.set_match_params(match_params)
+            lists_changed = True
+        inferred: Set[str] = set()
+        if inference is not None and inference != self.repo.inference:
+            inferred = self.repo.set_inference(inference)
+        inferred |= self.repo.set_inference_rules(rules)
+        if specifications_changed or len(inferred) > 0 \
+                or limits.first_match or limits.files_with_matches:
+            self.repo.forget_specifications(inferred)
+            self.load_specitications()
+            return self.search()
+        if lists_changed:
+            # the matches of any retained rule may depend on the lists
+            return self.search()
+
+        added = RulesDict({
+            expression: rule_info for expression, rule_info in rules.items()
+            if expression not in self._retained_rules})
+        searched: Dict[str, Lines2Matches] = {}
+        if len(added) > 0:
+            loaded = [
+                file for file in self.repo.get_files()
+                if file not in self._stale]
+            searched = dict(self.repo.iter_search(
+                added,
+                parallel=config.parallel and len(loaded) > 1,
+                limits=limits,
+                files=loaded,
+            ))
+        expressions = list(rules)
+        for file in set(self.results) | set(searched):
+            line2matches = merge_by_line(
+                [m for m in (self.results.get(file), searched.get(file))
+                 if m is not None],
+                expressions)
+            self.results.pop(file, None)
+            if len(line2matches.matches) > 0:
+                self.results[file] = line2matches
+        self._retained_rules = tuple(rules)
+        return self.search([])
+
+    def search(
+        self, files: Optional[List[str]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Tuple[int, Dict[int, Tuple[str, str]], Dict[str, int]]:
+        """Search the current rules and report their matches.
+
+        Args:
+            files: in the watch mode, the files to search again, see
+                `iter_retained`. None searches all the loaded files.
+            cancelled: in the watch mode, stops the search before the
+                report, see `iter_retained`
+
+        """
+        rules = self.get_current_rules()
+        config = self.config
+        num_matches = 0
+        str_by_file = {}
+        parent_folder = Path(".").resolve()
+        filter_rules = {k: 0 for k in rules.keys()}
+        limits = config.search_limits
+        # outside of the interactive mode each file is printed as soon
+        # as its search finishes, nothing is accumulated
+        stream = not config.interactive
+        # the linter only needs to know if there is any match
+        stop_at_first = config.linter and config.quiet \
+            and not config.vscode_output
+        rule_nodes = None
+        if config.vscode_output:
+            rule_nodes = vscode_rule_nodes(rules)
 
         output_str = ""
-        for i, (file, line2matches) in enumerate(file2matches.items()):
+        matches = self.iter_matches(rules)
+        if config.watch:
+            matches = self.iter_retained(rules, files, cancelled)
+        for i, (file, line2matches) in enumerate(matches):
             if len(line2matches.matches) == 0:
                 continue
             for expr in line2matches.num_matches_by_expr.keys():
                 filter_rules[expr] += line2matches.num_matches_by_expr[expr]
-            output_str_file, num_matches_file = humanized_report.matches_by_filename( # noqa
-                line2matches, file, rules
+            context_of = partial(
+                self.repo.get_code_context,
+                file,
+                before_context=config.before_context,
+                after_context=config.after_context,
             )
-            if num_matches_file > 0:
-                str_by_file[i] = (
-                    str(Path(file).relative_to(parent_folder)),
-                    output_str_file,
+            if rule_nodes is not None:
+                add_vscode_file_matches(
+                    rule_nodes, file, line2matches, context_of)
+            if limits.files_with_matches:
+                output_str_file, num_matches_file = humanized_report.filename_with_matches( # noqa
+                    line2matches, str(Path(file).relative_to(parent_folder))
+                )
+            elif limits.count:
+                output_str_file, num_matches_file = humanized_report.count_by_filename( # noqa
+                    line2matches, str(Path(file).relative_to(parent_folder))
+                )
+            else:
+                output_str_file, num_matches_file = humanized_report.matches_by_filename( # noqa
+                    line2matches, file, rules, context_of
                 )
-                num_matches += num_matches_file
-                output_str += output_str_file
+            if num_matches_file == 0:
+                continue
+            num_matches += num_matches_file
+            if stream:
+                str_by_file[i] = (
+                    str(Path(file).relative_to(parent_folder)), "")
+                if not config.quiet:
+                    rprint(output_str_file, end="")
+                if stop_at_first:
+                    break
+                continue
+            str_by_file[i] = (
+                str(Path(file).relative_to(parent_folder)),
+                output_str_file,
+            )
+            output_str += output_str_file
+        if not config.quiet:
+            fallbacks = self.repo.get_fallback_rules(rules)
+            for expression, reason in fallbacks.items():
+                rprint(
+                    f"[yellow]{expression} was evaluated with lxml:"
+                    + f" {reason}[/yellow]")
+            skipped = self.repo.inference_stats.skipped
+            if len(skipped) > 0:
+                rprint(
+                    f"[yellow]The imports of {len(skipped)} files were"
+                    + " not followed by the inference, see"
+                    + " max_closure[/yellow]")
+            for method_name, stats in self.repo.extension_stats.items():
+                rprint(
+                    f"pyastrx:{__all_lxml_ext__[method_name]}:"
+                    + f" {stats.calls} calls, {stats.seconds:.3f}s")
         # save json_data to
-        if config.vscode_output:
-            json_data = matches2vscode_ext(rules, file2matches, filter_rules)
+        if rule_nodes is not None:
+            json_data = [
+                node for node in rule_nodes.values()
+                if filter_rules[node["expression"]] > 0
+            ]
             with open(Path(".pyastrx/results.json").resolve(), "w") as f:
                 json.dump(json_data, f, cls=DataClassJSONEncoder)
 
         num_files = len(str_by_file)
-        if not config.interactive:
-            if not config.quiet:
-                rprint(output_str)
+        if stream:
             return num_matches, str_by_file, filter_rules
 
         interactive_files = config.interactive_files and num_files > 1
@@ -5,9 +5,117 @@ in the command line.
 
 """
 import argparse
+import json
+import math
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, cast
+
 from rich import print as rprint
 
-from pyastrx.inference.mypy import infer_types as infer_types_mypy
+from pyastrx.axml.python.symbols import symbols_from_txt
+from pyastrx.data_typing import (
+    InferenceConfig,
+    ModuleSymbols,
+    MypyInferFileResult,
+    MypyType,
+)
+from pyastrx.inference.cache import (
+    InferenceCache,
+    inference_keys,
+    reverse_dependencies,
+    source_digest,
+)
+from pyastrx.inference.mypy import (
+    MypySession,
+    infer_chunk,
+    init_infer_worker,
+)
+from pyastrx.inference.normalization import mypy2astrx
+
+# maximum number of files sent at once to a worker
+MAX_CHUNK_FILES = 16
+
+
+def iter_chunks(files: List[str], jobs: int) -> Iterator[List[str]]:
+    """Split the files in chunks of at most MAX_CHUNK_FILES files, at
+    least one chunk per job. The files of a chunk are kept in order,
+    the neighbour files usually import each other."""
+    size = min(MAX_CHUNK_FILES, math.ceil(len(files) / jobs))
+    for start in range(0, len(files), size):
+        yield files[start:start + size]
+
+
+def iter_workers(
+    files: List[str], jobs: int
+) -> Iterator[MypyInferFileResult]:
+    """Infer the chunks of files in pool workers, the results of each
+    chunk are yielded as soon as it finishes."""
+    with Pool(jobs, initializer=init_infer_worker) as pool:
+        for chunk in pool.imap_unordered(
+                infer_chunk, iter_chunks(files, jobs)):
+            yield from chunk
+
+
+def iter_query(
+    files: List[str],
+    jobs: int = 1,
+    cache: Optional[InferenceCache] = None,
+) -> Iterator[MypyInferFileResult]:
+    """Yield the types of each file as soon as they are available.
+
+    The types found in the cache are yielded first, the files
+    importing a file missing from the cache are inferred again, see
+    `reverse_dependencies`. With several jobs the files are sent in
+    chunks to pool workers, each worker keeps its own mypy build.
+
+    Args:
+        files: the files to infer
+        jobs: number of worker processes
+        cache: the pyastrx inference cache, the new types are stored
+
+    """
+    missing = files
+    keys: Dict[str, str] = {}
+    if cache is not None:
+        digests: Dict[str, str] = {}
+        symbols: Dict[str, ModuleSymbols] = {}
+        for filename in files:
+            txt = Path(filename).read_text(encoding="utf-8")
+            digests[filename] = source_digest(txt)
+            symbols[filename] = symbols_from_txt(txt, filename)
+        # the mypy builds of mypyq follow the imports normally
+        keys = inference_keys(files, dict(symbols), digests, "normal")
+        missing = [
+            filename for filename in files
+            if cache.get(keys[filename]) is None]
+        inferred = set(missing) | reverse_dependencies(missing, symbols)
+        for filename in files:
+            types = cache.get(keys[filename])
+            if filename not in inferred and types is not None:
+                yield {
+                    "path": filename,
+                    "types": cast(List[MypyType], types)}
+        missing = [filename for filename in files if filename in inferred]
+    if len(missing) == 0:
+        return
+
+    results: Iterator[MypyInferFileResult]
+    if jobs <= 1:
+        cache_dir = None
+        if cache is not None:
+            # the same mypy cache as the one of the pyastrx searches
+            cache_dir = str(Path(
+                f".pyastrx/mypy_cache/{cache.engine[:16]}/normal"
+            ).resolve())
+        results = MypySession(cache_dir).iter_types(missing)
+    else:
+        results = iter_workers(missing, jobs)
+    for result in results:
+        if cache is not None:
+            cache.set(keys[result["path"]], mypy2astrx(result["types"]))
+        yield result
 
 
 def mypy_query() -> None:
@@ -26,17 +134,46 @@ def mypy_query() -> None:
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--jsonl",
+        help="Print a json line with the types of each file as soon as"
+        + " they are extracted, in any order",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of worker processes, each one with its own mypy build",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Do not read nor write the pyastrx inference cache",
+        action="store_true",
+        default=False,
+    )
     args = parser.parse_args()
     files = args.files
-    query_results, success = infer_types_mypy(files)
-    if not success:
+    cache = None
+    if not args.no_cache:
+        cache = InferenceCache(InferenceConfig(what="mypy", run=True))
+    query_results = iter_query(files, args.jobs, cache)
+
+    if args.jsonl:
+        for result in query_results:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
         return
 
+    order = {filename: i for i, filename in enumerate(files)}
+    results = sorted(query_results, key=lambda r: order[r["path"]])
     if args.raw_output:
-        print(query_results)
+        print(results)
         return
 
-    for result in query_results:
+    for result in results:
         rprint(result["path"])
         rprint(result["types"])
 
@@ -0,0 +1,198 @@
+"""Live preview of a xpath expression while it is typed.
+
+The expression is evaluated in a background thread over the trees of
+the loaded files, parsed the first time and kept between the
+evaluations. Each keystroke cancels the evaluation of the previous
+text, which is checked between the files, and the evaluation only
+starts once the text did not change during a debounce period. The
+running count and the first matches are shown in the bottom toolbar
+of the prompt, see `LivePreview.toolbar`.
+
+"""
+import threading
+import time
+from dataclasses import replace
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+
+from pyastrx.axml.python.ast2xml import txt2axml
+from pyastrx.data_typing import FileInfo
+from pyastrx.frontend.manager import Manager
+from pyastrx.search.xml_search import create_extensions, search_in_file_info
+from pyastrx.xml.xpath_extensions import __lxml_namespaces__
+
+# number of matches shown by the preview
+PREVIEW_MATCHES = 5
+# seconds without keystrokes before the text is evaluated
+DEBOUNCE = 0.15
+
+
+class LivePreview:
+    """Evaluate the text of a prompt in a background thread.
+
+    Attributes:
+        matches: the first matches of the last text, by file and line
+        num_matches: number of matches found so far
+        num_files: number of files with matches found so far
+        searched: number of files searched so far
+        error: the syntax or evaluation error of the text, empty if
+            it is valid
+        running: True until the last text is evaluated
+
+    """
+    def __init__(
+        self, manager: Manager,
+        max_matches: int = PREVIEW_MATCHES, debounce: float = DEBOUNCE,
+    ) -> None:
+        self.manager = manager
+        self.max_matches = max_matches
+        self.debounce = debounce
+        self.matches: List[Tuple[str, int]] = []
+        self.num_matches = 0
+        self.num_files = 0
+        self.searched = 0
+        self.error = ""
+        self.running = False
+        # the trees of the files, kept while their info is loaded
+        self._trees: Dict[str, Tuple[FileInfo, etree._ElementTree]] = {}
+        self._text: Optional[str] = None
+        self._generation = 0
+        self._last_update = 0.0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, text: str) -> None:
+        """Evaluate a new text, the current evaluation is cancelled."""
+        with self._condition:
+            self._generation += 1
+            self._text = text
+            self._last_update = time.monotonic()
+            self.running = True
+            self._condition.notify()
+
+    def cancel(self) -> None:
+        """Cancel the current evaluation, e.g. when the prompt ends."""
+        with self._condition:
+            self._generation += 1
+            self._text = None
+            self.running = False
+
+    def cancelled(self, generation: int) -> bool:
+        return generation != self._generation
+
+    def tree(self, info: FileInfo) -> etree._ElementTree:
+        """The xml of a file, parsed the first time."""
+        cached = self._trees.get(info.filename)
+        if cached is not None and cached[0] is info:
+            return cached[1]
+        axml = info.axml
+        if isinstance(axml, bytes) and len(axml) == 0:
+            # loaded by the AST backend
+            tree = txt2axml(
+                info.txt, info.filename, info.normalize_ast).getroottree()
+        elif isinstance(axml, bytes):
+            tree = etree.parse(BytesIO(axml))
+        elif isinstance(axml, etree._ElementTree):
+            tree = axml
+        else:
+            tree = axml.getroottree()
+        self._trees[info.filename] = (info, tree)
+        return tree
+
+    def _take_text(self) -> Tuple[str, int]:
+        with self._condition:
+            while True:
+                if self._text is None:
+                    self._condition.wait()
+                    continue
+                remaining = \
+                    self._last_update + self.debounce - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                text = self._text
+                self._text = None
+                return text, self._generation
+
+    def _run(self) -> None:
+        while True:
+            text, generation = self._take_text()
+            try:
+                self.evaluate(text, generation)
+            except Exception as e:
+                # e.g. a list function without its list in pyastrx.yaml,
+                # the thread is kept for the next texts
+                if not self.cancelled(generation):
+                    self.error = " ".join(str(e).split()) \
+                        or type(e).__name__
+            finally:
+                with self._condition:
+                    if not self.cancelled(generation):
+                        self.running = False
+
+    def evaluate(self, text: str, generation: int) -> None:
+        """Search the text in the loaded files, stops as soon as a
+        newer text arrives."""
+        self.matches = []
+        self.num_matches = 0
+        self.num_files = 0
+        self.searched = 0
+        self.error = ""
+        text = text.strip()
+        if len(text) == 0:
+            return
+        rules = self.manager.expression_rules(text)
+        expression = list(rules)[0]
+        xpath = expression[expression.index("]") + 1:] \
+            if expression.startswith("[") else expression
+        try:
+            etree.XPath(xpath, namespaces=__lxml_namespaces__)
+        except etree.XPathSyntaxError as e:
+            self.error = f"Invalid expression: {e}"
+            return
+        repo = self.manager.repo
+        extensions = create_extensions(
+            repo.match_params, rules, symbols=repo.get_symbol_index(rules))
+        for filename in repo.get_files():
+            if self.cancelled(generation):
+                return
+            info = repo.cache.get(filename)
+            line2matches = search_in_file_info(
+                replace(info, axml=self.tree(info)), rules,
+                repo.match_params, extensions=extensions)
+            self.searched += 1
+            num_matches = sum(line2matches.num_matches_by_expr.values())
+            if num_matches == 0:
+                continue
+            self.num_matches += num_matches
+            self.num_files += 1
+            for line in line2matches.matches:
+                if len(self.matches) >= self.max_matches:
+                    break
+                self.matches.append((filename, line))
+
+    def toolbar(self) -> str:
+        """The running count and the first matches of the text."""
+        if self.error:
+            return self.error
+        repo = self.manager.repo
+        total = len(repo.get_files())
+        lines = [
+            f"{self.num_matches} matches in {self.num_files} files"
+            + f" ({self.searched}/{total} files searched)"
+            + (" ..." if self.running else "")]
+        parent_folder = Path(".").resolve()
+        for filename, line in list(self.matches):
+            code = repo.get_code_context(filename, line)
+            code_line = code[0][1].strip() if len(code) > 0 else ""
+            path = Path(filename)
+            try:
+                path = path.relative_to(parent_folder)
+            except ValueError:
+                pass
+            lines.append(f"{path}:{line}: {code_line}")
+        return "\n".join(lines)
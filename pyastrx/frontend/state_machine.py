@@ -9,9 +9,10 @@ A image diagram of the state machine can be found in the
 """
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, List, Tuple, Type, Union
+from typing import Dict, List, Optional, Tuple, Type, Union
 from prompt_toolkit import PromptSession, prompt
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.completion import FuzzyWordCompleter
 from prompt_toolkit.filters import completion_is_selected, has_completions
 from prompt_toolkit.history import FileHistory
@@ -27,6 +28,7 @@ from pyastrx.config import _prompt_dialog_style
 from pyastrx.data_typing import Config
 from pyastrx.folder_utils import get_location_and_create
 from pyastrx.frontend.manager import Manager
+from pyastrx.frontend.preview import LivePreview
 from pyastrx.report.stdout import paging_lxml, rich_paging
 from pyastrx.search import Repo
 from pyastrx.xml.misc import el_lxml2str
@@ -146,6 +148,8 @@ class Context(Manager):
         # super init manager
         super().__init__(config, repo)
         self._search_interface: Type[StateInterface] = InterfaceMain
+        # the live preview of the new expressions, see InterfaceNewRule
+        self.preview: Optional[LivePreview] = None
         self.set_state(initial_state)
 
     @property
@@ -377,11 +381,26 @@ class InterfaceNewRule(StateInterface):
 
     def run(self) -> None:
         self.context.search_interface = InterfaceNewRule
+        if self.context.preview is None:
+            self.context.preview = LivePreview(self.context)
+        preview = self.context.preview
+        buffer = _PromptSessionExpr.default_buffer
+
+        def on_text_changed(buffer: Buffer) -> None:
+            preview.update(buffer.text)
+
+        buffer.on_text_changed += on_text_changed
         while True:
-            command = _PromptSessionExpr.prompt(
-                ":",
-                auto_suggest=AutoSuggestFromHistory()
-            )
+            try:
+                command = _PromptSessionExpr.prompt(
+                    ":",
+                    auto_suggest=AutoSuggestFromHistory(),
+                    bottom_toolbar=preview.toolbar,
+                    refresh_interval=0.1,
+                )
+            finally:
+                buffer.on_text_changed -= on_text_changed
+                preview.cancel()
             state: Type[State] = InterfaceMain
             if command == "q":
                 break
@@ -0,0 +1,100 @@
+"""The queue of the file system events of the watch mode.
+
+The events are coalesced in a set of pending paths. A background
+thread waits until no event arrives during a quiet period and
+processes all the pending paths at once, e.g. the files touched by a
+branch switch or a formatter. The events arriving while a batch is
+processed supersede it, the processing is cancelled and their paths
+are processed together with the files left by the cancelled batch, see
+`Manager.update_files`.
+
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from rich import print as rprint
+
+from pyastrx.frontend.manager import SearchCancelled
+
+# seconds without events before a batch is processed
+QUIET_PERIOD = 0.3
+
+
+class WatchQueue:
+    """The pending paths of the watch mode and the thread that
+    processes them.
+
+    Attributes:
+        process: called with the paths of each batch and a function
+            returning True once newer events supersede the batch. It
+            can raise `SearchCancelled` to stop, the other errors are
+            printed and the next batches are still processed.
+        quiet_period: seconds without events before a batch is taken
+
+    """
+    def __init__(
+        self,
+        process: Callable[[List[str], Callable[[], bool]], None],
+        quiet_period: float = QUIET_PERIOD,
+    ) -> None:
+        self.process = process
+        self.quiet_period = quiet_period
+        self._pending: Dict[str, None] = {}
+        self._last_event = 0.0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def put(self, *paths: str) -> None:
+        """Add the paths of an event, the quiet period starts again."""
+        with self._condition:
+            self._pending.update(dict.fromkeys(paths))
+            self._last_event = time.monotonic()
+            self._condition.notify()
+
+    def superseded(self) -> bool:
+        """True if some event arrived after the batch was taken."""
+        with self._condition:
+            return len(self._pending) > 0 or self._stopped
+
+    def take_batch(self) -> Optional[List[str]]:
+        """Wait for a quiet period and take all the pending paths,
+        None once the queue is stopped."""
+        with self._condition:
+            while not self._stopped:
+                if len(self._pending) == 0:
+                    self._condition.wait()
+                    continue
+                remaining = \
+                    self._last_event + self.quiet_period - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                batch = list(self._pending)
+                self._pending = {}
+                return batch
+            return None
+
+    def _run(self) -> None:
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            try:
+                self.process(batch, self.superseded)
+            except SearchCancelled:
+                continue
+            except Exception as e:
+                # e.g. a file saved with a syntax error, the thread is
+                # kept for the next events
+                rprint(f"[red]The changes were not processed: {e}[/red]")
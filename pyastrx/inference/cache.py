@@ -0,0 +1,242 @@
+"""A content-addressed cache of the normalized inference results.
+
+The types of a file are stored by the digest of the inference engine,
+see `engine_digest`, and the key of the file, see `inference_keys`:
+its path, its source, the sources of the files it imports and the mode
+used to follow the imports. The loaded files importing a modified
+module are also annotated again, see `reverse_dependencies`.
+
+"""
+import hashlib
+import pickle
+import shutil
+import subprocess
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from pyastrx.axml.python.symbols import symbols_from_txt
+from pyastrx.data_typing import ASTrXType, InferenceConfig, ModuleSymbols
+
+# the configuration files read by each engine
+CONFIG_FILES = {
+    "mypy": ["mypy.ini", ".mypy.ini", "pyproject.toml", "setup.cfg"],
+    "pyre": [".pyre_configuration"],
+}
+
+
+def source_digest(txt: str) -> str:
+    return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+
+def engine_version(what: str) -> str:
+    """The version of the inference engine, empty if unknown."""
+    if what == "mypy":
+        try:
+            from mypy.version import __version__
+        except ImportError:
+            return ""
+        return __version__
+    if shutil.which(what) is None:
+        return ""
+    process = subprocess.run(
+        [what, "--version"], capture_output=True, shell=False)
+    return process.stdout.decode("utf-8").strip()
+
+
+def engine_digest(inference: InferenceConfig) -> str:
+    """The digest of the engine, its version, the inference config
+    and the engine configuration files of the current folder."""
+    digest = hashlib.sha256()
+    digest.update(repr(inference).encode("utf-8"))
+    digest.update(engine_version(inference.what).encode("utf-8"))
+    for name in CONFIG_FILES.get(inference.what, []):
+        config_file = Path(name)
+        if config_file.is_file():
+            digest.update(name.encode("utf-8"))
+            digest.update(config_file.read_bytes())
+    return digest.hexdigest()
+
+
+def imports_module(symbols: ModuleSymbols, module: str) -> bool:
+    """True if the module may be imported by a file.
+
+    `import pkg.mod` only keeps `pkg`, therefore an import of a
+    package is considered an import of all its modules.
+
+    """
+    for imported in symbols.imports.values():
+        if imported == module or imported.startswith(f"{module}.") \
+                or module.startswith(f"{imported}."):
+            return True
+    return False
+
+
+def reverse_dependencies(
+    modified: Iterable[str], symbols: Dict[str, ModuleSymbols]
+) -> Set[str]:
+    """The files that import the modified files, directly or through
+    other files.
+
+    Args:
+        modified: the modified files
+        symbols: the symbols of each known file
+
+    """
+    pending = [symbols[f].module for f in modified if f in symbols]
+    seen = set(pending)
+    dependents: Set[str] = set()
+    while pending:
+        module = pending.pop()
+        for filename, file_symbols in symbols.items():
+            if filename in dependents \
+                    or not imports_module(file_symbols, module):
+                continue
+            dependents.add(filename)
+            if file_symbols.module not in seen:
+                seen.add(file_symbols.module)
+                pending.append(file_symbols.module)
+    return dependents
+
+
+def import_closure(
+    files: Iterable[str], symbols: Dict[str, ModuleSymbols]
+) -> Set[str]:
+    """The known files imported by the files, directly or through
+    other files, see `imports_module`."""
+    closure: Set[str] = set()
+    pending = [f for f in files if f in symbols]
+    while pending:
+        file_symbols = symbols[pending.pop()]
+        for filename, other in symbols.items():
+            if filename in closure \
+                    or not imports_module(file_symbols, other.module):
+                continue
+            closure.add(filename)
+            pending.append(filename)
+    return closure
+
+
+def package_root(filename: str, module: str) -> Path:
+    """The folder from which the module of a file is imported."""
+    path = Path(filename).resolve()
+    depth = len(module.split("."))
+    if path.name != "__init__.py":
+        depth -= 1
+    return path.parents[depth]
+
+
+def resolve_module(module: str, root: Path) -> Optional[str]:
+    """The file of an imported name under a folder, e.g.
+    `pkg/mod.py` for `pkg.mod.f`, None if it is not found there."""
+    parts = module.split(".")
+    while parts:
+        base = root.joinpath(*parts)
+        for candidate in (base.with_suffix(".py"), base / "__init__.py"):
+            if candidate.is_file():
+                return str(candidate)
+        parts.pop()
+    return None
+
+
+def inference_keys(
+    files: Iterable[str],
+    symbols: Dict[str, ModuleSymbols],
+    digests: Dict[str, str],
+    follow_imports: str,
+) -> Dict[str, str]:
+    """The keys of the types of the files in the inference cache.
+
+    The types of a file depend on its path, its source, the sources of
+    the files it imports, directly or through other files, and the mode
+    used to follow the imports. The imports are resolved under the
+    package root of each file. The files missing from `symbols` and
+    `digests` are read and added to them.
+
+    """
+    imported: Dict[str, Set[str]] = {}
+
+    def direct_imports(filename: str) -> Set[str]:
+        if filename in imported:
+            return imported[filename]
+        if filename not in symbols or filename not in digests:
+            txt = Path(filename).read_text(encoding="utf-8")
+            digests.setdefault(filename, source_digest(txt))
+            symbols.setdefault(filename, symbols_from_txt(txt, filename))
+        file_symbols = symbols[filename]
+        root = package_root(filename, file_symbols.module)
+        resolved = (
+            resolve_module(module, root)
+            for module in set(file_symbols.imports.values()))
+        imported[filename] = {
+            str(Path(f).resolve()) for f in resolved if f is not None}
+        return imported[filename]
+
+    keys = {}
+    for filename in files:
+        path = str(Path(filename).resolve())
+        closure = {path}
+        pending = [filename]
+        while pending:
+            for dependency in direct_imports(pending.pop()):
+                if dependency not in closure:
+                    closure.add(dependency)
+                    pending.append(dependency)
+        key = hashlib.sha256()
+        for part in (path, digests[filename], follow_imports):
+            key.update(f"{part}\n".encode("utf-8"))
+        for dependency in sorted(closure - {path}):
+            key.update(f"{dependency} {digests[dependency]}\n".encode(
+                "utf-8"))
+        keys[filename] = key.hexdigest()
+    return keys
+
+
+def in_modules(module: str, patterns: List[str]) -> bool:
+    """True if a module matches some pattern, e.g. `pkg.*`. Every
+    module matches an empty list."""
+    if len(patterns) == 0:
+        return True
+    return any(fnmatchcase(module, pattern) for pattern in patterns)
+
+
+class InferenceCache:
+    """The normalized types of each file by engine.
+
+    The types are kept in memory and, with `persist`, pickled in
+    `.pyastrx/inference/<engine digest>/<key>.pickle`, see
+    `inference_keys`.
+
+    """
+    def __init__(
+        self, inference: InferenceConfig, persist: bool = True
+    ) -> None:
+        self.engine = engine_digest(inference)
+        self.persist = persist
+        self._types: Dict[str, List[ASTrXType]] = {}
+
+    def _location(self, key: str) -> Path:
+        return Path(
+            f".pyastrx/inference/{self.engine[:16]}/{key}.pickle"
+        ).resolve()
+
+    def get(self, key: str) -> Optional[List[ASTrXType]]:
+        types = self._types.get(key)
+        if types is not None or not self.persist:
+            return types
+        location = self._location(key)
+        if not location.exists():
+            return None
+        with open(location, "rb") as f:
+            types = pickle.load(f)
+        self._types[key] = types
+        return types
+
+    def set(self, key: str, types: List[ASTrXType]) -> None:
+        self._types[key] = types
+        if not self.persist:
+            return
+        location = self._location(key)
+        location.parent.mkdir(parents=True, exist_ok=True)
+        with open(location, "wb") as f:
+            pickle.dump(types, f)
@@ -1,10 +1,14 @@
+import os
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 try:
     import mypy.main as MAIN
     import mypy.build as BUILD
+    from mypy.find_sources import create_source_list
+    from mypy.fscache import FileSystemCache
     from mypy.nodes import MypyFile as MypyFileType
+    from mypy.server.update import FineGrainedBuildManager
     MYPY_AVAILABLE = True
 except ImportError:
     MYPY_AVAILABLE = False
@@ -13,38 +17,176 @@ from pyastrx.data_typing import MypyInferFileResult
 from pyastrx.inference.mypy_visitor import TypeExtractor
 
 
+class MypySession:
+    """A mypy build kept in memory between the inferences.
+
+    The first update type checks all the files with the fine-grained
+    incremental mode of mypy. The next ones only process the modified
+    files and the targets that depend on them, the trees of the other
+    modules are kept, see `mypy.server.update`.
+
+    With a cache_dir the first update writes the incremental cache of
+    mypy, with the fine-grained dependencies, in a sqlite database.
+    The next sessions load the build from the cache and only parse
+    again the requested files and the modified modules.
+
+    """
+    def __init__(
+        self, cache_dir: Optional[str] = None,
+        follow_imports: str = "normal",
+    ) -> None:
+        if not MYPY_AVAILABLE:
+            raise ImportError("mypy is not available")
+        self.fscache = FileSystemCache()
+        self.cache_dir = cache_dir
+        self.follow_imports = follow_imports
+        self.manager: Optional["FineGrainedBuildManager"] = None
+        # module id of each path of the build
+        self.modules: Dict[str, str] = {}
+        self._mtimes: Dict[str, int] = {}
+
+    def _build(self, paths: List[str]) -> None:
+        sources, options = MAIN.process_options(paths)
+        options.preserve_asts = True
+        options.local_partial_types = True
+        options.follow_imports = self.follow_imports
+        warm = False
+        if self.cache_dir is None:
+            options.cache_dir = os.devnull
+            options.fine_grained_incremental = True
+        else:
+            warm = Path(self.cache_dir).exists()
+            options.cache_dir = self.cache_dir
+            options.sqlite_cache = True
+            options.cache_fine_grained = True
+            # the cache is only written outside of the fine-grained mode
+            options.fine_grained_incremental = warm
+            options.use_fine_grained_cache = warm
+        result = BUILD.build(sources, options, fscache=self.fscache)
+        self.manager = FineGrainedBuildManager(result)
+        for source in sources:
+            if source.path is not None:
+                self.modules[str(Path(source.path).resolve())] = \
+                    source.module
+        if not warm:
+            return
+        # the modules loaded from the cache have no tree
+        requested = set(paths)
+        stale: List[Tuple[str, str]] = []
+        for module, state in self.manager.graph.items():
+            if state.path is None or state.path.endswith(".pyi"):
+                continue
+            path = str(Path(state.path).resolve())
+            if (path in requested and state.tree is None) \
+                    or state.meta is None \
+                    or state.meta.hash != self.fscache.hash_digest(path):
+                stale.append((module, path))
+        if len(stale) > 0:
+            self.manager.update(stale, [])
+
+    def _modified(self, path: str) -> bool:
+        mtime = os.stat(path).st_mtime_ns
+        modified = self._mtimes.get(path) != mtime
+        self._mtimes[path] = mtime
+        return modified
+
+    def _module_of_target(self, target: str) -> Optional[str]:
+        """The module of a mypy target, e.g. `pkg.mod.Class.method`."""
+        assert self.manager is not None
+        parts = target.split(".")
+        for i in range(len(parts), 0, -1):
+            module = ".".join(parts[:i])
+            if module in self.manager.graph:
+                return module
+        return None
+
+    def update(self, files: List[str]) -> List[str]:
+        """Type check the files that are new or were modified since
+        the last update.
+
+        Returns:
+            The paths of the files whose inferred types may have
+            changed, the modified files and their dependents
+
+        """
+        paths = [str(Path(file).resolve()) for file in files]
+        if self.manager is None:
+            self._build(paths)
+            for path in paths:
+                self._modified(path)
+            return paths
+
+        assert self.manager is not None
+        options = self.manager.manager.options
+        changed: List[Tuple[str, str]] = []
+        for path in paths:
+            if not self._modified(path) and path in self.modules:
+                continue
+            if path not in self.modules:
+                sources = create_source_list([path], options, self.fscache)
+                if len(sources) == 0:
+                    continue
+                self.modules[path] = sources[0].module
+            changed.append((self.modules[path], path))
+        if len(changed) == 0:
+            return []
+        self.fscache.flush()
+        self.manager.flush_cache()
+        self.manager.update(changed, [])
+        affected: Set[str] = set(self.manager.updated_modules)
+        for target in self.manager.processed_targets:
+            module = self._module_of_target(target)
+            if module is not None:
+                affected.add(module)
+        return [
+            path for path, module in self.modules.items()
+            if module in affected]
+
+    def iter_types(self, files: List[str]) -> Iterator[MypyInferFileResult]:
+        """Yield the types of each file as soon as they are extracted,
+        the files are updated first if needed."""
+        self.update(files)
+        assert self.manager is not None
+        for file in files:
+            result: MypyInferFileResult = {"path": file, "types": []}
+            module = self.modules.get(str(Path(file).resolve()))
+            tree = None
+            if module is not None and module in self.manager.graph:
+                tree = self.manager.graph[module].tree
+            if isinstance(tree, MypyFileType):
+                visitor = TypeExtractor(tree)
+                visitor.visit_mypy_file(tree)
+                result["types"] = visitor.types_info
+            yield result
+
+    def infer_types(
+            self, files: List[str]) -> Tuple[List[MypyInferFileResult], bool]:
+        """Extract the types of the files from the last update,
+        the files are updated first if needed."""
+        return list(self.iter_types(files)), True
+
+
+# the mypy build of a pool worker, see `init_infer_worker`
+_worker_session: Optional[MypySession] = None
+
+
+def init_infer_worker() -> None:
+    """Create a mypy build once per pool worker, the chunks of files
+    sent to the worker are added to it."""
+    global _worker_session
+    _worker_session = MypySession()
+
+
+def infer_chunk(files: List[str]) -> List[MypyInferFileResult]:
+    """The types of a chunk of files inferred by a pool worker."""
+    session = _worker_session
+    if session is None:
+        session = MypySession()
+    return list(session.iter_types(files))
+
+
 def infer_types(
         files: List[str], ) -> Tuple[List[MypyInferFileResult], bool]:
-    if not MYPY_AVAILABLE:
-        raise ImportError("mypy is not available")
-    mfiles, opt = MAIN.process_options(
-        files,
-    )
-    opt.preserve_asts = True
-    opt.fine_grained_incremental = True
-    opt.use_fine_grained_cache = True
-    result = BUILD.build(
-        mfiles, options=opt,
-    )
-
-    mypy_query: List[MypyInferFileResult] = []
-    base_folder = str(Path(".").resolve()) + "/"
-    for file in files:
-        mod = file.replace(base_folder, "").replace("/", ".")
-        mod = mod.replace(".py", "")
-        mypy_query.append({
-            "path": file,
-            "types": []
-        })
-        types_info = []
-        if mod not in result.graph:
-            continue
-        tree = result.graph[mod].tree
-        if not isinstance(tree, MypyFileType):
-            continue
-        visitor = TypeExtractor(tree)
-        visitor.visit_mypy_file(tree)
-        types_info = visitor.types_info
-        mypy_query[-1]["types"] = types_info
-
-    return mypy_query, True
+    """Infer the types of the files with a new mypy build, see
+    `MypySession` to keep the build between calls."""
+    return MypySession().infer_types(files)
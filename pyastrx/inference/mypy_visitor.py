@@ -1,4 +1,4 @@
-from typing import Any, List, Tuple, Union
+from typing import Any, Dict, List, Tuple, Union
 from typing_extensions import TYPE_CHECKING
 try:
     import mypy.nodes
@@ -15,15 +15,59 @@ if TYPE_CHECKING: # noqa:
         pass
 
 
+# the `is_*` names of each mypy node class
+_IS_ATTRIBUTES: Dict[type, Tuple[str, ...]] = {}
+
+
+def is_attribute_names(node_class: type) -> Tuple[str, ...]:
+    """The names starting with `is_` of a mypy node class, in the
+    order of `dir`."""
+    names = _IS_ATTRIBUTES.get(node_class)
+    if names is None:
+        names = tuple(
+            name for name in dir(node_class) if name.startswith("is_"))
+        _IS_ATTRIBUTES[node_class] = names
+    return names
+
+
 class TypeExtractor(TraverserVisitor):
     """Visitor for converting a mst node into a dictonary
     with the type information and other useful information
 
+    The `is_*` names of each node class are listed once, see
+    `is_attribute_names`, and the nodes with the same true `is_*`
+    attributes share the `attrs` list. The repr of each type is
+    computed once.
+
     """
 
     def __init__(self, tree: 'mypy.nodes.MypyFile') -> None:
         self.types_info: List[MypyType] = []
         self.tree = tree
+        self._attrs: Dict[Tuple[str, ...], List[str]] = {}
+        # the types are kept to not reuse their ids
+        self._reprs: Dict[int, Tuple[Any, str]] = {}
+
+    def true_attributes(self, o: Any) -> List[str]:
+        """The `is_*` attributes of a node that are true."""
+        names = is_attribute_names(type(o))
+        instance_names = getattr(o, "__dict__", None)
+        if instance_names:
+            names = tuple(sorted(set(names).union(
+                name for name in instance_names if name.startswith("is_"))))
+        key = tuple(name for name in names if getattr(o, name))
+        attrs = self._attrs.get(key)
+        if attrs is None:
+            attrs = list(key)
+            self._attrs[key] = attrs
+        return attrs
+
+    def type_repr(self, type_: Any) -> str:
+        cached = self._reprs.get(id(type_))
+        if cached is None:
+            cached = (type_, type_.__repr__())
+            self._reprs[id(type_)] = cached
+        return cached[1]
 
     def navigate_func_def(self, o: 'mypy.nodes.FuncDef') -> None:
         if o.arguments is not None:
@@ -44,7 +88,7 @@ class TypeExtractor(TraverserVisitor):
         if arg_names is None or arg_types is None or ret_type is None:
             self.navigate_func_def(o)
             return
-        arg_types_str = [t.__repr__() for t in arg_types]
+        arg_types_str = [self.type_repr(t) for t in arg_types]
         args_str = ""
         if len(arg_names) == len(arg_types):
             args_str = ",".join([
@@ -52,7 +96,7 @@ class TypeExtractor(TraverserVisitor):
                 for name_arg, type_arg in
                 zip(arg_names, arg_types_str)
             ])
-        annotation = f"[{args_str}][{ret_type.__repr__()}]"
+        annotation = f"[{args_str}][{self.type_repr(ret_type)}]"
         line = o.line
         column = o.column
         end_line = o.line
@@ -62,9 +106,7 @@ class TypeExtractor(TraverserVisitor):
             "stop": {"line": end_line, "column": end_column}
         }
         fullname = o.fullname
-        attrs = [
-            attr for attr in dir(o)
-            if attr.startswith("is_") and getattr(o, attr)]
+        attrs = self.true_attributes(o)
         node_name = o.__class__.__name__
         type_info: MypyType = {
             "location": position,
@@ -80,9 +122,7 @@ class TypeExtractor(TraverserVisitor):
 
     def visit_class_def(self, o: 'mypy.nodes.ClassDef') -> None:
         name = o.name
-        attrs = [
-            attr for attr in dir(o.info)
-            if attr.startswith("is_") and getattr(o.info, attr)]
+        attrs = self.true_attributes(o.info)
         fullname = o.fullname
         line = o.line
         column = o.column
@@ -118,18 +158,16 @@ class TypeExtractor(TraverserVisitor):
     def visit_var(self, o: 'mypy.nodes.Var') -> None:
 
         name = o.name
-        annotation = o.type.__repr__()
         node_name = o.__class__.__name__
         if o.type is None or o.column == -1:
             return
+        annotation = self.type_repr(o.type)
         column = o.type.column
         line = o.type.line
         fullname = o.fullname
         end_line = line
         end_column = column + len(name)
-        attrs = [
-            attr for attr in dir(o)
-            if attr.startswith("is_") and getattr(o, attr)]
+        attrs = self.true_attributes(o)
         position: TokenLoc = {
             "start": {"line": line, "column": column},
             "stop": {"line": end_line, "column": end_column}
@@ -162,7 +200,7 @@ class TypeExtractor(TraverserVisitor):
         else:
             node_type = getattr(o.node, "type", None)
             if node_type is not None:
-                annotation = node_type.__repr__()
+                annotation = self.type_repr(node_type)
             else:
                 try:
                     if hash(self.tree.names[o.name].node) == hash(o.node):
@@ -170,10 +208,7 @@ class TypeExtractor(TraverserVisitor):
                 except KeyError:
                     pass
 
-        attrs = [
-            attr
-            for attr in dir(o)
-            if attr.startswith("is_") and getattr(o, attr)]
+        attrs = self.true_attributes(o)
         type_info: MypyType = {
             "location": position,
             "name": name,
@@ -216,10 +251,7 @@ class TypeExtractor(TraverserVisitor):
             "start": {"line": line, "column": column},
             "stop": {"line": end_line, "column": end_column}
         }
-        attrs = [
-            attr for attr in dir(o.callee)
-            if attr.startswith("is_") and getattr(o.callee, attr)
-        ]
+        attrs = self.true_attributes(o.callee)
         type_info: MypyType = {
             "location": position,
             "name": name,
@@ -262,10 +294,7 @@ class TypeExtractor(TraverserVisitor):
             annotations.append(item.__class__.__name__)
         annotation = ",".join(annotations)
 
-        attrs = [
-            d for d in dir(o)
-            if d.startswith("is_") and getattr(o, d)
-        ]
+        attrs = self.true_attributes(o)
 
         type_info: MypyType = {
             "location": position,
@@ -2,22 +2,43 @@
 """
 import subprocess
 import json
-from typing import Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 from pyastrx.data_typing import PyreFile
 
+# bounds of the files of each `pyre query`
+MAX_CHUNK_FILES = 64
+MAX_CHUNK_CHARS = 32_000
 
-def infer_types(files: List[str], ) -> Tuple[List[PyreFile], bool]:
-    """
 
-    Args:
-        files: list(str)
-            List of files to be analyzed.
+def iter_chunks(
+    files: List[str],
+    max_files: int = MAX_CHUNK_FILES,
+    max_chars: int = MAX_CHUNK_CHARS,
+) -> Iterator[List[str]]:
+    """Split the files in chunks with at most max_files files and a
+    `types(...)` argument of about max_chars characters."""
+    chunk: List[str] = []
+    chars = 0
+    for f in files:
+        size = len(f) + 3
+        if chunk and (len(chunk) >= max_files or chars + size > max_chars):
+            yield chunk
+            chunk = []
+            chars = 0
+        chunk.append(f)
+        chars += size
+    if chunk:
+        yield chunk
+
+
+def query_types(files: List[str]) -> Tuple[int, str, Optional[List[PyreFile]]]:  # noqa
+    """Run a `pyre query` with the types of the files.
+
     Returns:
-        Tuple[List[PyreFile], bool]
-            - A list of PyreFile dicts. The list has
-            the same length and order as the input files.
-            - True if pyre successfully ran.
+        The exit code, the stderr and the files of the response, None
+        if the response has no files.
 
     """
     files_str = "".join([f"'{f}'," for f in files])[:-1]
@@ -32,14 +53,47 @@ def infer_types(files: List[str], ) -> Tuple[List[PyreFile], bool]:
 
     exit_code = process.wait()
     if exit_code != 0:
-        print(stderr.decode("utf-8"))
-        exit(exit_code)
+        return exit_code, stderr.decode("utf-8"), None
     pyre_response = json.loads(stdout.decode("utf-8"))
-    if "response" not in pyre_response:
-        print(pyre_response)
-        return [], False
-    if len(pyre_response["response"]) == 0:
+    if len(pyre_response.get("response", [])) == 0:
         print(pyre_response)
-        return [], False
+        return exit_code, "", None
+    return exit_code, "", pyre_response["response"]
+
+
+def infer_types(
+    files: List[str],
+    max_files: int = MAX_CHUNK_FILES,
+    jobs: int = 4,
+) -> Tuple[List[PyreFile], bool]:
+    """
+
+    Args:
+        files: list(str)
+            List of files to be analyzed.
+        max_files: int
+            Maximum number of files of each query, see `iter_chunks`.
+        jobs: int
+            Number of queries sent at the same time to the pyre server.
+    Returns:
+        Tuple[List[PyreFile], bool]
+            - A list of PyreFile dicts. The list has
+            the same length and order as the input files.
+            - True if pyre successfully ran.
+
+    """
+    chunks = list(iter_chunks(files, max_files))
+    if len(chunks) == 0:
+        return [], True
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(query_types, chunks))
+    response: List[PyreFile] = []
+    for exit_code, stderr, chunk_response in results:
+        if exit_code != 0:
+            print(stderr)
+            exit(exit_code)
+        if chunk_response is None:
+            return [], False
+        response.extend(chunk_response)
 
-    return pyre_response["response"], True
+    return response, True
@@ -2,7 +2,7 @@
 the linter.
 
 """
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from pyastrx.config import __color_highlight, __severity2color
 from pyastrx.data_typing import CodeContext, Lines2Matches, RuleInfo, RulesDict
@@ -56,12 +56,29 @@ def matches_by_filename(
     line2matches: Lines2Matches,
     filename: str,
     rules: RulesDict,
+    context_of: Optional[Callable[[int], CodeContext]] = None,
 ) -> Tuple[str, int]:
+    """Create the report of the matches of a file.
+
+    Args:
+        line2matches: the matches of the file
+        filename: the file name
+        rules: the rules used in the search
+        context_of: extract the code context of a line. It is called
+            only for the lines without a code context.
+    Returns:
+        The report and the number of matches
+
+    """
     output_str = ""
     output_list = [f"[bold white on green]File:{filename}[/bold white on green]\n"] # noqa
     num_matches = 0
     for line_match, matches_by_line in line2matches.matches.items():
         context = matches_by_line.code_context
+        if context is None:
+            context = CodeContext([])
+            if context_of is not None:
+                context = context_of(line_match)
         cols = []
         for expr, match in matches_by_line.match_by_expr.items():
             col_numbers = match.cols_by_line[line_match]
@@ -74,3 +91,27 @@ def matches_by_filename(
         output_str = "".join(output_list)
 
     return output_str, num_matches
+
+
+def count_by_filename(
+    line2matches: Lines2Matches,
+    filename: str,
+) -> Tuple[str, int]:
+    """Report only the number of lines with matches of a file, like
+    grep -c."""
+    num_matches = len(line2matches.matches)
+    if num_matches == 0:
+        return "", 0
+    output_str = f"[bold green]{filename}[/bold green]:{num_matches}\n"
+    return output_str, num_matches
+
+
+def filename_with_matches(
+    line2matches: Lines2Matches,
+    filename: str,
+) -> Tuple[str, int]:
+    """Report only the filename if it has any match, like grep -l."""
+    num_matches = len(line2matches.matches)
+    if num_matches == 0:
+        return "", 0
+    return f"[bold green]{filename}[/bold green]\n", num_matches
@@ -0,0 +1,821 @@
+"""Evaluate xpath rules directly over the python AST.
+
+The rules are parsed by `pyastrx.xml.xpath_parser` and compiled into
+python closures that walk the virtual tree of `ast_tree`, so the
+files are never converted to lxml. The rules outside of the supported
+subset fall back to the lxml search, see `fallback_reason`.
+
+"""
+import math
+import re
+from bisect import bisect_right
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pyastrx.axml.python.ast_tree import (
+    DocumentNode,
+    ElementNode,
+    Node,
+    txt2document,
+)
+from pyastrx.data_typing import (
+    Expression2Match,
+    FileInfo,
+    MatchParams,
+    RulesDict,
+    SearchLimits,
+)
+from pyastrx.xml.misc import match_from_spans, span_from_xml
+from pyastrx.xml.xpath_compiler import XPathSyntaxError
+from pyastrx.xml.xpath_extensions import LXMLExtensions, __all_lxml_ext__
+from pyastrx.xml.xpath_lists import inline_list_calls, list_params
+from pyastrx.xml.xpath_parser import (
+    REVERSE_AXES,
+    BinaryOp,
+    Filter,
+    FunctionCall,
+    Literal,
+    Negate,
+    Number,
+    Path,
+    Step,
+    UnionExpr,
+    UnsupportedXPathError,
+    parse_xpath,
+)
+
+
+class XPathTypeError(ValueError):
+    """Raised when a function gets an argument of the wrong type,
+    lxml fails to evaluate these expressions too."""
+
+
+class Environment:
+    """The document being searched and the extension functions."""
+    def __init__(
+        self, document: DocumentNode, extensions: LXMLExtensions
+    ) -> None:
+        self.document = document
+        self.extensions = extensions
+        self._orders_by_tag: Dict[str, List[int]] = {}
+
+    def orders_by_tag(self, tag: str) -> List[int]:
+        orders = self._orders_by_tag.get(tag)
+        if orders is None:
+            elements = self.document.elements_by_tag().get(tag, [])
+            orders = [element.order for element in elements]
+            self._orders_by_tag[tag] = orders
+        return orders
+
+    def tag_elements(
+        self, node: Node, tag: str
+    ) -> Tuple[List[ElementNode], Callable[[], List[int]]]:
+        """The elements with a tag of the tree of a node, in document
+        order, and a function that returns their orders."""
+        return (
+            self.document.elements_by_tag().get(tag, []),
+            partial(self.orders_by_tag, tag))
+
+    def count_tag(self, node: Node, tag: str) -> Optional[int]:
+        """The number of elements with a tag below a node, i.e.
+        `count(.//tag)`, None if it is not known without walking
+        the tree."""
+        if node.kind == "document":
+            return len(self.document.elements_by_tag().get(tag, []))
+        return None
+
+
+NodeSet = List[Node]
+# a compiled expression: (context node, position, size, env) -> value
+Evaluator = Callable[[Node, int, int, Environment], Any]
+
+_NUMBER_RE = re.compile(r"\s*-?(\d+(\.\d*)?|\.\d+)\s*$")
+_NUMERIC_FUNCTIONS = {
+    "count", "sum", "string-length", "number", "floor", "ceiling",
+    "round", "position", "last"}
+_EXTENSIONS = {
+    f"pyastrx:{name}": method for method, name in __all_lxml_ext__.items()}
+
+
+def to_string(value: Any) -> str:
+    if isinstance(value, list):
+        if len(value) == 0:
+            return ""
+        return value[0].string_value()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return number_to_string(value)
+    return str(value)
+
+
+def number_to_string(number: float) -> str:
+    if math.isnan(number):
+        return "NaN"
+    if math.isinf(number):
+        return "Infinity" if number > 0 else "-Infinity"
+    if number == int(number):
+        return str(int(number))
+    txt = f"{number:.15g}"
+    if "e" in txt:
+        txt = f"{number:.15f}"
+    return txt.rstrip("0").rstrip(".")
+
+
+def to_number(value: Any) -> float:
+    if isinstance(value, float):
+        return value
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    txt = to_string(value)
+    if _NUMBER_RE.match(txt) is None:
+        return math.nan
+    return float(txt)
+
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, (list, str)):
+        return len(value) > 0
+    if isinstance(value, float):
+        return value != 0 and not math.isnan(value)
+    return bool(value)
+
+
+_RELATIONAL: Dict[str, Callable[[Any, Any], bool]] = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def compare(op: str, left: Any, right: Any) -> bool:
+    """Compare two values following the xpath 1.0 rules."""
+    fn = _RELATIONAL[op]
+    equality = op in ("=", "!=")
+    if isinstance(left, list) and isinstance(right, list):
+        if equality:
+            values = {node.string_value() for node in right}
+            return any(
+                fn(node.string_value(), value)
+                for node in left for value in values)
+        numbers = [to_number(node.string_value()) for node in right]
+        return any(
+            fn(to_number(node.string_value()), number)
+            for node in left for number in numbers)
+    if isinstance(left, list) or isinstance(right, list):
+        if isinstance(right, list):
+            # a < nodes is the same as nodes > a
+            swapped = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+            op = swapped.get(op, op)
+            fn = _RELATIONAL[op]
+            left, right = right, left
+        if isinstance(right, bool):
+            return fn(to_bool(left), right)
+        if isinstance(right, float) or not equality:
+            number = to_number(right)
+            return any(
+                fn(to_number(node.string_value()), number)
+                for node in left)
+        return any(fn(node.string_value(), right) for node in left)
+    if equality:
+        if isinstance(left, bool) or isinstance(right, bool):
+            return fn(to_bool(left), to_bool(right))
+        if isinstance(left, float) or isinstance(right, float):
+            return fn(to_number(left), to_number(right))
+        return fn(to_string(left), to_string(right))
+    return fn(to_number(left), to_number(right))
+
+
+def sort_nodes(nodes: NodeSet) -> NodeSet:
+    """Remove duplicated nodes and sort them in document order."""
+    unique = {id(node): node for node in nodes}
+    return sorted(unique.values(), key=lambda node: node.key)
+
+
+def iter_axis(node: Node, axis: str) -> Iterator[Node]:
+    """The nodes of an axis in the axis order."""
+    if axis == "child":
+        yield from node.iter_children()
+    elif axis == "attribute":
+        yield from node.iter_attributes()
+    elif axis == "descendant":
+        yield from node.iter_descendants()
+    elif axis == "descendant-or-self":
+        yield node
+        yield from node.iter_descendants()
+    elif axis == "self":
+        yield node
+    elif axis == "parent":
+        if node.parent is not None:
+            yield node.parent
+    elif axis in ("ancestor", "ancestor-or-self"):
+        current: Optional[Node] = node
+        if axis == "ancestor":
+            current = node.parent
+        while current is not None:
+            yield current
+            current = current.parent
+    elif axis in ("following-sibling", "preceding-sibling"):
+        if node.parent is None or node.kind == "attribute":
+            return
+        siblings = node.parent.iter_children()
+        index = next(
+            i for i, sibling in enumerate(siblings) if sibling is node)
+        if axis == "following-sibling":
+            yield from siblings[index + 1:]
+        else:
+            yield from reversed(siblings[:index])
+    elif axis == "following":
+        current = node
+        if node.kind == "attribute" and node.parent is not None:
+            yield from node.parent.iter_descendants()
+            current = node.parent
+        while current is not None:
+            for sibling in iter_axis(current, "following-sibling"):
+                yield sibling
+                yield from sibling.iter_descendants()
+            current = current.parent
+    elif axis == "preceding":
+        root: Node = node
+        ancestors = set()
+        while root.parent is not None:
+            root = root.parent
+            ancestors.add(id(root))
+        if node.kind == "attribute" and node.parent is not None:
+            ancestors.add(id(node.parent))
+        preceding = []
+        for other in root.iter_descendants():
+            if other.key >= node.key:
+                break
+            if id(other) not in ancestors:
+                preceding.append(other)
+        yield from reversed(preceding)
+
+
+def node_test_fn(axis: str, node_test: str) -> Callable[[Node], bool]:
+    principal = "attribute" if axis == "attribute" else "element"
+    if node_test == "node()":
+        return lambda node: True
+    if node_test == "text()":
+        return lambda node: node.kind == "text"
+    if node_test == "*":
+        return lambda node: node.kind == principal
+    if principal == "attribute":
+        return lambda node: getattr(node, "name", None) == node_test
+    return lambda node: getattr(node, "tag", None) == node_test
+
+
+def uses_position(expr: Any) -> bool:
+    """True if a predicate may depend on the context position,
+    that is a numeric predicate or a call to position() or last()."""
+    if isinstance(expr, (Number, Negate)):
+        return True
+    if isinstance(expr, BinaryOp) \
+            and expr.op in ("+", "-", "*", "div", "mod"):
+        return True
+    if isinstance(expr, FunctionCall) and expr.name in _NUMERIC_FUNCTIONS:
+        return True
+    return calls_position(expr)
+
+
+def calls_position(expr: Any) -> bool:
+    if isinstance(expr, FunctionCall):
+        if expr.name in ("position", "last"):
+            return True
+        return any(calls_position(arg) for arg in expr.args)
+    if isinstance(expr, (BinaryOp, UnionExpr)):
+        return calls_position(expr.left) or calls_position(expr.right)
+    if isinstance(expr, Negate):
+        return calls_position(expr.expr)
+    if isinstance(expr, Filter):
+        return calls_position(expr.primary)
+    if isinstance(expr, Path) and expr.start is not None:
+        return calls_position(expr.start)
+    # the predicates of the steps have their own context
+    return False
+
+
+def filter_predicates(
+    nodes: NodeSet, predicates: Tuple[Evaluator, ...], env: Environment,
+    positional: bool = True,
+) -> NodeSet:
+    if not positional:
+        for predicate in predicates:
+            nodes = [
+                node for node in nodes
+                if to_bool(predicate(node, 1, 1, env))]
+        return nodes
+    for predicate in predicates:
+        size = len(nodes)
+        selected = []
+        for position, node in enumerate(nodes, 1):
+            value = predicate(node, position, size, env)
+            if isinstance(value, float):
+                if value == position:
+                    selected.append(node)
+            elif to_bool(value):
+                selected.append(node)
+        nodes = selected
+    return nodes
+
+
+StepEvaluator = Callable[[NodeSet, Environment], NodeSet]
+
+
+def compile_attribute_step(step: Step) -> StepEvaluator:
+    """`@name` looks up a single attribute of each element."""
+    name = step.node_test
+
+    def evaluate(context: NodeSet, env: Environment) -> NodeSet:
+        found: NodeSet = []
+        for node in context:
+            if isinstance(node, ElementNode):
+                attribute = node.attribute(name)
+                if attribute is not None:
+                    found.append(attribute)
+        return found
+    return evaluate
+
+
+def compile_step(step: Step) -> StepEvaluator:
+    if step.axis == "attribute" and not step.predicates \
+            and step.node_test not in ("*", "node()", "text()"):
+        return compile_attribute_step(step)
+    test = node_test_fn(step.axis, step.node_test)
+    predicates = tuple(compile_expr(p) for p in step.predicates)
+    positional = any(uses_position(p) for p in step.predicates)
+    reverse = step.axis in REVERSE_AXES
+    axis = step.axis
+    tag = step.node_test
+    child_by_tag = axis == "child" \
+        and tag not in ("*", "node()", "text()")
+
+    def select(node: Node, env: Environment) -> NodeSet:
+        if child_by_tag:
+            nodes = [n for n in node.iter_children() if n.tag == tag]
+        else:
+            nodes = [n for n in iter_axis(node, axis) if test(n)]
+        if predicates and nodes:
+            nodes = filter_predicates(nodes, predicates, env, positional)
+        if reverse:
+            nodes.reverse()
+        return nodes
+
+    def evaluate(context: NodeSet, env: Environment) -> NodeSet:
+        if len(context) == 1:
+            return select(context[0], env)
+        found: NodeSet = []
+        for node in context:
+            found.extend(select(node, env))
+        if axis in ("child", "attribute"):
+            # the nodes of different parents can not be duplicated
+            return sorted(found, key=lambda node: node.key)
+        return sort_nodes(found)
+    return evaluate
+
+
+def compile_descendants_by_tag(step: Step) -> StepEvaluator:
+    """`//Tag[pred]`, i.e. `descendant-or-self::node()/child::Tag[pred]`,
+    with the elements taken from the tag index of the document instead
+    of walking the tree. If the predicates depend on the position,
+    the elements are grouped by their parent before the filter."""
+    tag = step.node_test
+    predicates = tuple(compile_expr(p) for p in step.predicates)
+    positional = any(uses_position(p) for p in step.predicates)
+
+    def evaluate(context: NodeSet, env: Environment) -> NodeSet:
+        found: NodeSet = []
+        for node in context:
+            if node.kind == "document":
+                found.extend(env.tag_elements(node, tag)[0])
+                continue
+            if not isinstance(node, ElementNode):
+                continue
+            elements, orders_of = env.tag_elements(node, tag)
+            if not elements:
+                continue
+            orders = orders_of()
+            found.extend(elements[
+                bisect_right(orders, node.order):
+                bisect_right(orders, node.end)])
+        if len(context) > 1:
+            found = sort_nodes(found)
+        if not predicates or not found:
+            return found
+        if not positional:
+            return filter_predicates(found, predicates, env, False)
+        by_parent: Dict[int, NodeSet] = {}
+        for node in found:
+            by_parent.setdefault(id(node.parent), []).append(node)
+        selected: NodeSet = []
+        for siblings in by_parent.values():
+            selected.extend(filter_predicates(siblings, predicates, env))
+        return sorted(selected, key=lambda node: node.key)
+    return evaluate
+
+
+def compile_steps(steps: Tuple[Step, ...]) -> List[StepEvaluator]:
+    compiled: List[StepEvaluator] = []
+    i = 0
+    while i < len(steps):
+        step = steps[i]
+        following = steps[i + 1] if i + 1 < len(steps) else None
+        if step.axis == "descendant-or-self" and step.node_test == "node()" \
+                and not step.predicates and following is not None \
+                and following.axis == "child" \
+                and following.node_test not in ("*", "node()", "text()"):
+            compiled.append(compile_descendants_by_tag(following))
+            i += 2
+            continue
+        compiled.append(compile_step(step))
+        i += 1
+    return compiled
+
+
+def compile_path(expr: Path) -> Evaluator:
+    steps = compile_steps(expr.steps)
+    start = compile_expr(expr.start) if expr.start is not None else None
+    absolute = expr.absolute
+
+    def evaluate(node: Node, position: int, size: int, env: Environment) -> Any:  # noqa
+        nodes: NodeSet
+        if start is not None:
+            value = start(node, position, size, env)
+            if not isinstance(value, list):
+                raise XPathTypeError("The path does not start at nodes")
+            nodes = value
+        elif absolute:
+            nodes = [env.document]
+        else:
+            nodes = [node]
+        for step in steps:
+            if len(nodes) == 0:
+                return nodes
+            nodes = step(nodes, env)
+        return nodes
+    return evaluate
+
+
+def compile_filter(expr: Filter) -> Evaluator:
+    primary = compile_expr(expr.primary)
+    predicates = tuple(compile_expr(p) for p in expr.predicates)
+
+    def evaluate(node: Node, position: int, size: int, env: Environment) -> Any:  # noqa
+        value = primary(node, position, size, env)
+        if not isinstance(value, list):
+            raise XPathTypeError("Predicates can only filter nodes")
+        return filter_predicates(value, predicates, env)
+    return evaluate
+
+
+def compile_binary(expr: BinaryOp) -> Evaluator:
+    left = compile_expr(expr.left)
+    right = compile_expr(expr.right)
+    op = expr.op
+    if op == "or":
+        return lambda n, p, s, env: to_bool(left(n, p, s, env)) \
+            or to_bool(right(n, p, s, env))
+    if op == "and":
+        return lambda n, p, s, env: to_bool(left(n, p, s, env)) \
+            and to_bool(right(n, p, s, env))
+    if op in ("=", "!="):
+        attribute_literal = compile_attribute_literal(expr)
+        if attribute_literal is not None:
+            return attribute_literal
+    if op in _RELATIONAL:
+        return lambda n, p, s, env: compare(
+            op, left(n, p, s, env), right(n, p, s, env))
+    arithmetic: Dict[str, Callable[[float, float], float]] = {
+        "+": lambda a, b: a + b,
+        "-": lambda a, b: a - b,
+        "*": lambda a, b: a * b,
+        "div": divide,
+        "mod": modulo,
+    }
+    fn = arithmetic[op]
+    return lambda n, p, s, env: fn(
+        to_number(left(n, p, s, env)), to_number(right(n, p, s, env)))
+
+
+def attribute_name(expr: Any) -> Optional[str]:
+    """The name of a `@name` path, None for any other expression."""
+    if isinstance(expr, Path) and expr.start is None \
+            and not expr.absolute and len(expr.steps) == 1:
+        step = expr.steps[0]
+        if step.axis == "attribute" and not step.predicates \
+                and step.node_test not in ("*", "node()", "text()"):
+            return step.node_test
+    return None
+
+
+def descendants_tag(expr: Any) -> Optional[Tuple[str, bool]]:
+    """The tag of a `//tag` or `.//tag` path and if it is absolute,
+    None for any other expression."""
+    if not isinstance(expr, Path) or expr.start is not None:
+        return None
+    steps = expr.steps
+    if not expr.absolute:
+        if len(steps) == 0 or steps[0] != Step("self", "node()"):
+            return None
+        steps = steps[1:]
+    if len(steps) != 2 or steps[0] != Step("descendant-or-self", "node()"):
+        return None
+    step = steps[1]
+    if step.axis != "child" or step.predicates \
+            or step.node_test in ("*", "node()", "text()"):
+        return None
+    return step.node_test, expr.absolute
+
+
+def compile_attribute_literal(expr: BinaryOp) -> Optional[Evaluator]:
+    """`@name='value'` compares the attribute value directly,
+    without creating the attribute node."""
+    left, right = expr.left, expr.right
+    if isinstance(left, Literal):
+        left, right = right, left
+    name = attribute_name(left)
+    if name is None or not isinstance(right, Literal):
+        return None
+    value = right.value
+    if expr.op == "=":
+        return lambda n, p, s, env: isinstance(n, ElementNode) \
+            and n.get(name) == value
+    return lambda n, p, s, env: isinstance(n, ElementNode) \
+        and n.get(name) not in (None, value)
+
+
+def divide(a: float, b: float) -> float:
+    if b == 0:
+        if a == 0 or math.isnan(a):
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1, b)
+    return a / b
+
+
+def modulo(a: float, b: float) -> float:
+    if b == 0 or math.isinf(a) or math.isnan(a) or math.isnan(b):
+        return math.nan
+    return math.fmod(a, b)
+
+
+def xpath_round(number: float) -> float:
+    if math.isnan(number) or math.isinf(number):
+        return number
+    return float(math.floor(number + 0.5))
+
+
+def substring(txt: str, start: float, length: Optional[float] = None) -> str:
+    first = xpath_round(start)
+    end = math.inf if length is None else first + xpath_round(length)
+    return "".join(
+        char for position, char in enumerate(txt, 1)
+        if first <= position < end)
+
+
+def translate(txt: str, source: str, target: str) -> str:
+    table: Dict[int, Optional[str]] = {}
+    for i, char in enumerate(source):
+        if ord(char) not in table:
+            table[ord(char)] = target[i] if i < len(target) else None
+    return txt.translate(table)
+
+
+def node_name(nodes: NodeSet) -> str:
+    if len(nodes) == 0:
+        return ""
+    node = nodes[0]
+    return str(getattr(node, "tag", None) or getattr(node, "name", ""))
+
+
+# name: (function, (min args, max args), uses the string value of
+# the context node when there are no arguments)
+_STRING_FUNCTIONS: Dict[str, Tuple[Callable[..., Any], Tuple[int, int], bool]] = {  # noqa
+    "concat": (lambda *a: "".join(a), (2, 1000), False),
+    "starts-with": (lambda a, b: a.startswith(b), (2, 2), False),
+    "contains": (lambda a, b: b in a, (2, 2), False),
+    "substring-before": (
+        lambda a, b: a[:a.find(b)] if b in a else "", (2, 2), False),
+    "substring-after": (
+        lambda a, b: a[a.find(b) + len(b):] if b in a else "", (2, 2),
+        False),
+    "string-length": (lambda a: float(len(a)), (0, 1), True),
+    "normalize-space": (lambda a: " ".join(a.split()), (0, 1), True),
+    "translate": (translate, (3, 3), False),
+    "string": (lambda a: a, (0, 1), True),
+}
+
+
+def compile_function(expr: FunctionCall) -> Evaluator:
+    name = expr.name
+    args = tuple(compile_expr(arg) for arg in expr.args)
+    num_args = len(args)
+
+    def check_arity(low: int, high: int) -> None:
+        if not low <= num_args <= high:
+            raise XPathSyntaxError(f"Invalid number of arguments: {name}")
+
+    if name in _EXTENSIONS:
+        method_name = _EXTENSIONS[name]
+
+        def extension(n: Node, p: int, s: int, env: Environment) -> Any:
+            values = []
+            for arg in args:
+                value = arg(n, p, s, env)
+                if isinstance(value, list):
+                    value = [
+                        node if node.kind == "element"
+                        else node.string_value() for node in value]
+                values.append(value)
+            result = env.extensions.functions[method_name](None, *values)
+            if isinstance(result, (int, float)) \
+                    and not isinstance(result, bool):
+                return float(result)
+            return result
+        return extension
+
+    if name in _STRING_FUNCTIONS:
+        fn, (low, high), default_context = _STRING_FUNCTIONS[name]
+        check_arity(low, high)
+        if num_args == 0 and default_context:
+            return lambda n, p, s, env: fn(n.string_value())
+        return lambda n, p, s, env: fn(
+            *[to_string(arg(n, p, s, env)) for arg in args])
+    if name == "substring":
+        check_arity(2, 3)
+        return lambda n, p, s, env: substring(
+            to_string(args[0](n, p, s, env)),
+            *[to_number(arg(n, p, s, env)) for arg in args[1:]])
+    if name in ("position", "last", "true", "false"):
+        check_arity(0, 0)
+        constants: Dict[str, Evaluator] = {
+            "position": lambda n, p, s, env: float(p),
+            "last": lambda n, p, s, env: float(s),
+            "true": lambda n, p, s, env: True,
+            "false": lambda n, p, s, env: False,
+        }
+        return constants[name]
+    if name in ("not", "boolean"):
+        check_arity(1, 1)
+        if name == "not":
+            return lambda n, p, s, env: not to_bool(args[0](n, p, s, env))
+        return lambda n, p, s, env: to_bool(args[0](n, p, s, env))
+    if name in ("number", "floor", "ceiling", "round"):
+        check_arity(0 if name == "number" else 1, 1)
+        rounding: Dict[str, Callable[[float], float]] = {
+            "number": lambda x: x,
+            "floor": lambda x: x if math.isinf(x) or math.isnan(x)
+            else float(math.floor(x)),
+            "ceiling": lambda x: x if math.isinf(x) or math.isnan(x)
+            else float(math.ceil(x)),
+            "round": xpath_round,
+        }
+        rnd = rounding[name]
+        if num_args == 0:
+            return lambda n, p, s, env: to_number(n.string_value())
+        return lambda n, p, s, env: rnd(to_number(args[0](n, p, s, env)))
+    if name == "count" and num_args == 1:
+        descendants = descendants_tag(expr.args[0])
+        if descendants is not None:
+            tag, absolute = descendants
+            path = args[0]
+
+            def count_tag(n: Node, p: int, s: int, env: Environment) -> Any:
+                counted = env.count_tag(env.document if absolute else n, tag)
+                if counted is None:
+                    return float(len(path(n, p, s, env)))
+                return float(counted)
+            return count_tag
+    if name in ("count", "sum", "name", "local-name"):
+        check_arity(0 if name in ("name", "local-name") else 1, 1)
+
+        def node_set(n: Node, p: int, s: int, env: Environment) -> NodeSet:
+            if num_args == 0:
+                return [n]
+            value = args[0](n, p, s, env)
+            if not isinstance(value, list):
+                raise XPathTypeError(f"{name} expects a node-set")
+            return value
+        if name == "count":
+            return lambda n, p, s, env: float(len(node_set(n, p, s, env)))
+        if name == "sum":
+            return lambda n, p, s, env: float(sum(
+                to_number(node.string_value())
+                for node in node_set(n, p, s, env)))
+        return lambda n, p, s, env: node_name(node_set(n, p, s, env))
+    raise UnsupportedXPathError(f"function {name}")
+
+
+def compile_expr(expr: Any) -> Evaluator:
+    if isinstance(expr, Literal):
+        value = expr.value
+        return lambda n, p, s, env: value
+    if isinstance(expr, Number):
+        number = expr.value
+        return lambda n, p, s, env: number
+    if isinstance(expr, Path):
+        return compile_path(expr)
+    if isinstance(expr, Filter):
+        return compile_filter(expr)
+    if isinstance(expr, BinaryOp):
+        return compile_binary(expr)
+    if isinstance(expr, Negate):
+        inner = compile_expr(expr.expr)
+        return lambda n, p, s, env: -to_number(inner(n, p, s, env))
+    if isinstance(expr, UnionExpr):
+        left = compile_expr(expr.left)
+        right = compile_expr(expr.right)
+
+        def union(n: Node, p: int, s: int, env: Environment) -> Any:
+            a = left(n, p, s, env)
+            b = right(n, p, s, env)
+            if not isinstance(a, list) or not isinstance(b, list):
+                raise XPathTypeError("Only node-sets can be joined")
+            return sort_nodes(a + b)
+        return union
+    if isinstance(expr, FunctionCall):
+        return compile_function(expr)
+    raise UnsupportedXPathError(f"{expr}")
+
+
+@lru_cache(maxsize=4096)
+def compile_ast_xpath(xpath: str) -> Tuple[Optional[Evaluator], str]:
+    """Compile a xpath to be evaluated over the AST.
+
+    Returns:
+        The compiled expression and an empty string, or None and
+        the reason to fall back to lxml.
+
+    """
+    try:
+        return compile_expr(parse_xpath(xpath)), ""
+    except UnsupportedXPathError as err:
+        return None, f"not supported: {err}"
+    except XPathSyntaxError as err:
+        return None, f"invalid xpath: {err}"
+
+
+def fallback_reason(xpath: str) -> Optional[str]:
+    """Why a rule has to be evaluated by lxml, None if the AST
+    backend supports it."""
+    evaluator, reason = compile_ast_xpath(xpath)
+    if evaluator is None:
+        return reason
+    return None
+
+
+def search_ast(
+    file_info: FileInfo,
+    mark_specification: str,
+    rules: RulesDict,
+    match_params: Optional[MatchParams],
+    limits: Optional[SearchLimits] = None,
+    extensions: Optional[LXMLExtensions] = None,
+) -> Expression2Match:
+    """Search the rules supported by the AST backend in a python file.
+
+    The rules that are not supported are not evaluated, therefore they
+    are missing in the result.
+
+    Args:
+        extensions: the extension functions of the search, a new
+            object is created if None
+
+    """
+    if limits is None:
+        limits = SearchLimits()
+    stop_at_first = limits.files_with_matches or limits.first_match
+    max_matches = 1 if stop_at_first else limits.max_matches
+    matching_by_expression = Expression2Match({})
+    env: Optional[Environment] = None
+    lists = list_params(match_params)
+    for expression in rules.keys():
+        evaluator, _ = compile_ast_xpath(inline_list_calls(
+            expression[len(mark_specification):], lists))
+        if evaluator is None:
+            continue
+        if env is None:
+            document = txt2document(
+                file_info.txt, file_info.filename,
+                getattr(file_info, "normalize_ast", True))
+            if extensions is None:
+                params = match_params.__dict__ if match_params else {}
+                extensions = LXMLExtensions(**params)
+            env = Environment(document, extensions)
+        try:
+            result = evaluator(env.document.root, 1, 1, env)
+        except XPathTypeError:
+            continue
+        if not isinstance(result, list):
+            continue
+        if max_matches is not None:
+            result = result[:max_matches]
+        match = match_from_spans(
+            span_from_xml(node) for node in result  # type: ignore
+            if isinstance(node, ElementNode))
+        matching_by_expression[expression] = match
+        if stop_at_first and match.num_matches > 0:
+            break
+    return matching_by_expression
@@ -1,8 +1,9 @@
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Tuple
 import pickle
 
 from pyastrx.data_typing import FileInfo
+from pyastrx.search.txt_tools import build_line_offsets
 
 
 class Cache:
@@ -11,6 +12,8 @@ class Cache:
     """
     def __init__(self, file_cache: bool = True) -> None:
         self._cache: Dict[str, FileInfo] = {}
+        # the modification time of each file when it was last checked
+        self._mtimes: Dict[str, float] = {}
         self.file_cache = file_cache
 
     def _get_cache_location(self, file_path: Path) -> Path:
@@ -31,6 +34,10 @@ class Cache:
         if not file_path.exists():
             raise FileNotFoundError(f"File '{filename}' not found.")
         last_modified = file_path.stat().st_mtime
+        if filename in self._cache \
+                and self._mtimes.get(filename) == last_modified:
+            return False
+        self._mtimes[filename] = last_modified
         file_cache = self._get_cache_location(file_path)
         if file_cache.exists() and self.file_cache:
             last_modified_cache = file_cache.stat().st_mtime
@@ -39,8 +46,6 @@ class Cache:
             file_info = pickle.load(open(file_cache, "rb"))
             self.set(filename, file_info, False)
             return False
-        if filename in self._cache.keys():
-            return False
         return True
 
     def get(self, filename: str) -> FileInfo:
@@ -49,12 +54,49 @@ class Cache:
         """
         return self._cache[filename]
 
+    def remove(self, filename: str, delete: bool = False) -> None:
+        """
+        Forget a file. With delete its cache file is also removed.
+        """
+        self._cache.pop(filename, None)
+        self._mtimes.pop(filename, None)
+        if delete and self.file_cache:
+            file_cache = self._get_cache_location(Path(filename).absolute())
+            try:
+                file_cache.unlink()
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, filename: str) -> None:
+        """
+        Check the file again in the next update, e.g. if it failed to
+        be converted.
+        """
+        self._mtimes.pop(filename, None)
+
+    def __contains__(self, filename: object) -> bool:
+        return filename in self._cache
+
+    def items(self) -> List[Tuple[str, FileInfo]]:
+        """
+        The filenames and the files in the cache.
+        """
+        return list(self._cache.items())
+
+    def values(self) -> List[FileInfo]:
+        """
+        All the files in the cache.
+        """
+        return list(self._cache.values())
+
     def set(
             self, filename: str,
             file_info: FileInfo, dump: bool = True) -> None:
         """
         Set a value in the cache.
         """
+        if len(getattr(file_info, "line_offsets", [])) == 0:
+            file_info.line_offsets = build_line_offsets(file_info.txt)
         self._cache[filename] = file_info
         if dump and self.file_cache:
             file_path = Path(filename).absolute()
@@ -1,28 +1,64 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from itertools import starmap
 from multiprocessing import Pool
+from multiprocessing.pool import AsyncResult
 from pathlib import Path
-from typing import List, Optional, Literal
+from typing import (
+    Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Literal,
+    Set, Tuple)
 from dataclasses import asdict
 
 
+from pyastrx.inference.cache import (
+    InferenceCache,
+    inference_keys,
+    import_closure,
+    in_modules,
+    reverse_dependencies,
+    source_digest,
+)
 from pyastrx.inference.pyre import infer_types as infer_types_pyre
-from pyastrx.inference.mypy import infer_types as infer_types_mypy
+from pyastrx.inference.mypy import MypySession
 from pyastrx.inference.normalization import pyre2astrx, mypy2astrx
-from pyastrx.axml.python.ast2xml import file2axml
+from pyastrx.axml.python.ast2xml import annotate_file_info, file2axml
+from pyastrx.axml.python.ast_tree import file2info
+from pyastrx.axml.python.symbols import module_name, symbols_from_txt
+from pyastrx.xml.misc import match_from_spans
 from pyastrx.axml.yaml.yaml2xml import file2axml as yaml2axml
 from pyastrx.data_typing import (
+    CodeContext,
+    Expression2Match,
+    ExtensionStats,
     Files2Matches,
     Lines2Matches,
     MatchParams,
+    ModuleSymbols,
     FileInfo,
+    RuleInfo,
     RulesDict,
     ASTrXType,
     InferenceConfig,
+    InferenceStats,
+    SearchLimits,
     Specifications,
     Specification,
 )
+from pyastrx.search.ast_search import fallback_reason
 from pyastrx.search.cache import Cache
-from pyastrx.search.xml_search import search_in_file_info
+from pyastrx.search.repo_document import RepoDocument, evaluate_repo
+from pyastrx.search.txt_tools import get_code_context
+from pyastrx.search.xml_search import (
+    create_extensions,
+    group_by_line,
+    init_search_worker,
+    search_in_file_info,
+    search_in_file_item,
+)
+from pyastrx.xml.symbol_index import SymbolIndex
+from pyastrx.xml.xpath_compiler import uses_inferred_types
+from pyastrx.xml.xpath_extensions import LXMLExtensions, uses_symbols
 
 
 class Repo:
@@ -31,27 +67,246 @@ class Repo:
         match_params: MatchParams,
         inference: Optional[InferenceConfig] = None,
         file_cache: bool = True,
+        fused_rules: Optional[RulesDict] = None,
+        backend: Literal["xml", "ast"] = "xml",
+        profile_extensions: bool = False,
+        inference_rules: Optional[RulesDict] = None,
     ) -> None:
+        """
+        Args:
+            fused_rules: the rules to be matched while the python
+                files are converted to XML. Only the simple rules are
+                fused, the search evaluates the others as usual.
+            backend: "xml" converts the python files to xml and
+                evaluates the rules with lxml. "ast" evaluates the
+                rules directly over the python AST, the files are only
+                converted to xml if some rule needs the lxml fallback,
+                see `get_fallback_rules`. The inferred types are only
+                available in the xml backend, therefore the xml backend
+                is used if the types of some specification are
+                inferred.
+            profile_extensions: count the calls and the time of the
+                `pyastrx:` xpath functions in `extension_stats`.
+            inference_rules: the rules that will be searched. The
+                types are only inferred for the specifications with a
+                rule reading an inferred attribute, e.g. `@type`. None
+                infers the types of all the specifications.
+
+        The `symbol_index` with the symbols of the loaded python files
+        is only updated when a rule calls one of its functions, see
+        `get_symbol_index`.
+
+        """
         self.cache = Cache(file_cache)
         self._files: List[str] = []
         if match_params is None:
             match_params = {}
         self.match_params = match_params
         self.inference = inference
+        self.fused_rules = fused_rules
+        self.backend = backend
+        self._specifications = Specifications({})
+        self._inference_specifications: Optional[Set[str]] = None
+        self.set_inference_rules(inference_rules)
+        self._languages: Dict[str, str] = {}
+        self.profile_extensions = profile_extensions
+        self._extensions: Optional[LXMLExtensions] = None
+        self.extension_stats: Dict[str, ExtensionStats] = {}
+        self.symbol_index = SymbolIndex()
+        self._mypy_session: Optional[MypySession] = None
+        self._inference_cache: Optional[InferenceCache] = None
+        self.inference_stats = InferenceStats()
+
+    def get_symbol_index(self, rules: RulesDict) -> Optional[SymbolIndex]:
+        """The index of the symbols of the loaded python files, None
+        if the rules do not use it.
+
+        Only the files loaded or modified since the last call are
+        indexed again. The symbols are extracted when the xml is
+        created and kept in the cache, the files loaded by the AST
+        backend are parsed here.
+
+        """
+        if not uses_symbols(rules):
+            return None
+        for info in self.cache.values():
+            if info.language != "python":
+                continue
+            symbols = getattr(info, "symbols", None)
+            if symbols is None:
+                symbols = symbols_from_txt(info.txt, info.filename)
+                info.symbols = symbols
+            self.symbol_index.update(info.filename, symbols)
+        return self.symbol_index
+
+    def get_extensions(self, rules: RulesDict) -> LXMLExtensions:
+        """The extension functions of the searches in this process,
+        with the regexes of the rules already compiled."""
+        symbols = self.get_symbol_index(rules)
+        if self._extensions is None:
+            self._extensions = create_extensions(
+                self.match_params, rules, self.profile_extensions, symbols)
+        else:
+            self._extensions.compile_patterns(rules)
+            self._extensions.symbols = symbols
+        return self._extensions
+
+    def add_extension_stats(self, stats: Dict[str, ExtensionStats]) -> None:
+        """Accumulate the counters of the extension functions called
+        by the searches in `extension_stats`."""
+        for name, function_stats in stats.items():
+            total = self.extension_stats.setdefault(name, ExtensionStats())
+            total.calls += function_stats.calls
+            total.seconds += function_stats.seconds
+
+    def get_fallback_rules(self, rules: RulesDict) -> Dict[str, str]:
+        """The rules of python specifications that the AST backend
+        has to evaluate with lxml.
+
+        Returns:
+            The reason of the fallback of each rule expression
+
+        """
+        if self.backend != "ast":
+            return {}
+        fallbacks = {}
+        for expression, rule_info in rules.items():
+            spec_name = rule_info.specification_name
+            if self._languages.get(spec_name, "python") != "python":
+                continue
+            mark = f"[{spec_name}]"
+            reason = fallback_reason(expression[len(mark):])
+            if reason is not None:
+                fallbacks[expression] = reason
+        return fallbacks
+
+    def get_fused_xpaths(
+        self, specification_name: str
+    ) -> Optional[Tuple[str, ...]]:
+        """The xpaths of the fused rules of a specification.
+
+        The rules are not fused if the types are inferred, merging them
+        moves the definitions to their names and removes the
+        `annotation` fields, see `annotate_axml`.
+
+        """
+        if not self.fused_rules or self.should_infer(specification_name):
+            return None
+        xpaths = []
+        for expression, rule_info in self.fused_rules.items():
+            mark = f"[{rule_info.specification_name}]"
+            if rule_info.specification_name not in (
+                    specification_name, "inline"):
+                continue
+            if not expression.startswith(mark):
+                continue
+            xpaths.append(expression[len(mark):])
+        return tuple(xpaths)
 
     def search_file(
         self,
         filename: str,
         rules: RulesDict,
-        before_context: int = 0,
-        after_context: int = 0,
+        limits: Optional[SearchLimits] = None,
     ) -> Lines2Matches:
         info = self.cache.get(filename)
+        extensions = self.get_extensions(rules)
         matching_by_line = search_in_file_info(
-            info, rules, before_context, after_context, self.match_params
+            info, rules, self.match_params, limits, self.backend,
+            extensions,
         )
+        self.add_extension_stats(extensions.pop_stats())
         return matching_by_line
 
+    def get_repo_document(self) -> RepoDocument:
+        """The virtual `/Repo/File` document of the loaded python files,
+        see `pyastrx.search.repo_document`."""
+        # a file can be loaded by several specifications
+        infos = [
+            self.cache.get(filename)
+            for filename in dict.fromkeys(self._files)]
+        return RepoDocument(
+            [info for info in infos if info.language == "python"])
+
+    def evaluate_repo(self, xpath: str) -> Any:
+        """Evaluate a xpath over all the loaded python files at once,
+        e.g. `count(//ClassDef)`.
+
+        Returns:
+            A number, string or boolean, or the spans of the nodes of
+            each file for a node-set
+
+        """
+        rules = RulesDict({xpath: RuleInfo()})
+        document = self.get_repo_document()
+        value = evaluate_repo(document, xpath, self.get_extensions(rules))
+        self.store_tag_counts(document)
+        return value
+
+    def store_tag_counts(self, document: RepoDocument) -> None:
+        """Save in the file cache the tags counted by a search over
+        the repo document, the next searches skip the files without
+        the tags of the rules without parsing them."""
+        counted = {id(info) for info in document.counted()}
+        if len(counted) == 0:
+            return
+        for filename in dict.fromkeys(self._files):
+            info = self.cache.get(filename)
+            if id(info) in counted:
+                self.cache.set(filename, info)
+
+    def search_repo(self, rules: RulesDict) -> Files2Matches:
+        """Search rules over the virtual `/Repo/File` document, e.g.
+        `/Repo/File[.//ClassDef[@name='Config']]//Call`.
+
+        The rules that do not select nodes have no matches.
+
+        Returns:
+            The matches of each file with some match
+
+        """
+        document = self.get_repo_document()
+        extensions = self.get_extensions(rules)
+        matching_by_file: Dict[str, Expression2Match] = {}
+        for expression, rule_info in rules.items():
+            spec_name = rule_info.specification_name
+            if self._languages.get(spec_name, "python") != "python":
+                continue
+            mark = f"[{spec_name}]"
+            xpath = expression
+            if spec_name and expression.startswith(mark):
+                xpath = expression[len(mark):]
+            spans_by_file = evaluate_repo(document, xpath, extensions)
+            if not isinstance(spans_by_file, dict):
+                continue
+            for filename, spans in spans_by_file.items():
+                matching_by_file.setdefault(
+                    filename, Expression2Match({}))[expression] = \
+                    match_from_spans(spans)
+        self.add_extension_stats(extensions.pop_stats())
+        self.store_tag_counts(document)
+        return Files2Matches({
+            filename: group_by_line(matching_by_file[filename])
+            for filename in (file.info.filename for file in document.files)
+            if filename in matching_by_file
+        })
+
+    def get_code_context(
+        self,
+        filename: str,
+        lineno: int,
+        before_context: int = 0,
+        after_context: int = 0,
+    ) -> CodeContext:
+        """Extract the code around a line of a loaded file.
+
+        The search results do not carry the code context, the reports
+        call this method only for the matches they will show.
+
+        """
+        info = self.cache.get(filename)
+        return get_code_context(info, lineno, before_context, after_context)
+
     def load_file(
         self,
         filename: str,
@@ -68,13 +323,21 @@ class Repo:
         self._files = [filename]
         if not should_update:
             return self.cache.get(filename)
-        if language == "python":
+        if language == "python" and self.backend == "ast":
+            info = file2info(
+                filename=filename,
+                specification_name=specification_name,
+                normalize_ast=normalize_ast,
+            )
+            self.cache.set(filename, info)
+        elif language == "python":
             info = file2axml(
                 filename=filename,
                 specification_name=specification_name,
                 normalize_ast=normalize_ast,
                 infered_types=infered_types,
                 baxml=True,
+                fused_xpaths=self.get_fused_xpaths(specification_name),
             )
             self.cache.set(filename, info)
         elif language == "yaml":
@@ -85,6 +348,265 @@ class Repo:
             self.cache.set(filename, info)
         return info
 
+    def get_mypy_session(
+        self, follow_imports: Optional[str] = None
+    ) -> MypySession:
+        """The mypy build kept between the loads of the python files,
+        only the modified files and their dependents are checked
+        again.
+
+        Args:
+            follow_imports: the mode to follow the imports, by default
+                the one of the config. A new build is started if it
+                changes.
+
+        """
+        assert self.inference is not None
+        if follow_imports is None:
+            follow_imports = self.inference.follow_imports
+        session = self._mypy_session
+        if session is None or session.follow_imports != follow_imports:
+            cache_dir = None
+            if self.cache.file_cache:
+                # isolated from the cache of the user, by mypy version
+                # and configuration
+                engine = self.get_inference_cache().engine
+                cache_dir = str(Path(
+                    f".pyastrx/mypy_cache/{engine[:16]}/{follow_imports}"
+                ).resolve())
+            session = MypySession(cache_dir, follow_imports)
+            self._mypy_session = session
+        return session
+
+    def get_follow_imports(
+        self, files: List[str], symbols: Dict[str, ModuleSymbols]
+    ) -> str:
+        """The mode to follow the imports of the files, "skip" if they
+        import more loaded files than `InferenceConfig.max_closure`.
+        The skipped files are added to `inference_stats`."""
+        assert self.inference is not None
+        max_closure = self.inference.max_closure
+        if max_closure is None:
+            return self.inference.follow_imports
+        closure = import_closure(files, symbols) - set(files)
+        if len(closure) <= max_closure:
+            return self.inference.follow_imports
+        self.inference_stats.skipped.extend(sorted(closure))
+        return "skip"
+
+    def should_infer(self, specification_name: str) -> bool:
+        """True if the types of the files of a specification are
+        inferred, see `inference_rules`."""
+        if self.inference is None or not self.inference.run:
+            return False
+        specifications = self._inference_specifications
+        return specifications is None \
+            or specification_name in specifications \
+            or "inline" in specifications
+
+    def set_inference_rules(
+        self, inference_rules: Optional[RulesDict]
+    ) -> Set[str]:
+        """Infer the types only for the specifications with a rule
+        reading them, see `should_infer`. The xml backend is used if
+        some types are inferred.
+
+        Returns:
+            The loaded specifications whose types were not inferred
+            before
+
+        """
+        inferred = {
+            name for name in self._specifications if self.should_infer(name)}
+        self._inference_specifications = None
+        if inference_rules is not None:
+            self._inference_specifications = set()
+            for expression, rule_info in inference_rules.items():
+                mark = f"[{rule_info.specification_name}]"
+                if expression.startswith(mark):
+                    expression = expression[len(mark):]
+                if uses_inferred_types(expression):
+                    self._inference_specifications.add(
+                        rule_info.specification_name)
+        if self.inference is not None and self.inference.run \
+                and self._inference_specifications != set():
+            self.backend = "xml"
+        return {
+            name for name in self._specifications
+            if self.should_infer(name) and name not in inferred}
+
+    def set_match_params(self, match_params: MatchParams) -> None:
+        """Use new deny and allow lists, e.g. after pyastrx.yaml was
+        edited. The extension functions are created again."""
+        self.match_params = match_params
+        self._extensions = None
+
+    def set_inference(self, inference: Optional[InferenceConfig]) -> Set[str]:
+        """Use a new inference config, e.g. after pyastrx.yaml was
+        edited. The mypy build and the inference cache are created
+        again.
+
+        Returns:
+            The loaded specifications whose types are inferred with the
+            previous or the new config, their files must be converted
+            again
+
+        """
+        inferred = {
+            name for name in self._specifications if self.should_infer(name)}
+        self.inference = inference
+        self._mypy_session = None
+        self._inference_cache = None
+        return inferred | {
+            name for name in self._specifications if self.should_infer(name)}
+
+    def get_inference_cache(self) -> InferenceCache:
+        assert self.inference is not None
+        if self._inference_cache is None:
+            self._inference_cache = InferenceCache(
+                self.inference, persist=self.cache.file_cache)
+        return self._inference_cache
+
+    def get_infered_types(
+        self, files2load: List[str], specification_name: str
+    ) -> Tuple[List[str], Optional[List[List[ASTrXType]]]]:
+        """Get the types of the files from the inference cache and
+        infer only the files that are not in the cache.
+
+        The files importing an inferred file are inferred again. If
+        they are already loaded they are added to the files to load,
+        to be annotated with the new types.
+
+        Returns:
+            The files to load and their types, None if the inference
+            failed.
+
+        """
+        assert self.inference is not None
+        inference_cache = self.get_inference_cache()
+        follow_imports: str = self.inference.follow_imports
+        digests: Dict[str, str] = {}
+        symbols: Dict[str, ModuleSymbols] = {}
+        for filename, info in self.cache.items():
+            if info.specification_name == specification_name \
+                    and info.symbols is not None:
+                symbols[filename] = info.symbols
+        for filename in files2load:
+            txt = Path(filename).read_text(encoding="utf-8")
+            digests[filename] = source_digest(txt)
+            symbols[filename] = symbols_from_txt(txt, filename)
+        modules = self.inference.modules
+        excluded = {
+            filename for filename, file_symbols in symbols.items()
+            if not in_modules(file_symbols.module, modules)}
+        self.inference_stats.excluded += len(excluded.intersection(digests))
+        included = [
+            filename for filename in files2load if filename not in excluded]
+        if self.inference.what == "mypy" and len(included) > 0:
+            follow_imports = self.get_follow_imports(included, symbols)
+        keys = inference_keys(
+            included, dict(symbols), dict(digests), follow_imports)
+        missing = [
+            filename for filename in included
+            if inference_cache.get(keys[filename]) is None]
+        dependents = reverse_dependencies(missing, symbols) - excluded
+        if self.inference.what == "mypy" and len(missing) > 0:
+            # the build knows the targets affected by the modified files
+            session = self.get_mypy_session(follow_imports)
+            dependents.update(
+                filename for filename in session.update(missing)
+                if filename in symbols and filename not in excluded)
+        files2load = files2load + [
+            filename for filename in sorted(dependents)
+            if filename not in digests]
+        missing = missing + [
+            filename for filename in files2load
+            if filename in dependents and filename not in missing]
+        for filename in files2load:
+            if filename not in digests:
+                digests[filename] = source_digest(
+                    self.cache.get(filename).txt)
+        keys.update(inference_keys(
+            [filename for filename in files2load if filename not in keys],
+            dict(symbols), dict(digests), follow_imports))
+
+        if len(missing) > 0:
+            infered_types: List[List[ASTrXType]]
+            if self.inference.what == "pyre":
+                result_pyre, success = infer_types_pyre(missing)
+                infered_types = [
+                    pyre2astrx(file_types["types"])
+                    for file_types in result_pyre]
+            else:
+                result_mypy, success = self.get_mypy_session(
+                    follow_imports).infer_types(missing)
+                infered_types = [
+                    mypy2astrx(file_types["types"])
+                    for file_types in result_mypy]
+            if not success:
+                return files2load, None
+            for filename, file_types in zip(missing, infered_types):
+                inference_cache.set(keys[filename], file_types)
+
+        self.inference_stats.inferred += len(missing)
+        types_by_file: List[List[ASTrXType]] = []
+        for filename in files2load:
+            if filename in excluded:
+                types_by_file.append([])
+                continue
+            types = inference_cache.get(keys[filename])
+            assert types is not None
+            types_by_file.append(types)
+        self.inference_stats.cached += \
+            len(files2load) - len(missing) - len(excluded.intersection(
+                files2load))
+        return files2load, types_by_file
+
+    def convert_python_files(
+        self,
+        files2load: List[str],
+        specification_name: str,
+        normalize_ast: bool,
+        map_fn: Callable[..., Iterable[FileInfo]],
+        starmap_fn: Callable[..., Iterable[FileInfo]],
+    ) -> Tuple[List[str], List[FileInfo]]:
+        """Convert the python files to xml while their types are
+        inferred in a thread. The types are merged into the xml
+        afterwards, see `annotate_axml`, the files keep the xml without
+        types if the inference fails.
+
+        Args:
+            map_fn: the map used to convert the files, e.g. `Pool.map`
+            starmap_fn: the starmap used to merge the types
+
+        Returns:
+            The loaded files, with the files importing them, see
+            `get_infered_types`, and their infos.
+
+        """
+        convert = partial(
+            file2axml,
+            infered_types=None,
+            specification_name=specification_name,
+            normalize_ast=normalize_ast,
+            baxml=True,
+            fused_xpaths=self.get_fused_xpaths(specification_name),
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            inference = None
+            if self.should_infer(specification_name):
+                inference = executor.submit(
+                    self.get_infered_types, files2load, specification_name)
+            infos = list(map_fn(convert, files2load))
+            if inference is None:
+                return files2load, infos
+            loaded, infered_types = inference.result()
+        infos.extend(map_fn(convert, loaded[len(files2load):]))
+        if infered_types is not None:
+            infos = list(starmap_fn(
+                annotate_file_info, zip(infos, infered_types)))
+        return loaded, infos
+
     def load_python_files(
         self,
         files2load: List[str],
@@ -92,57 +614,40 @@ class Repo:
         parallel: bool = True,
         normalize_ast: bool = True,
         **kwargs,
-    ) -> None:
+    ) -> List[str]:
+        """Convert the python files and store them in the cache.
 
-        use_infered_types = False
-        inference_result: List[List[ASTrXType]]
-        if self.inference and self.inference.run:
-            if self.inference.what == "pyre":
-                inference_result_pyre, use_infered_types = infer_types_pyre(files2load) # noqa
-                if use_infered_types:
-                    inference_result = [
-                        pyre2astrx(infered_types["types"])
-                        for infered_types in inference_result_pyre
-                    ]
-            elif self.inference.what == "mypy":
-                inference_result_mypy, use_infered_types = infer_types_mypy(files2load) # noqa
-                if use_infered_types:
-                    inference_result = [
-                        mypy2astrx(infered_types["types"])
-                        for infered_types in inference_result_mypy
-                    ]
-        files_and_types = [
-            (filename, inference_result[i])
-            if use_infered_types else (filename, None)
-            for i, filename in enumerate(files2load)
-        ]
-        if parallel:
-            with Pool() as pool:
-                infos = pool.starmap(
-                    partial(
-                        file2axml,
-                        specification_name=specification_name,
-                        normalize_ast=normalize_ast,
-                        baxml=True,
-                    ),
-                    files_and_types,
-                )
-        else:
+        Returns:
+            The converted files, with the loaded files importing them
+            if their types were inferred.
+
+        """
+        if self.backend == "ast":
+            # reading the files is cheaper than sending them to a pool
             infos = [
-                self.load_file(
+                file2info(
                     filename,
                     specification_name=specification_name,
                     normalize_ast=normalize_ast,
-                    language="python",
-                    infered_types=infered_types,
                 )
-                for filename, infered_types in files_and_types
+                for filename in files2load
             ]
+        elif parallel:
+            with Pool() as pool:
+                files2load, infos = self.convert_python_files(
+                    files2load, specification_name, normalize_ast,
+                    pool.map, pool.starmap)
+        else:
+            files2load, infos = self.convert_python_files(
+                files2load, specification_name, normalize_ast, map, starmap)
 
+        inferred = self.should_infer(specification_name)
         for info, filename in zip(infos, files2load):
             if info is None:
                 raise Exception(f"Failed to convert {filename}")
+            info.inferred = inferred
             self.cache.set(filename, info)
+        return files2load
 
     def load_yaml_files(
         self, files2load: List[str],
@@ -160,9 +665,9 @@ class Repo:
                 )
         else:
             infos = [
-                self.load_file(
+                yaml2axml(
                     filename,
-                    specification_name=specification_name, language="yaml"
+                    specification_name=specification_name, baxml=True
                 )
                 for filename in files2load
             ]
@@ -177,25 +682,37 @@ class Repo:
         specification_name: str,
         language: Literal["python", "yaml"] = "python",
         **kwargs,
-    ) -> None:
+    ) -> List[str]:
+        """Load the files that are new or were modified since they were
+        cached, and the cached files converted with the types if they
+        are no longer inferred or the other way around.
+
+        Returns:
+            The converted files, see `load_python_files`.
 
+        """
+        self._languages[specification_name] = language
         files = [str(Path(file).resolve()) for file in files]
+        inferred = language == "python" \
+            and self.should_infer(specification_name)
         files2load = [
-            filename for filename in files if self.cache.update(filename)]
+            filename for filename in files
+            if self.cache.update(filename)
+            # cached with or without the types for other rules
+            or getattr(self.cache.get(filename), "inferred", False)
+            != inferred]
+        self._files = list(dict.fromkeys(self._files + files))
         if len(files2load) == 0:
-            self._files.extend(files)
-            return
+            return []
 
         if language == "python":
-            self.load_python_files(
+            return self.load_python_files(
                 files2load, specification_name=specification_name, **kwargs
             )
-        elif language == "yaml":
-            self.load_yaml_files(
-                files2load, specification_name=specification_name, **kwargs
-            )
-
-        self._files.extend(files)
+        self.load_yaml_files(
+            files2load, specification_name=specification_name, **kwargs
+        )
+        return files2load
 
     def load_folder(
         self,
@@ -243,9 +760,105 @@ class Repo:
         )
 
     def load_specifications(self, specifications: Specifications) -> None:
+        self.inference_stats = InferenceStats()
+        self._specifications = specifications
+        self._files = []
         for spec in specifications:
             self.load_specification(spec, specifications[spec])
 
+    def specification_of(self, filename: str) -> Optional[str]:
+        """The name of the loaded specification that owns a file, None
+        if the file is not part of any of them."""
+        path = Path(filename).resolve()
+        for name, spec in self._specifications.items():
+            if len(spec.files) > 0:
+                if any(Path(f).resolve() == path for f in spec.files):
+                    return name
+                continue
+            if not any(path.name.endswith(ext) for ext in spec.extensions):
+                continue
+            try:
+                relative = path.relative_to(Path(spec.folder).resolve())
+            except ValueError:
+                continue
+            if not spec.recursive and len(relative.parts) > 1:
+                continue
+            parts = (Path(spec.folder) / relative).parts
+            if any(d in parts for d in spec.exclude):
+                continue
+            return name
+        return None
+
+    def remove_file(self, filename: str) -> None:
+        """Forget a loaded file, e.g. after it was deleted."""
+        filename = str(Path(filename).resolve())
+        self._files = [f for f in self._files if f != filename]
+        self.cache.remove(filename)
+        self.symbol_index.remove(filename)
+
+    def forget_specifications(self, names: Set[str]) -> None:
+        """Forget the converted files of the specifications, and their
+        cache files, they are converted again by the next load."""
+        for filename, info in self.cache.items():
+            if info.specification_name in names:
+                self.cache.remove(filename, delete=True)
+
+    def get_symbol_dependents(
+        self, files: List[str], rules: RulesDict
+    ) -> List[str]:
+        """The loaded files whose matches may depend on the files
+        through the symbol functions of the rules, e.g.
+        `pyastrx:defined-in`, the files importing them."""
+        symbol_index = self.get_symbol_index(rules)
+        if symbol_index is None:
+            return []
+        modified = set(files)
+        symbols = dict(symbol_index.by_file)
+        for filename in files:
+            # the deleted files are no longer indexed
+            symbols.setdefault(filename, ModuleSymbols(module_name(filename)))
+        dependents = reverse_dependencies(files, symbols)
+        return [
+            filename for filename in self._files
+            if filename in dependents and filename not in modified]
+
+    def reload_files(self, files: List[str]) -> List[str]:
+        """Load again the modified, created or deleted files of the
+        loaded specifications, the other files are not visited.
+
+        Returns:
+            The files whose matches may have changed: the modified and
+            created files, the files importing them if their types are
+            inferred again, and the deleted files.
+
+        """
+        affected: List[str] = []
+        files_by_spec: Dict[str, List[str]] = {}
+        for filename in dict.fromkeys(
+                str(Path(file).resolve()) for file in files):
+            if not Path(filename).is_file():
+                if filename in self.cache:
+                    self.remove_file(filename)
+                    affected.append(filename)
+                continue
+            name = self.specification_of(filename)
+            if name is not None:
+                files_by_spec.setdefault(name, []).append(filename)
+        for name, spec_files in files_by_spec.items():
+            specs_dict = asdict(self._specifications[name])
+            del specs_dict["files"]
+            specs_dict["parallel"] = specs_dict["parallel"] \
+                and len(spec_files) > 1
+            try:
+                loaded = self.load_files(spec_files, name, **specs_dict)
+            except Exception:
+                # e.g. a syntax error, checked again by the next load
+                for filename in spec_files:
+                    self.cache.invalidate(filename)
+                raise
+            affected.extend(f for f in loaded if f not in affected)
+        return affected
+
     def get_files(self) -> List[str]:
         return self._files
 
@@ -259,34 +872,99 @@ class Repo:
             exit(1)
         return files[0]
 
+    def iter_search(
+        self,
+        rules: RulesDict,
+        parallel: bool = True,
+        limits: Optional[SearchLimits] = None,
+        ordered: bool = False,
+        buffer_size: int = 64,
+        files: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[str, Lines2Matches]]:
+        """Search the rules in the loaded files yielding the results
+        of each file as soon as they are available.
+
+        Args:
+            rules: the rules to search
+            parallel: if True, use a pool of processes
+            limits: grep-like limits (files with matches, first match,
+                count only and max matches by rule)
+            ordered: if True, the files are yielded in the same order
+                they were loaded. Otherwise, in the order the workers
+                finish them.
+            buffer_size: maximum number of files being searched or
+                waiting to be yielded in the ordered mode
+            files: the loaded files to search, all of them by default
+        Yields:
+            The filename and its matches
+
+        """
+        if files is None:
+            files = self._files
+        if not parallel:
+            for filename in files:
+                yield filename, self.search_file(filename, rules, limits)
+            return
+
+        search = partial(
+            search_in_file_item,
+            rules=rules,
+            match_params=self.match_params,
+            limits=limits,
+            backend=self.backend,
+        )
+        items = (
+            (filename, self.cache.get(filename)) for filename in files)
+        # the extension functions are created once per worker
+        with Pool(
+            initializer=init_search_worker,
+            initargs=(
+                self.match_params, tuple(rules.keys()),
+                self.profile_extensions, self.get_symbol_index(rules)),
+        ) as pool:
+            if not ordered:
+                for filename, line2matches, stats in pool.imap_unordered(
+                        search, items):
+                    self.add_extension_stats(stats)
+                    yield filename, line2matches
+                return
+            # bounded reorder buffer: the results that finish before
+            # their turn wait inside of the AsyncResult objects
+            pending: Deque[AsyncResult] = deque()
+            for item in items:
+                pending.append(pool.apply_async(search, (item,)))
+                if len(pending) >= buffer_size:
+                    filename, line2matches, stats = pending.popleft().get()
+                    self.add_extension_stats(stats)
+                    yield filename, line2matches
+            while pending:
+                filename, line2matches, stats = pending.popleft().get()
+                self.add_extension_stats(stats)
+                yield filename, line2matches
+
     def search_files(
         self,
         rules: RulesDict,
-        before_context: int = 0,
-        after_context: int = 0,
         parallel: bool = True,
+        limits: Optional[SearchLimits] = None,
     ) -> Files2Matches:
+        """Search the rules in all the loaded files.
 
-        file2matches = {}
-        if parallel:
-            with Pool() as pool:
-                matches_by_file = pool.map(
-                    partial(
-                        search_in_file_info,
-                        rules=rules,
-                        before_context=before_context,
-                        after_context=after_context,
-                        match_params=self.match_params,
-                    ),
-                    map(self.cache.get, self._files),
-                )
-            for filename, matches_by_line in zip(self._files, matches_by_file):
-                file2matches[filename] = matches_by_line
+        Args:
+            rules: the rules to search
+            parallel: if True, use a pool of processes
+            limits: grep-like limits (files with matches, first match,
+                count only and max matches by rule)
+        Returns:
+            The matches of each file
 
-        else:
-            for filename in self._files:
-                match_by_lines = self.search_file(
-                    filename, rules, before_context, after_context
-                )
-                file2matches[filename] = match_by_lines
+        """
+        file2matches = dict(
+            self.iter_search(
+                rules,
+                parallel=parallel,
+                limits=limits,
+                ordered=True,
+            )
+        )
         return Files2Matches(file2matches)
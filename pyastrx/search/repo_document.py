@@ -0,0 +1,303 @@
+"""A virtual `/Repo/File` document over the loaded python files.
+
+The document has a `Repo` root element with a `File` element for
+each python file, so a single xpath can relate several files:
+
+    /Repo/File[.//ClassDef[@name='Config']]//Call
+    count(//ClassDef)
+
+The AST of a file is only parsed when the evaluation steps inside of
+its `File` element. The number of elements of each tag, counted the
+first time and stored in the cache as `FileInfo.tag_counts`, skips
+the files without the tag of a `//Tag` step and answers
+`count(//Tag)` without parsing the files. The paths
+starting with `/Repo/File` are evaluated file by file, the tree of a
+file is released before the next one is parsed.
+
+The trees are the ones of the AST backend, without inferred types.
+
+"""
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pyastrx.axml.python.ast_tree import (
+    DocumentNode,
+    ElementNode,
+    Node,
+    txt2document,
+)
+from pyastrx.data_typing import FileInfo, Span
+from pyastrx.search.ast_search import (
+    Environment,
+    Evaluator,
+    compile_ast_xpath,
+    compile_expr,
+    uses_position,
+)
+from pyastrx.xml.misc import span_from_xml
+from pyastrx.xml.xpath_compiler import XPathSyntaxError
+from pyastrx.xml.xpath_extensions import LXMLExtensions
+from pyastrx.xml.xpath_parser import (
+    Path,
+    Step,
+    UnsupportedXPathError,
+    parse_xpath,
+)
+
+# the orders of the elements of each file start at (index + 1) << 32
+ORDER_BITS = 32
+
+
+class FileElement(ElementNode):
+    """The `File` element of a loaded file, its child is the `Module`
+    element of the file, parsed on demand.
+
+    Attributes:
+        info: the loaded file
+        index: the position of the file in the document
+        document: the tree of the file, None until it is needed
+
+    """
+    __slots__ = ("info", "index", "document", "counted")
+
+    def __init__(self, parent: Node, index: int, info: FileInfo) -> None:
+        first_order = (index + 1) << ORDER_BITS
+        super().__init__(parent, first_order, "File", info, ElementNode.FIELD)
+        self.end = first_order + (1 << ORDER_BITS) - 1
+        self.info = info
+        self.index = index
+        self.document: Optional[DocumentNode] = None
+        self.counted = False
+
+    def attribute_values(self) -> Dict[str, str]:
+        if self._values is None:
+            self._values = {
+                "path": self.info.filename,
+                "specification": self.info.specification_name,
+            }
+        return self._values
+
+    def parse(self) -> DocumentNode:
+        return txt2document(
+            self.info.txt, self.info.filename,
+            getattr(self.info, "normalize_ast", True), self.order + 1)
+
+    def materialize(self) -> DocumentNode:
+        """The tree of the file, parsed the first time."""
+        if self.document is None:
+            document = self.parse()
+            document.root.parent = self
+            self.children = [document.root]
+            self.document = document
+        return self.document
+
+    def release(self) -> None:
+        """Forget the tree of the file."""
+        self.document = None
+        self.children = []
+
+    def tag_counts(self) -> Dict[str, int]:
+        """The number of elements of each tag of the file.
+
+        The file is parsed the first time to count them, the counts
+        are kept in the `FileInfo`, see `RepoDocument.counted`.
+
+        """
+        counts = getattr(self.info, "tag_counts", None)
+        if not counts:
+            document = self.document or self.parse()
+            counts = {
+                tag: len(elements)
+                for tag, elements in document.elements_by_tag().items()}
+            self.info.tag_counts = counts
+            self.counted = True
+        return counts
+
+    def iter_children(self) -> List[Node]:
+        self.materialize()
+        return self.children
+
+
+class RepoElement(ElementNode):
+    """The `Repo` root element, its children are the files."""
+    __slots__ = ()
+
+    def __init__(self, parent: Node, end: int) -> None:
+        super().__init__(parent, 0, "Repo", None, ElementNode.FIELD)
+        self.end = end
+
+    def attribute_values(self) -> Dict[str, str]:
+        return {}
+
+
+class RepoDocument(DocumentNode):
+    """The document node of the virtual repository.
+
+    Attributes:
+        files: the `File` elements in the order of the loaded files
+
+    """
+    __slots__ = ("files",)
+
+    def __init__(self, infos: List[FileInfo]) -> None:
+        Node.__init__(self, None, ())
+        self.root = RepoElement(self, (len(infos) + 1) << ORDER_BITS)
+        self.files = [
+            FileElement(self.root, index, info)
+            for index, info in enumerate(infos)]
+        self.root.children = list(self.files)
+        self.by_tag = {"Repo": [self.root], "File": list(self.files)}
+
+    def counted(self) -> List[FileInfo]:
+        """The files whose tags were counted by this document."""
+        return [file.info for file in self.files if file.counted]
+
+
+class RepoEnvironment(Environment):
+    """Evaluate the `//Tag` steps and `count(//Tag)` file by file,
+    only over the files that have the tag."""
+    def __init__(
+        self, document: RepoDocument, extensions: LXMLExtensions
+    ) -> None:
+        super().__init__(document, extensions)
+        self.repo = document
+        self._file_orders: Dict[Tuple[int, str], List[int]] = {}
+        self._repo_elements: Dict[str, List[ElementNode]] = {}
+
+    def file_of(self, node: Node) -> Optional[FileElement]:
+        """The file of a node, None for the repository nodes."""
+        if len(node.key) == 0:
+            return None
+        index = (node.key[0] >> ORDER_BITS) - 1
+        if index < 0:
+            return None
+        return self.repo.files[index]
+
+    def release(self, file: FileElement) -> None:
+        file.release()
+        for key in [k for k in self._file_orders if k[0] == file.index]:
+            del self._file_orders[key]
+
+    def file_orders(self, file: FileElement, tag: str) -> List[int]:
+        orders = self._file_orders.get((file.index, tag))
+        if orders is None:
+            elements = file.materialize().elements_by_tag().get(tag, [])
+            orders = [element.order for element in elements]
+            self._file_orders[(file.index, tag)] = orders
+        return orders
+
+    def repo_elements(self, tag: str) -> List[ElementNode]:
+        elements = self._repo_elements.get(tag)
+        if elements is None:
+            elements = list(self.repo.by_tag.get(tag, []))
+            for file in self.repo.files:
+                if tag in file.tag_counts():
+                    elements.extend(
+                        file.materialize().elements_by_tag()[tag])
+            self._repo_elements[tag] = elements
+        return elements
+
+    def orders_by_tag(self, tag: str) -> List[int]:
+        orders = self._orders_by_tag.get(tag)
+        if orders is None:
+            orders = [element.order for element in self.repo_elements(tag)]
+            self._orders_by_tag[tag] = orders
+        return orders
+
+    def tag_elements(
+        self, node: Node, tag: str
+    ) -> Tuple[List[ElementNode], Callable[[], List[int]]]:
+        file = self.file_of(node)
+        if file is None:
+            return self.repo_elements(tag), partial(self.orders_by_tag, tag)
+        if tag not in file.tag_counts():
+            return [], list
+        elements = file.materialize().elements_by_tag()[tag]
+        return elements, partial(self.file_orders, file, tag)
+
+    def count_tag(self, node: Node, tag: str) -> Optional[int]:
+        if isinstance(node, FileElement):
+            return node.tag_counts().get(tag, 0)
+        if node.kind != "document" and node is not self.repo.root:
+            return None
+        counted = sum(
+            file.tag_counts().get(tag, 0) for file in self.repo.files)
+        if tag == "File":
+            counted += len(self.repo.files)
+        if tag == "Repo" and node.kind == "document":
+            counted += 1
+        return counted
+
+
+@lru_cache(maxsize=1024)
+def compile_file_path(xpath: str) -> Optional[Evaluator]:
+    """Compile `/Repo/File[preds]/rest` as `self::File[preds]/rest`,
+    to be evaluated over each file. None if the xpath has another
+    form or the predicates of `File` depend on its position."""
+    try:
+        expr = parse_xpath(xpath)
+    except (XPathSyntaxError, UnsupportedXPathError):
+        return None
+    if not isinstance(expr, Path) or not expr.absolute \
+            or expr.start is not None or len(expr.steps) < 2:
+        return None
+    repo_step, file_step = expr.steps[:2]
+    if repo_step != Step("child", "Repo") or file_step.axis != "child" \
+            or file_step.node_test != "File" \
+            or any(uses_position(p) for p in file_step.predicates):
+        return None
+    steps = (Step("self", "File", file_step.predicates),) + expr.steps[2:]
+    return compile_expr(Path(None, False, steps))
+
+
+def node_span(node: Node) -> Optional[Span]:
+    """The span of a matched node, the files match their first line."""
+    if isinstance(node, FileElement):
+        return Span(1, 0, 1, 0)
+    return span_from_xml(node)  # type: ignore
+
+
+def evaluate_repo(
+    document: RepoDocument, xpath: str, extensions: LXMLExtensions
+) -> Any:
+    """Evaluate a xpath over the virtual repository.
+
+    The context node is the `Repo` element. The symbol functions,
+    see `pyastrx.xml.symbol_index`, resolve the names of each file
+    only in the paths evaluated file by file.
+
+    Returns:
+        A number, string or boolean. A node-set is returned as the
+        spans of its nodes by filename.
+
+    Raises:
+        UnsupportedXPathError: the xpath is outside of the subset of
+            the AST backend
+
+    """
+    evaluator, reason = compile_ast_xpath(xpath)
+    if evaluator is None:
+        raise UnsupportedXPathError(reason)
+    env = RepoEnvironment(document, extensions)
+    spans_by_file: Dict[str, List[Optional[Span]]] = {}
+    by_file = compile_file_path(xpath)
+    if by_file is not None:
+        for file in document.files:
+            extensions.set_file(file.info.filename)
+            nodes = by_file(file, 1, 1, env)
+            if nodes:
+                spans_by_file[file.info.filename] = [
+                    node_span(node) for node in nodes]
+            env.release(file)
+        return spans_by_file
+    value = evaluator(document.root, 1, 1, env)
+    if not isinstance(value, list):
+        return value
+    for node in value:
+        owner = env.file_of(node)
+        if owner is not None:
+            spans_by_file.setdefault(owner.info.filename, []).append(
+                node_span(node))
+    for file in document.files:
+        file.release()
+    return spans_by_file
@@ -1,7 +1,8 @@
-from itertools import islice
+from array import array
+from itertools import accumulate, islice
 from typing import List
 
-from pyastrx.data_typing import CodeContext
+from pyastrx.data_typing import CodeContext, FileInfo
 
 
 def apply_context(
@@ -14,3 +15,52 @@ def apply_context(
     ])
 
     return context_list
+
+
+def build_line_offsets(txt: str) -> "array[int]":
+    """Create the offset of the beginning of each line of a text.
+
+    The offsets are stored in a compact array of unsigned ints, this
+    allows to slice any line of the text without splitting it. As with
+    `str.splitlines`, a final line break does not start a new line.
+
+    """
+    lines = txt.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    offsets = array("I", [0])
+    offsets.extend(accumulate(len(line) + 1 for line in lines))
+    return offsets
+
+
+def context_from_offsets(
+        txt: str, offsets: "array[int]",
+        index: int, before: int = 0, after: int = 0) -> CodeContext:
+    """Same as apply_context, but slicing the lines from the text
+    using the line offsets.
+
+    """
+    num_lines = len(offsets) - 1
+    if num_lines > 0 and offsets[num_lines - 1] >= len(txt):
+        # the empty line after the final line break of older caches
+        num_lines -= 1
+    start = max(0, index - before)
+    end = min(num_lines, index + 1 + after)
+    context_list = CodeContext([
+        (i+1, txt[offsets[i]:offsets[i+1]-1].rstrip("\r"))
+        for i in range(start, end)
+    ])
+    return context_list
+
+
+def get_code_context(
+        file_info: FileInfo,
+        lineno: int, before: int = 0, after: int = 0) -> CodeContext:
+    """Extract the code context of a line from a FileInfo obj."""
+    offsets = getattr(file_info, "line_offsets", None)
+    if offsets is None or len(offsets) == 0:
+        # FileInfo objs from older caches do not have the offsets
+        offsets = build_line_offsets(file_info.txt)
+        file_info.line_offsets = offsets
+    return context_from_offsets(
+        file_info.txt, offsets, lineno - 1, before, after)
@@ -1,97 +1,309 @@
-from typing import Dict, List, Tuple, Optional, Union
+from functools import partial
+from typing import (
+    Any, Callable, Dict, Iterable, List, Set, Tuple, Optional, Union)
 from io import BytesIO
 from lxml import etree
 
+from pyastrx.axml.python.ast2xml import txt2axml
+
 from pyastrx.data_typing import (
     Expression2Match,
+    ExtensionStats,
     FileInfo,
     Lines2Matches,
     Match,
     MatchesByLine,
     MatchParams,
     RulesDict,
+    SearchLimits,
+    Span,
 )
-from pyastrx.search.txt_tools import apply_context
-from pyastrx.xml.xpath_expressions import XpathExpressions
+from pyastrx.search.ast_search import search_ast
+from pyastrx.xml.misc import match_from_spans, span_from_xml
+from pyastrx.xml.symbol_index import SymbolIndex
+from pyastrx.xml.xpath_compiler import CompiledRule, compile_rules
 from pyastrx.xml.xpath_extensions import (
     LXMLExtensions,
-    __all_lxml_ext__,
     __lxml_namespaces__,
 )
+from pyastrx.xml.xpath_lists import (
+    ListParams,
+    inline_list_calls,
+    list_params,
+)
 
 
-def get_xml_el_value(
-    element: etree._Element, xpath_name: str
-) -> Tuple[List[int], bool]:
-    xpath_expr = getattr(XpathExpressions, xpath_name)
-    xml_result = element.xpath(xpath_expr)
-    if isinstance(xml_result, list):
-        result: List[int] = []
-        for r in xml_result:
-            if isinstance(r, float) or isinstance(r, str) or isinstance(r, int):
-                result.append(int(r))
-        return result, True
-    else:
-        return [0], False
+def evaluate_limited(
+    evaluator: etree.XPathElementEvaluator, xpath: str,
+    max_matches: Optional[int] = None, **variables: Any
+) -> Any:
+    """Evaluate a xpath keeping at most max_matches nodes.
+
+    The limit is pushed inside of the xpath expression, this allows
+    libxml2 to stop the evaluation as soon as enough nodes are found.
+    If the expression can not be wrapped (it is not a node-set) the
+    full result is sliced instead.
+
+    """
+    if max_matches is None:
+        return evaluator(xpath, **variables)
+    try:
+        return evaluator(
+            f"({xpath})[position() <= {max_matches}]", **variables)
+    except etree.XPathEvalError:
+        pass
+    result = evaluator(xpath, **variables)
+    if isinstance(result, list):
+        return result[:max_matches]
+    return result
+
+
+def collect_tags(
+    axml: Union[etree._Element, etree._ElementTree], tags: Set[str]
+) -> Dict[str, List[etree._Element]]:
+    """Group the elements of a tree by tag in a single traversal."""
+    nodes_by_tag: Dict[str, List[etree._Element]] = {tag: [] for tag in tags}
+    for element in axml.iter(*tags):
+        nodes_by_tag[element.tag].append(element)
+    return nodes_by_tag
+
 
+def evaluate_rule(
+    evaluator: etree.XPathElementEvaluator,
+    rule: CompiledRule,
+    nodes_by_tag: Optional[Dict[str, List[etree._Element]]],
+    max_matches: Optional[int] = None,
+    prefix_nodes: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """Evaluate a compiled rule.
 
-def linenos_from_xml(element: etree._Element) -> Tuple[List[int], List[int], bool]:
-    linenos, success_line = get_xml_el_value(element, "linenos")
-    cols_offset, success_col = get_xml_el_value(element, "cols_offset")
-    success = success_line and success_col
-    return linenos, cols_offset, success
+    If the elements were grouped by tag, the rules starting with
+    `//Tag` are evaluated only over the elements with that tag instead
+    of walking the whole tree again.
+
+    The nodes of a prefix shared by several rules are evaluated once
+    and stored in prefix_nodes, then only the suffix of each rule
+    is evaluated over them.
+
+    """
+    if prefix_nodes is not None and rule.prefix is not None \
+            and rule.suffix_xpath is not None:
+        prefix = rule.prefix.xpath
+        if prefix not in prefix_nodes:
+            prefix_nodes[prefix] = evaluate_rule(
+                evaluator, rule.prefix, nodes_by_tag)
+        nodes = prefix_nodes[prefix]
+        if isinstance(nodes, list):
+            if len(nodes) == 0:
+                return []
+            return evaluate_limited(
+                evaluator, rule.suffix_xpath, max_matches, prefix=nodes)
+    if nodes_by_tag is None or rule.tag is None \
+            or rule.dispatch_xpath is None:
+        return evaluate_limited(evaluator, rule.xpath, max_matches)
+    nodes = nodes_by_tag[rule.tag]
+    if rule.descendants_only and len(nodes) > 0 \
+            and nodes[0].getparent() is None:
+        nodes = nodes[1:]
+    if len(nodes) == 0:
+        return []
+    return evaluate_limited(
+        evaluator, rule.dispatch_xpath, max_matches, nodes=nodes)
 
 
 def search_evaluator(
-    mark_specification: str, rules: RulesDict, evaluator: etree.XPathElementEvaluator
+    mark_specification: str, rules: RulesDict,
+    evaluator: etree.XPathElementEvaluator,
+    limits: Optional[SearchLimits] = None,
+    axml: Optional[Union[etree._Element, etree._ElementTree]] = None,
+    lists: ListParams = (),
 ) -> Expression2Match:
+    """Evaluate the rules with a xpath evaluator of the file.
+
+    Args:
+        lists: the deny and allow lists that can be inlined in the
+            rules, see `pyastrx.xml.xpath_lists`
+
+    """
+    if limits is None:
+        limits = SearchLimits()
+    stop_at_first = limits.files_with_matches or limits.first_match
+    max_matches = 1 if stop_at_first else limits.max_matches
+    # replace the same length of the specification name in the expression
+    xpaths = {
+        expression: inline_list_calls(
+            expression[len(mark_specification):], lists)
+        for expression in rules.keys()
+    }
+    compiled_by_xpath = compile_rules(tuple(xpaths.values()))
+    compiled_rules = {
+        expression: compiled_by_xpath[xpath]
+        for expression, xpath in xpaths.items()
+    }
+    nodes_by_tag = None
+    dispatch_tags = []
+    for rule in compiled_rules.values():
+        if rule.prefix is not None:
+            rule = rule.prefix
+        if rule.tag is not None:
+            dispatch_tags.append(rule.tag)
+    # a single rule is cheaper to evaluate directly by libxml2
+    if axml is not None and len(dispatch_tags) > 1:
+        nodes_by_tag = collect_tags(axml, set(dispatch_tags))
+    prefix_nodes: Dict[str, Any] = {}
     matching_by_expression = Expression2Match({})
-    for expression, _ in rules.items():
-        # replace the same length of the specification name in the expression
-        xpath = expression[len(mark_specification) :]
+    for expression, rule in compiled_rules.items():
         try:
-            matching_elements = evaluator(xpath)
+            matching_elements = evaluate_rule(
+                evaluator, rule, nodes_by_tag, max_matches, prefix_nodes)
         except etree.XPathEvalError:
             continue
         if not isinstance(matching_elements, list):
             continue
-        line2cols: Dict[int, List[int]] = {}
-        for element in matching_elements:
-            if not isinstance(element, etree._Element):
-                continue
-            linenos, cols, success = linenos_from_xml(element)
-            if not success or len(linenos) == 0:
-                continue
-            col = cols[0]
-            line_num = linenos[0]
-            if line_num not in line2cols:
-                line2cols[line_num] = []
-            line2cols[line_num].append(col)
-
-        matching_by_expression[expression] = Match(line2cols, len(line2cols))
+        match = match_from_spans(
+            span_from_xml(element) for element in matching_elements
+            if isinstance(element, etree._Element)
+        )
+        matching_by_expression[expression] = match
+        if stop_at_first and match.num_matches > 0:
+            break
 
     return matching_by_expression
 
 
-def search_in_file_info(
+def search_fused(
+    mark_specification: str, rules: RulesDict,
+    fused_spans: Dict[str, List[Optional[Span]]],
+    limits: Optional[SearchLimits] = None,
+) -> Expression2Match:
+    """Get the matches of the rules that were matched during
+    the conversion of the file, see `pyastrx.xml.fused`."""
+    if limits is None:
+        limits = SearchLimits()
+    stop_at_first = limits.files_with_matches or limits.first_match
+    max_matches = 1 if stop_at_first else limits.max_matches
+    matching_by_expression = Expression2Match({})
+    for expression in rules.keys():
+        spans = fused_spans.get(expression[len(mark_specification):])
+        if spans is None:
+            continue
+        if max_matches is not None:
+            spans = spans[:max_matches]
+        match = match_from_spans(spans)
+        matching_by_expression[expression] = match
+        if stop_at_first and match.num_matches > 0:
+            break
+    return matching_by_expression
+
+
+def create_extensions(
+    match_params: Optional[MatchParams], rules: Iterable[str],
+    profile: bool = False, symbols: Optional[SymbolIndex] = None,
+) -> LXMLExtensions:
+    """The extension functions for a search of these rules."""
+    params = match_params.__dict__ if match_params is not None else {}
+    extensions = LXMLExtensions(**params, profile=profile, symbols=symbols)
+    extensions.compile_patterns(rules)
+    return extensions
+
+
+def search_xml(
     file_info: FileInfo,
+    mark_specification: str,
     rules: RulesDict,
-    before_context: int,
-    after_context: int,
     match_params: Optional[MatchParams],
-) -> Lines2Matches:
+    limits: Optional[SearchLimits] = None,
+    extensions: Optional[LXMLExtensions] = None,
+) -> Expression2Match:
+    """Evaluate the rules with lxml over the xml of the file.
+
+    Args:
+        extensions: the extension functions of the search, a new
+            object is created if None
 
-    extension_module = LXMLExtensions(**match_params.__dict__)
-    extensions = etree.Extension(extension_module, __all_lxml_ext__, ns="local-ns")
+    """
+    if extensions is None:
+        extensions = create_extensions(match_params, rules)
     axml: Union[etree._Element, etree._ElementTree]
-    if isinstance(file_info.axml, bytes):
+    if isinstance(file_info.axml, bytes) and len(file_info.axml) == 0:
+        # loaded by the AST backend, the xml is created on demand
+        axml = txt2axml(
+            file_info.txt, file_info.filename,
+            getattr(file_info, "normalize_ast", True))
+    elif isinstance(file_info.axml, bytes):
         axml = etree.parse(BytesIO(file_info.axml))
     else:
         axml = file_info.axml
 
     evaluator = etree.XPathEvaluator(
-        axml, namespaces=__lxml_namespaces__, extensions=extensions
+        axml, namespaces=__lxml_namespaces__,
+        extensions=extensions.etree_extension()
     )
+    return search_evaluator(
+        mark_specification, rules, evaluator, limits, axml,
+        list_params(match_params))
+
+
+def search_stages(
+    rules: RulesDict,
+    stages: List[Callable[[RulesDict], Expression2Match]],
+    limits: Optional[SearchLimits] = None,
+) -> Expression2Match:
+    """Search the rules with each stage, from the cheapest to the most
+    expensive one. Each stage returns only the rules that it was able
+    to evaluate, the remaining ones are passed to the next stage.
+
+    The result keeps the order of the rules. If the search stops at
+    the first match, only the rules before the first match found so
+    far are passed to the next stages.
+
+    """
+    stop_at_first = limits is not None and (
+        limits.files_with_matches or limits.first_match)
+    found = Expression2Match({})
+    pending = list(rules.keys())
+    for stage in stages:
+        if len(pending) == 0:
+            break
+        found.update(stage(RulesDict({k: rules[k] for k in pending})))
+        pending = [k for k in pending if k not in found]
+        if stop_at_first:
+            for i, expr in enumerate(rules.keys()):
+                if expr in found and found[expr].num_matches > 0:
+                    before = set(list(rules.keys())[:i])
+                    pending = [k for k in pending if k in before]
+                    break
+
+    matching_by_expr = Expression2Match({})
+    for expr in rules.keys():
+        if expr not in found:
+            continue
+        match = found[expr]
+        matching_by_expr[expr] = match
+        if stop_at_first and match.num_matches > 0:
+            break
+    return matching_by_expr
+
+
+def search_in_file_info(
+    file_info: FileInfo,
+    rules: RulesDict,
+    match_params: Optional[MatchParams],
+    limits: Optional[SearchLimits] = None,
+    backend: str = "xml",
+    extensions: Optional[LXMLExtensions] = None,
+) -> Lines2Matches:
+    """Search the rules of the file specification in a file.
+
+    Args:
+        backend: "xml" to evaluate the rules with lxml, "ast" to
+            evaluate them over the python AST. The rules that are not
+            supported by the AST backend are evaluated with lxml.
+        extensions: the extension functions, reused between files,
+            see `create_extensions`
+
+    """
+
     specification_name = file_info.specification_name
     just_one_rule = len(rules) == 1
     mark_spec = f"[{specification_name}]"
@@ -107,26 +319,99 @@ def search_in_file_info(
             if k.startswith(mark_spec) or v.specification_name == "inline"
         }
     )
-    matching_by_expr = search_evaluator(mark_spec, filtred_rules, evaluator)
+    if extensions is None:
+        extensions = create_extensions(match_params, filtred_rules)
+    extensions.set_file(file_info.filename)
+    fused_spans = getattr(file_info, "fused_spans", {})
+    stages: List[Callable[[RulesDict], Expression2Match]] = [
+        partial(search_fused, mark_spec, fused_spans=fused_spans,
+                limits=limits),
+    ]
+    if backend == "ast" and file_info.language == "python":
+        stages.append(partial(
+            search_ast, file_info, mark_spec,
+            match_params=match_params, limits=limits,
+            extensions=extensions))
+    stages.append(partial(
+        search_xml, file_info, mark_spec,
+        match_params=match_params, limits=limits, extensions=extensions))
+    return group_by_line(search_stages(filtred_rules, stages, limits))
+
 
+def group_by_line(matching_by_expr: Expression2Match) -> Lines2Matches:
+    """The matches of the rules in a file grouped by line."""
     match_expr_by_line = {}
     expr2num = {}
     for expr, match in matching_by_expr.items():
         for line_num, cols in match.cols_by_line.items():
             if line_num not in match_expr_by_line:
-                code_context = apply_context(
-                    file_info.txt.splitlines(),
-                    line_num - 1,
-                    before_context,
-                    after_context,
-                )
                 match_expr_by_line[line_num] = MatchesByLine(
-                    code_context, Expression2Match({})
+                    None, Expression2Match({})
                 )
             match_expr_by_line[line_num].match_by_expr[expr] = Match(
-                {line_num: cols}, match.num_matches
+                {line_num: cols}, match.num_matches,
+                {line_num: match.spans_by_line.get(line_num, [])}
             )
             expr2num[expr] = match.num_matches
-            expr2num[expr] = expr2num.get(expr, 0) + match.num_matches
 
     return Lines2Matches(match_expr_by_line, expr2num)
+
+
+def merge_by_line(
+    line2matches: List[Lines2Matches], expressions: List[str]
+) -> Lines2Matches:
+    """Merge the matches of several searches of a file, e.g. with
+    different rules, keeping only the expressions, in their order."""
+    matching_by_expr: Dict[str, Match] = {
+        expr: Match({}, 0, {}) for expr in expressions}
+    for searched in line2matches:
+        for line_num, matches_by_line in searched.matches.items():
+            for expr, match in matches_by_line.match_by_expr.items():
+                if expr not in matching_by_expr:
+                    continue
+                merged = matching_by_expr[expr]
+                merged.cols_by_line[line_num] = match.cols_by_line[line_num]
+                merged.spans_by_line[line_num] = \
+                    match.spans_by_line.get(line_num, [])
+                merged.num_matches = searched.num_matches_by_expr[expr]
+    return group_by_line(Expression2Match({
+        expr: match for expr, match in matching_by_expr.items()
+        if len(match.cols_by_line) > 0}))
+
+
+# the extension functions of a pool worker, see `init_search_worker`
+_worker_extensions: Optional[LXMLExtensions] = None
+
+
+def init_search_worker(
+    match_params: Optional[MatchParams], rules: Tuple[str, ...],
+    profile: bool = False, symbols: Optional[SymbolIndex] = None,
+) -> None:
+    """Create the extension functions once per pool worker."""
+    global _worker_extensions
+    _worker_extensions = create_extensions(
+        match_params, rules, profile, symbols)
+
+
+def search_in_file_item(
+    item: Tuple[str, FileInfo],
+    rules: RulesDict,
+    match_params: Optional[MatchParams],
+    limits: Optional[SearchLimits] = None,
+    backend: str = "xml",
+) -> Tuple[str, Lines2Matches, Dict[str, ExtensionStats]]:
+    """Same as search_in_file_info but keeps track of the filename.
+
+    This is used by the pool workers, because the results can arrive
+    in a different order than the files were sent. The counters of the
+    extension functions called by the search are also returned.
+
+    """
+    filename, file_info = item
+    extensions = _worker_extensions
+    if extensions is None:
+        extensions = create_extensions(match_params, rules)
+    line2matches = search_in_file_info(
+        file_info, rules, match_params, limits, backend, extensions
+    )
+    return filename, line2matches, extensions.pop_stats()
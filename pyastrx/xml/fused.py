@@ -0,0 +1,116 @@
+"""Match simple rules while the AST is converted to XML.
+
+The rules compiled by `compile_fused_rules` are checked by the
+`ast2xml` traversal itself: each element is tested when all its
+children were built, using the stack of the ancestor tags for the
+parent chain. The matches are stored as spans in the FileInfo, so
+the search does not need to evaluate these rules again.
+
+"""
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+
+from pyastrx.data_typing import Span
+from pyastrx.xml.misc import span_from_xml
+from pyastrx.xml.xpath_compiler import FusedRule, FusedStep
+
+
+def match_step(element: etree._Element, step: FusedStep) -> bool:
+    """Check the predicates of a step over a complete element."""
+    for name, value in step.attributes:
+        attribute = element.get(name)
+        if attribute is None:
+            return False
+        if value is not None and attribute != value:
+            return False
+    for path in step.children:
+        if element.find(path) is None:
+            return False
+    return True
+
+
+class FusedMatcher:
+    """Collect the matches of the fused rules during a traversal.
+
+    The traversal calls `enter` when an element is created and `exit`
+    once all its children were appended. Only the tags of the
+    ancestors are known at that moment, the predicates of the
+    ancestor steps are checked by `spans` when the tree is complete.
+
+    """
+    def __init__(self, rules: Tuple[FusedRule, ...]) -> None:
+        self.rules = rules
+        self.rules_by_tag: Dict[str, List[FusedRule]] = {}
+        for rule in rules:
+            tag = rule.steps[-1].tag
+            self.rules_by_tag.setdefault(tag, []).append(rule)
+        self._stack: List[str] = []
+        self._position = 0
+        self._found: Dict[str, List[Tuple[int, etree._Element]]] = {
+            rule.xpath: [] for rule in rules}
+
+    def enter(self, tag: str) -> int:
+        """Push a tag and return the position of its element
+        in document order."""
+        self._stack.append(tag)
+        self._position += 1
+        return self._position
+
+    def exit(self, element: etree._Element, position: int) -> None:
+        self._stack.pop()
+        rules = self.rules_by_tag.get(element.tag)
+        if rules is None:
+            return
+        for rule in rules:
+            if self.match_chain(rule) and match_step(
+                    element, rule.steps[-1]):
+                self._found[rule.xpath].append((position, element))
+
+    def match_chain(self, rule: FusedRule) -> bool:
+        """Check the tags of the ancestors of the current element."""
+        stack = self._stack
+        num_parents = len(rule.steps) - 1
+        if len(stack) < num_parents:
+            return False
+        if rule.anchored and len(stack) != num_parents:
+            return False
+        if rule.descendants_only and len(stack) == num_parents:
+            return False
+        for i in range(num_parents):
+            if stack[-1 - i] != rule.steps[-2 - i].tag:
+                return False
+        return True
+
+    def spans(self) -> Dict[str, List[Optional[Span]]]:
+        """The spans of the matches of each rule in document order.
+
+        Elements without location are kept as None, so that the
+        search can apply the same limits as in a xpath evaluation.
+
+        """
+        spans_by_xpath: Dict[str, List[Optional[Span]]] = {}
+        for rule in self.rules:
+            found = sorted(self._found[rule.xpath], key=lambda f: f[0])
+            parent_steps = rule.steps[:-1]
+            check_parents = any(
+                step.attributes or step.children for step in parent_steps)
+            spans: List[Optional[Span]] = []
+            for _, element in found:
+                if check_parents and not match_parents(
+                        element, parent_steps):
+                    continue
+                spans.append(span_from_xml(element))
+            spans_by_xpath[rule.xpath] = spans
+        return spans_by_xpath
+
+
+def match_parents(
+    element: etree._Element, parent_steps: Tuple[FusedStep, ...]
+) -> bool:
+    parent = element.getparent()
+    for step in reversed(parent_steps):
+        if parent is None or not match_step(parent, step):
+            return False
+        parent = parent.getparent()
+    return True
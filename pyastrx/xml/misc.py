@@ -1,8 +1,8 @@
 """Module for XML misc functions like printing."""
 from lxml import etree
-from typing import Union
+from typing import Dict, Iterable, List, Optional, Union
 from io import BytesIO
-from pyastrx.data_typing import AXML
+from pyastrx.data_typing import AXML, Match, Span
 
 
 def el_lxml2str(
@@ -14,3 +14,51 @@ def el_lxml2str(
     else:
         axml = el_lxml
     return str(etree.tostring(axml, pretty_print=pretty_print), "utf-8")
+
+
+def span_from_xml(element: etree._Element) -> Optional[Span]:
+    """Get the code location of a xml element.
+
+    The location is taken from the element itself or from the first
+    ancestor that has one. This walks the parents directly instead of
+    evaluating ancestor-or-self xpath expressions for each match.
+
+    Returns:
+        The (lineno, col_offset, end_lineno, end_col_offset) span or None
+        if neither the element nor its ancestors have a location.
+
+    """
+    el: Optional[etree._Element] = element
+    lineno = None
+    # the walk stops at the document nodes of the AST backend
+    while el is not None and hasattr(el, "get"):
+        lineno = el.get("lineno")
+        if lineno is not None:
+            break
+        el = el.getparent()
+    if el is None or lineno is None:
+        return None
+    try:
+        line = int(lineno)
+        col = int(el.get("col_offset", 0))
+        end_line = int(el.get("end_lineno", line))
+        end_col = int(el.get("end_col_offset", col))
+    except ValueError:
+        return None
+    return Span(line, col, end_line, end_col)
+
+
+def match_from_spans(spans: Iterable[Optional[Span]]) -> Match:
+    """Group the spans of the matched nodes by line."""
+    line2cols: Dict[int, List[int]] = {}
+    line2spans: Dict[int, List[Span]] = {}
+    for span in spans:
+        if span is None:
+            continue
+        line_num = span.lineno
+        if line_num not in line2cols:
+            line2cols[line_num] = []
+            line2spans[line_num] = []
+        line2cols[line_num].append(span.col_offset)
+        line2spans[line_num].append(span)
+    return Match(line2cols, len(line2cols), line2spans)
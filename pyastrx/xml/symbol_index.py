@@ -0,0 +1,99 @@
+"""A repository wide index of the module level symbols.
+
+The index answers the `pyastrx:defined-in`, `pyastrx:is-deprecated`
+and `pyastrx:imported-as` xpath functions with dictionary lookups,
+instead of joining the xml of every file in a rule.
+
+"""
+from typing import Dict, Optional, Tuple
+
+from pyastrx.data_typing import ModuleSymbols, SymbolDefinition
+
+# maximum number of modules re-exporting a name
+MAX_REEXPORTS = 8
+
+
+class SymbolIndex:
+    """The symbols of the loaded python files by module.
+
+    Attributes:
+        modules: the symbols of each module name
+        by_file: the symbols of each filename
+
+    """
+    def __init__(self) -> None:
+        self.modules: Dict[str, ModuleSymbols] = {}
+        self.by_file: Dict[str, ModuleSymbols] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_file)
+
+    def update(self, filename: str, symbols: ModuleSymbols) -> None:
+        """Add the symbols of a file, replacing its previous ones."""
+        previous = self.by_file.get(filename)
+        if previous is symbols:
+            return
+        if previous is not None:
+            self.remove(filename)
+        self.by_file[filename] = symbols
+        self.modules[symbols.module] = symbols
+
+    def remove(self, filename: str) -> None:
+        symbols = self.by_file.pop(filename, None)
+        if symbols is not None \
+                and self.modules.get(symbols.module) is symbols:
+            del self.modules[symbols.module]
+
+    def qualify(self, name: str, symbols: ModuleSymbols) -> Optional[str]:
+        """The fully qualified name of a (dotted) name used in a
+        module, None if the module does not define or import it."""
+        head, _, rest = name.partition(".")
+        if head in symbols.imports:
+            qualified = symbols.imports[head]
+        elif head in symbols.definitions:
+            qualified = f"{symbols.module}.{head}" \
+                if symbols.module else head
+        else:
+            return None
+        return f"{qualified}.{rest}" if rest else qualified
+
+    def find(
+        self, qualified: str
+    ) -> Tuple[str, Optional[Tuple[ModuleSymbols, SymbolDefinition]]]:
+        """Follow the re-exports of a fully qualified name.
+
+        Returns:
+            The qualified name of the definition and its module and
+            definition, None if it is not defined in the index
+
+        """
+        for _ in range(MAX_REEXPORTS):
+            parts = qualified.split(".")
+            for i in range(len(parts) - 1, 0, -1):
+                symbols = self.modules.get(".".join(parts[:i]))
+                if symbols is None:
+                    continue
+                name = ".".join(parts[i:])
+                definition = symbols.definitions.get(name)
+                if definition is not None:
+                    return qualified, (symbols, definition)
+                if parts[i] in symbols.imports:
+                    qualified = ".".join(
+                        [symbols.imports[parts[i]]] + parts[i + 1:])
+                    break
+                return qualified, None
+            else:
+                return qualified, None
+        return qualified, None
+
+    def resolve(
+        self, name: str, symbols: Optional[ModuleSymbols]
+    ) -> Tuple[str, Optional[Tuple[ModuleSymbols, SymbolDefinition]]]:
+        """The fully qualified name of a name used in a module and its
+        definition, see `find`. The name is empty if it is unknown."""
+        if symbols is None:
+            return "", None
+        qualified = self.qualify(name, symbols)
+        if qualified is None:
+            return "", None
+        return self.find(qualified)
@@ -0,0 +1,516 @@
+"""A small compiler for the xpath rules.
+
+The rules are plain xpath strings. This module splits them in tokens,
+steps and predicates, which allows to find rules that can be evaluated
+in a cheaper way than one full xpath evaluation per rule and file.
+
+"""
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    start: int
+    end: int
+
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<number>\d+(?:\.\d*)?|\.\d+)
+    |(?P<op>//|::|\.\.|!=|<=|>=|[/\[\]()@,|=<>+\-*.$])
+    |(?P<name>[A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*)?)
+    """,
+    re.VERBOSE,
+)
+
+# operators that can not be part of a plain location path
+_PATH_BREAKERS = {
+    "|", "=", "!=", "<", "<=", ">", ">=", "+", "-", ",", "$"}
+_COMPARISONS = {"=", "!=", "<", "<=", ">", ">="}
+_NAME_OPERATORS = {"and", "or", "div", "mod"}
+_NUMERIC_FUNCTIONS = {
+    "count", "sum", "string-length", "number",
+    "floor", "ceiling", "round", "position", "last"}
+_NODE_TYPES = {"node", "text", "comment", "processing-instruction"}
+_NCNAME_RE = re.compile(r"[A-Za-z_][\w.\-]*$")
+
+
+class XPathSyntaxError(ValueError):
+    """Raised when a xpath can not be tokenized."""
+
+
+def tokenize(xpath: str) -> List[Token]:
+    """Split a xpath expression in tokens, whitespaces are dropped."""
+    tokens: List[Token] = []
+    pos = 0
+    while pos < len(xpath):
+        m = _TOKEN_RE.match(xpath, pos)
+        if m is None:
+            raise XPathSyntaxError(
+                f"Invalid character {xpath[pos]!r} at {pos} in {xpath}")
+        kind = m.lastgroup
+        if kind != "ws" and kind is not None:
+            tokens.append(Token(kind, m.group(), m.start(), m.end()))
+        pos = m.end()
+    return tokens
+
+
+def is_operator_position(previous: Optional[Token]) -> bool:
+    """True if a token after `previous` should be read as an operator.
+
+    This follows the disambiguation rules of the xpath 1.0
+    specification for `*` and the operator names.
+
+    """
+    if previous is None:
+        return False
+    if previous.kind in ("string", "number", "name"):
+        return True
+    return previous.value in (")", "]", "*", ".", "..")
+
+
+def iter_depth(tokens: List[Token]) -> Iterator[Tuple[int, Token]]:
+    """Yield each token with its nesting depth of brackets
+    and parenthesis."""
+    depth = 0
+    for token in tokens:
+        if token.kind == "op" and token.value in ")]":
+            depth -= 1
+        yield depth, token
+        if token.kind == "op" and token.value in "([":
+            depth += 1
+
+
+def split_location_path(xpath: str) -> Optional[List[Tuple[str, str]]]:
+    """Split a location path in its steps.
+
+    Args:
+        xpath: a xpath expression
+    Returns:
+        A list of (separator, step) where the separator is "/", "//" or
+        "" for the first step of a relative path. None if the xpath
+        is not a plain location path, e.g. an union or a function call.
+
+    """
+    try:
+        tokens = tokenize(xpath)
+    except XPathSyntaxError:
+        return None
+    if len(tokens) == 0:
+        return None
+    steps: List[Tuple[str, str]] = []
+    separator = ""
+    step_start: Optional[int] = None
+    previous: Optional[Token] = None
+    for depth, token in iter_depth(tokens):
+        if depth < 0:
+            return None
+        if depth > 0 or token.value in "])":
+            previous = token
+            continue
+        if token.kind == "op" and token.value in _PATH_BREAKERS:
+            return None
+        if token.kind == "number":
+            return None
+        if token.value == "*" and is_operator_position(previous):
+            return None
+        if token.value == "(" and (
+                previous is None or previous.value not in _NODE_TYPES):
+            # a function call or a parenthesized expression
+            return None
+        if token.kind == "name" and token.value in _NAME_OPERATORS \
+                and is_operator_position(previous):
+            return None
+        if token.kind == "op" and token.value in ("/", "//"):
+            if step_start is not None:
+                steps.append((separator, xpath[step_start:token.start]))
+            elif len(steps) > 0 or separator:
+                return None
+            separator = token.value
+            step_start = None
+        elif step_start is None:
+            step_start = token.start
+        previous = token
+    if step_start is None:
+        return None
+    steps.append((separator, xpath[step_start:].strip()))
+    return [(sep, step.strip()) for sep, step in steps]
+
+
+def split_step(step: str) -> Tuple[str, List[str]]:
+    """Split a step in its node test and its predicates."""
+    tokens = tokenize(step)
+    node_test_end = len(step)
+    predicates: List[str] = []
+    predicate_start = 0
+    for depth, token in iter_depth(tokens):
+        if token.value == "[" and depth == 0:
+            node_test_end = min(node_test_end, token.start)
+            predicate_start = token.end
+        elif token.value == "]" and depth == 0:
+            predicates.append(step[predicate_start:token.start].strip())
+    return step[:node_test_end].strip(), predicates
+
+
+def is_position_free(predicate: str) -> bool:
+    """True if the predicate does not depend on the context position.
+
+    The predicates `[1]`, `[last()]`, `[count(x)]` or `[@lineno - 4]`
+    select nodes by their position. These can not be evaluated outside of the
+    original step, so they are conservatively rejected.
+
+    """
+    try:
+        tokens = tokenize(predicate)
+    except XPathSyntaxError:
+        return False
+    if len(tokens) == 0:
+        return False
+    has_logic = False
+    has_arithmetic = False
+    previous: Optional[Token] = None
+    for depth, token in iter_depth(tokens):
+        if token.kind == "name" and token.value in ("position", "last"):
+            return False
+        if depth == 0:
+            if token.kind == "op" and token.value in _COMPARISONS:
+                has_logic = True
+            elif token.kind == "name" and token.value in ("and", "or") \
+                    and is_operator_position(previous):
+                has_logic = True
+            elif token.kind == "op" and token.value in ("+", "-"):
+                has_arithmetic = True
+            elif token.value in ("*", "div", "mod") \
+                    and is_operator_position(previous):
+                has_arithmetic = True
+        previous = token
+    if has_logic:
+        return True
+    if has_arithmetic:
+        # a number, e.g. `[@lineno - 4]`, selects by position
+        return False
+    first = tokens[0]
+    if first.kind == "number" or first.value in ("-", "(", "$"):
+        return False
+    if first.kind == "name" and first.value in _NUMERIC_FUNCTIONS:
+        return False
+    return True
+
+
+@dataclass
+class CompiledRule:
+    """The xpath of a rule and the cheaper ways to evaluate it.
+
+    Attributes:
+        xpath: the xpath expression of the rule
+        tag: the leading tag of a `//Tag[...]` rule. The rule can be
+            evaluated over the elements with this tag collected
+            in a single traversal of the tree.
+        dispatch_xpath: the xpath to be evaluated with the variable
+            `$nodes` holding the elements with the tag
+        descendants_only: the rule starts with `.//Tag`, therefore the
+            root element is not a candidate
+        prefix: a location path prefix shared with other rules
+        suffix_xpath: the xpath to be evaluated with the variable
+            `$prefix` holding the nodes selected by the prefix
+
+    """
+    xpath: str
+    tag: Optional[str] = None
+    dispatch_xpath: Optional[str] = None
+    descendants_only: bool = False
+    prefix: Optional["CompiledRule"] = None
+    suffix_xpath: Optional[str] = None
+
+
+@lru_cache(maxsize=4096)
+def compile_rule(xpath: str) -> CompiledRule:
+    """Compile a xpath rule.
+
+    A rule like `//Tag[pred]/rest` selects the same nodes as
+    `$nodes[pred]/rest` where `$nodes` are all the elements with the
+    tag `Tag`, as long as the predicates do not depend on the
+    position of the nodes. The same is valid for `.//Tag[pred]/rest`
+    evaluated from the root element, excluding the root itself.
+
+    """
+    steps = split_location_path(xpath)
+    if steps is None or len(steps) == 0:
+        return CompiledRule(xpath)
+    descendants_only = False
+    if steps[0] == ("", ".") and len(steps) > 1:
+        descendants_only = True
+        steps = steps[1:]
+    separator, first_step = steps[0]
+    if separator != "//":
+        return CompiledRule(xpath)
+    node_test, predicates = split_step(first_step)
+    if _NCNAME_RE.match(node_test) is None:
+        return CompiledRule(xpath)
+    if not all(is_position_free(p) for p in predicates):
+        return CompiledRule(xpath)
+    rest = join_steps(steps[1:])
+    dispatch_xpath = "$nodes" + "".join(f"[{p}]" for p in predicates) + rest
+    return CompiledRule(xpath, node_test, dispatch_xpath, descendants_only)
+
+
+def join_steps(steps: List[Tuple[str, str]]) -> str:
+    return "".join(f"{sep}{step}" for sep, step in steps)
+
+
+def is_expensive_prefix(steps: List[Tuple[str, str]]) -> bool:
+    """Only prefixes that walk the tree or filter nodes are worth
+    sharing, e.g. `/Module` is cheaper to evaluate again."""
+    for separator, step in steps:
+        if separator == "//" or "[" in step:
+            return True
+    return False
+
+
+@lru_cache(maxsize=256)
+def compile_rules(xpaths: Tuple[str, ...]) -> Dict[str, CompiledRule]:
+    """Compile a set of rules sharing the common location path prefixes.
+
+    Each rule is assigned to the longest prefix that it shares with
+    at least one other rule. The prefix is evaluated once and the
+    remaining steps of each rule are applied over its nodes through
+    `$prefix/rest`, which selects the same nodes as the original rule.
+
+    Args:
+        xpaths: the xpath expressions of the rules
+    Returns:
+        The compiled rule of each xpath
+
+    """
+    compiled = {xpath: compile_rule(xpath) for xpath in xpaths}
+    steps_by_xpath: Dict[str, List[Tuple[str, str]]] = {}
+    for xpath in compiled.keys():
+        steps = split_location_path(xpath)
+        if steps is not None and len(steps) > 1:
+            steps_by_xpath[xpath] = steps
+
+    num_rules_by_prefix: Dict[str, int] = {}
+    for steps in steps_by_xpath.values():
+        for k in range(1, len(steps)):
+            prefix = join_steps(steps[:k])
+            num_rules_by_prefix[prefix] = num_rules_by_prefix.get(
+                prefix, 0) + 1
+
+    prefix_by_xpath: Dict[str, int] = {}
+    for xpath, steps in steps_by_xpath.items():
+        for k in range(len(steps) - 1, 0, -1):
+            if not is_expensive_prefix(steps[:k]):
+                continue
+            if num_rules_by_prefix[join_steps(steps[:k])] > 1:
+                prefix_by_xpath[xpath] = k
+                break
+
+    # the longest prefix of a rule may not be the longest of the others
+    num_rules_by_prefix = {}
+    for xpath, k in prefix_by_xpath.items():
+        prefix = join_steps(steps_by_xpath[xpath][:k])
+        num_rules_by_prefix[prefix] = num_rules_by_prefix.get(prefix, 0) + 1
+
+    for xpath, k in prefix_by_xpath.items():
+        steps = steps_by_xpath[xpath]
+        prefix = join_steps(steps[:k])
+        if num_rules_by_prefix[prefix] < 2:
+            continue
+        compiled[xpath] = replace(
+            compiled[xpath],
+            prefix=compile_rule(prefix),
+            suffix_xpath="$prefix" + join_steps(steps[k:]),
+        )
+    return compiled
+
+
+class FusedStep(NamedTuple):
+    """A step of a rule that can be matched during the conversion.
+
+    Attributes:
+        tag: the tag of the element
+        attributes: the (name, value) pairs that the element must
+            have, a None value only requires the attribute
+        children: the relative paths of children that must exist
+
+    """
+    tag: str
+    attributes: Tuple[Tuple[str, Optional[str]], ...] = ()
+    children: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class FusedRule:
+    """A rule made of a parent chain of simple steps.
+
+    Attributes:
+        xpath: the xpath expression of the rule
+        steps: the parent chain, the last step is the matched element
+        anchored: the first step is the root element, e.g. `/Module/body`
+        descendants_only: the rule starts with `.//`, the first step
+            can not be the root element
+
+    """
+    xpath: str
+    steps: Tuple[FusedStep, ...]
+    anchored: bool = False
+    descendants_only: bool = False
+
+
+def split_and(tokens: List[Token]) -> List[List[Token]]:
+    """Split the tokens of a predicate by the top level `and`."""
+    parts: List[List[Token]] = [[]]
+    previous: Optional[Token] = None
+    for depth, token in iter_depth(tokens):
+        if depth == 0 and token.kind == "name" and token.value == "and" \
+                and is_operator_position(previous):
+            parts.append([])
+        else:
+            parts[-1].append(token)
+        previous = token
+    return parts
+
+
+def is_simple_name(token: Token) -> bool:
+    return token.kind == "name" and ":" not in token.value \
+        and _NCNAME_RE.match(token.value) is not None \
+        and token.value not in _NODE_TYPES
+
+
+def is_child_path(tokens: List[Token]) -> bool:
+    """True for paths like `a/b[@c='d']/e`, these are evaluated by
+    the ElementPath of lxml with the same meaning as in xpath."""
+    i = 0
+    while i < len(tokens):
+        if not is_simple_name(tokens[i]):
+            return False
+        i += 1
+        values = [token.value for token in tokens[i:i + 6]]
+        if values[:2] == ["[", "@"] and len(values) >= 4 \
+                and tokens[i + 2].kind == "name" and values[3] == "]":
+            i += 4
+        elif values[:2] == ["[", "@"] and len(values) == 6 \
+                and tokens[i + 2].kind == "name" and values[3] == "=" \
+                and tokens[i + 4].kind == "string" and values[5] == "]":
+            i += 6
+        if i == len(tokens):
+            return True
+        if tokens[i].value != "/" or i + 1 == len(tokens):
+            return False
+        i += 1
+    return False
+
+
+def fuse_step(step: str) -> Optional[FusedStep]:
+    """Convert a step to a FusedStep.
+
+    Only the predicates of the forms `@name`, `@name='value'` and
+    `child/path`, joined by `and`, are accepted.
+
+    """
+    node_test, predicates = split_step(step)
+    if _NCNAME_RE.match(node_test) is None or ":" in node_test:
+        return None
+    attributes: List[Tuple[str, Optional[str]]] = []
+    children: List[str] = []
+    for predicate in predicates:
+        try:
+            tokens = tokenize(predicate)
+        except XPathSyntaxError:
+            return None
+        for part in split_and(tokens):
+            values = [token.value for token in part]
+            kinds = [token.kind for token in part]
+            if kinds == ["op", "name"] and values[0] == "@":
+                attributes.append((values[1], None))
+            elif kinds == ["op", "name", "op", "string"] \
+                    and values[0] == "@" and values[2] == "=":
+                attributes.append((values[1], values[3][1:-1]))
+            elif is_child_path(part):
+                children.append(predicate[part[0].start:part[-1].end])
+            else:
+                return None
+    return FusedStep(node_test, tuple(attributes), tuple(children))
+
+
+@lru_cache(maxsize=4096)
+def compile_fused_rule(xpath: str) -> Optional[FusedRule]:
+    """Compile a rule to be matched during the AST to XML conversion.
+
+    The rule must be a location path like `//A[@x='y']/b/C[d/E]`,
+    that is a `//`, `.//` or `/` followed by a parent chain of simple
+    steps. Returns None for any other rule.
+
+    """
+    steps = split_location_path(xpath)
+    if steps is None or len(steps) == 0:
+        return None
+    descendants_only = False
+    if steps[0] == ("", ".") and len(steps) > 1:
+        descendants_only = True
+        steps = steps[1:]
+    separator = steps[0][0]
+    if separator not in ("/", "//"):
+        return None
+    if descendants_only and separator != "//":
+        return None
+    if any(sep != "/" for sep, _ in steps[1:]):
+        return None
+    fused_steps: List[FusedStep] = []
+    for _, step in steps:
+        fused_step = fuse_step(step)
+        if fused_step is None:
+            return None
+        fused_steps.append(fused_step)
+    return FusedRule(
+        xpath, tuple(fused_steps), separator == "/", descendants_only)
+
+
+@lru_cache(maxsize=256)
+def compile_fused_rules(xpaths: Tuple[str, ...]) -> Tuple[FusedRule, ...]:
+    """Compile the rules that can be fused, the others are dropped."""
+    fused_rules = []
+    for xpath in dict.fromkeys(xpaths):
+        rule = compile_fused_rule(xpath)
+        if rule is not None:
+            fused_rules.append(rule)
+    return tuple(fused_rules)
+
+
+# attributes set by `encode_type` from the inferred types, the
+# mypy attributes starting with `is_` are also inferred
+INFERRED_ATTRIBUTES = {"type", "fullname", "node_name"}
+
+
+@lru_cache(maxsize=4096)
+def uses_inferred_types(xpath: str) -> bool:
+    """True if a xpath may read an attribute of the inferred types.
+
+    The attributes are found by name after `@` or `attribute::`, any
+    attribute wildcard or a xpath that can not be tokenized counts as
+    a use.
+
+    """
+    try:
+        tokens = tokenize(xpath)
+    except XPathSyntaxError:
+        return True
+    for i, token in enumerate(tokens[:-1]):
+        if token.value == "@":
+            name = tokens[i + 1]
+        elif token.value == "attribute" and i + 2 < len(tokens) \
+                and tokens[i + 1].value == "::":
+            name = tokens[i + 2]
+        else:
+            continue
+        if name.kind != "name" or name.value in INFERRED_ATTRIBUTES \
+                or name.value.startswith("is_") \
+                or name.value in _NODE_TYPES:
+            return True
+    return False
@@ -1,19 +1,155 @@
 """All the xpath extensions should be defined here."""
 import re
-from typing import Dict, List, Any
+from functools import lru_cache
+from time import perf_counter
+from typing import (
+    Any, Callable, Collection, Dict, FrozenSet, Iterable, List, Optional,
+    Pattern, Tuple,
+)
 
+from pyastrx.data_typing import ExtensionStats, ModuleSymbols
 from pyastrx.exceptions import MissingYAMLConfig
+from pyastrx.xml.symbol_index import SymbolIndex
+from pyastrx.xml.xpath_compiler import XPathSyntaxError, tokenize
 
 
 XPathContext = Any
+_REGEX_FUNCTIONS = {"pyastrx:match", "pyastrx:search"}
+_SYMBOL_FUNCTIONS = ("defined-in", "is-deprecated", "imported-as")
+
+
+def counted(
+    function: Callable[..., Any], stats: ExtensionStats
+) -> Callable[..., Any]:
+    """Count the calls and the time of an extension function."""
+    def counted_function(*args: Any) -> Any:
+        start = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            stats.calls += 1
+            stats.seconds += perf_counter() - start
+    return counted_function
+
+
+@lru_cache(maxsize=4096)
+def find_patterns(xpath: str) -> Tuple[str, ...]:
+    """The regex literals passed to `pyastrx:match` and
+    `pyastrx:search` in a xpath."""
+    try:
+        tokens = tokenize(xpath)
+    except XPathSyntaxError:
+        return ()
+    patterns = []
+    for i in range(len(tokens) - 2):
+        if tokens[i].value in _REGEX_FUNCTIONS \
+                and tokens[i + 1].value == "(" \
+                and tokens[i + 2].kind == "string":
+            patterns.append(tokens[i + 2].value[1:-1])
+    return tuple(patterns)
+
+
+def uses_symbols(xpaths: Iterable[str]) -> bool:
+    """True if some xpath calls a function of the symbol index."""
+    return any(
+        f"pyastrx:{name}" in xpath
+        for xpath in xpaths for name in _SYMBOL_FUNCTIONS)
+
+
+def first_string(value: Any) -> str:
+    """The string value of a xpath argument, the first node of a
+    node-set."""
+    if isinstance(value, list):
+        if len(value) == 0:
+            return ""
+        value = value[0]
+    if isinstance(value, str):
+        return str(value)
+    if hasattr(value, "string_value"):
+        return value.string_value()
+    if hasattr(value, "itertext"):
+        return "".join(value.itertext())
+    return str(value)
 
 
 class LXMLExtensions:
+    """The `pyastrx:` functions of the xpath rules.
+
+    A single object is meant to be used for all the files of a search,
+    e.g. one per pool worker:
+
+    - the deny and allow lists are converted to frozensets the first
+      time they are used. The small lists are usually inlined in the
+      rules, see `pyastrx.xml.xpath_lists`, so these are the large ones.
+    - the regexes of `match` and `search` are compiled once and kept in
+      a registry, `re` only caches the last 512 patterns.
+    - with `profile`, `stats` counts the calls and the time of each
+      function. The counters cost more than a regex match, they are
+      off by default.
+    - `defined-in`, `is-deprecated` and `imported-as` look up the
+      names of the current file, see `set_file`, in the symbol index.
+
+    """
     def __init__(
-            self, deny_dict: Dict[str, List[str]],
-            allow_dict: Dict[str, List[str]]) -> None:
+            self, deny_dict: Optional[Dict[str, List[str]]],
+            allow_dict: Optional[Dict[str, List[str]]],
+            profile: bool = False,
+            symbols: Optional[SymbolIndex] = None) -> None:
         self.deny_dict = deny_dict
         self.allow_dict = allow_dict
+        self._deny_sets: Dict[str, FrozenSet[str]] = {}
+        self._allow_sets: Dict[str, FrozenSet[str]] = {}
+        self.patterns: Dict[str, Pattern[str]] = {}
+        self.stats: Dict[str, ExtensionStats] = {
+            name: ExtensionStats() for name in __all_lxml_ext__}
+        self.functions: Dict[str, Callable[..., Any]] = {}
+        for method_name in __all_lxml_ext__:
+            function = getattr(self, method_name)
+            if profile:
+                function = counted(function, self.stats[method_name])
+            self.functions[method_name] = function
+        self._etree_extension: Optional[Dict[Any, Any]] = None
+        self.symbols = symbols
+        self.module: Optional[ModuleSymbols] = None
+
+    def set_file(self, filename: str) -> None:
+        """Set the file whose names are resolved by the functions
+        of the symbol index."""
+        self.module = None
+        if self.symbols is not None:
+            self.module = self.symbols.by_file.get(filename)
+
+    def etree_extension(self) -> Dict[Any, Any]:
+        """The functions of this object for a lxml evaluator."""
+        if self._etree_extension is None:
+            self._etree_extension = {
+                ("local-ns", name): self.functions[method_name]
+                for method_name, name in __all_lxml_ext__.items()
+            }
+        return self._etree_extension
+
+    def compile_patterns(self, xpaths: Iterable[str]) -> None:
+        """Compile the regex literals of the rules."""
+        for xpath in xpaths:
+            for pattern in find_patterns(xpath):
+                self.get_pattern(pattern)
+
+    def get_pattern(self, pattern: str) -> Pattern[str]:
+        compiled = self.patterns.get(pattern)
+        if compiled is None:
+            compiled = re.compile(pattern)
+            self.patterns[pattern] = compiled
+        return compiled
+
+    def pop_stats(self) -> Dict[str, ExtensionStats]:
+        """The counters of the functions called since the last pop."""
+        called = {}
+        for name, stats in self.stats.items():
+            if stats.calls > 0:
+                called[name] = ExtensionStats(stats.calls, stats.seconds)
+                stats.calls = 0
+                stats.seconds = 0.0
+        return called
 
     def lxml_any_in(
             self, _: XPathContext,
@@ -30,8 +166,11 @@ class LXMLExtensions:
 
         """
 
+        checked: Collection[str] = values_check
+        if isinstance(values_check, list):
+            checked = set(values_check)
         for value in values:
-            if value in values_check:
+            if value in checked:
                 return True
         return False
 
@@ -54,13 +193,16 @@ class LXMLExtensions:
             raise MissingYAMLConfig(
                 "march_params: deny_list",
                 "Create first a deny_list inside of the yaml config")
-        try:
-            deny_list = self.deny_dict[list_name]
-        except KeyError:
-            raise MissingYAMLConfig(
-                f"deny_list: {list_name}",
-                f"Create first a attribute named {list_name} "
-                + "inside of match_params:deny_list")
+        deny_list = self._deny_sets.get(list_name)
+        if deny_list is None:
+            try:
+                deny_list = frozenset(self.deny_dict[list_name])
+            except KeyError:
+                raise MissingYAMLConfig(
+                    f"deny_list: {list_name}",
+                    f"Create first a attribute named {list_name} "
+                    + "inside of match_params:deny_list")
+            self._deny_sets[list_name] = deny_list
         for value in values:
             if value in deny_list:
                 return True
@@ -84,13 +226,16 @@ class LXMLExtensions:
             raise MissingYAMLConfig(
                 "march_params: allow_list",
                 "Create first a allow_list inside of the yaml config")
-        try:
-            allow_list = self.allow_dict[list_name]
-        except KeyError:
-            raise MissingYAMLConfig(
-                f"allow_list: {list_name}",
-                f"Create first a attribute named {list_name} "
-                + "inside of match_params:allow_list")
+        allow_list = self._allow_sets.get(list_name)
+        if allow_list is None:
+            try:
+                allow_list = frozenset(self.allow_dict[list_name])
+            except KeyError:
+                raise MissingYAMLConfig(
+                    f"allow_list: {list_name}",
+                    f"Create first a attribute named {list_name} "
+                    + "inside of match_params:allow_list")
+            self._allow_sets[list_name] = allow_list
 
         for value in values:
             if value not in allow_list:
@@ -100,19 +245,59 @@ class LXMLExtensions:
     def lxml_match(
             self, _: XPathContext,
             pattern: str, strings: List[str]) -> bool:
+        match = self.get_pattern(pattern).match
         for s in strings:
-            if re.match(pattern, s) is not None:
+            if match(s) is not None:
                 return True
         return False
 
     def lxml_search(
             self, _: XPathContext,
             pattern: str, strings: List[str]) -> bool:
+        search = self.get_pattern(pattern).search
         for s in strings:
-            if re.search(pattern, s) is not None:
+            if search(s) is not None:
                 return True
         return False
 
+    def lxml_defined_in(self, _: XPathContext, name: Any) -> str:
+        """The module where a name used in the current file is
+        defined, following the imports and re-exports of the repo.
+
+        Returns:
+            str: the module name, empty if the name is not defined
+                in the loaded files
+
+        """
+        if self.symbols is None:
+            return ""
+        _, found = self.symbols.resolve(first_string(name), self.module)
+        if found is None:
+            return ""
+        return found[0].module
+
+    def lxml_is_deprecated(self, _: XPathContext, name: Any) -> bool:
+        """True if a name used in the current file refers to a
+        definition with a `deprecated` decorator."""
+        if self.symbols is None:
+            return False
+        _, found = self.symbols.resolve(first_string(name), self.module)
+        return found is not None and found[1].deprecated
+
+    def lxml_imported_as(self, _: XPathContext, name: Any) -> str:
+        """The fully qualified name of a name imported by the current
+        file, e.g. `os.path.join` for `join` after
+        `from os.path import join`. Empty if it is not imported.
+
+        """
+        if self.symbols is None or self.module is None:
+            return ""
+        text = first_string(name)
+        if text.partition(".")[0] not in self.module.imports:
+            return ""
+        qualified, _ = self.symbols.resolve(text, self.module)
+        return qualified
+
 
 __all_lxml_ext__ = {
     "lxml_any_in": "any-in",
@@ -120,6 +305,9 @@ __all_lxml_ext__ = {
     "lxml_allow_list": "allow-list",
     "lxml_match": "match",
     "lxml_search": "search",
+    "lxml_defined_in": "defined-in",
+    "lxml_is_deprecated": "is-deprecated",
+    "lxml_imported_as": "imported-as",
 }
 
 __lxml_namespaces__ = {"pyastrx": 'local-ns'}
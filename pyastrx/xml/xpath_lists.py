@@ -0,0 +1,216 @@
+"""Inline the lists of the match params into the xpath rules.
+
+`pyastrx:deny-list`, `pyastrx:allow-list` and `pyastrx:any-in` are
+Python callbacks, lxml calls them for each candidate node. When the
+list is small they are replaced by xpath string functions, which
+libxml2 evaluates without leaving C:
+
+    pyastrx:deny-list('names', @id)
+        -> (not(contains(@id, '|'))
+            and contains('|a|b|', concat('|', @id, '|')))
+    pyastrx:allow-list('names', @id)
+        -> (@id and (contains(@id, '|')
+            or not(contains('|a|b|', concat('|', @id, '|')))))
+    pyastrx:any-in(A, B) -> ((A) = (B))
+
+The lists are only inlined for a single attribute, e.g. `@id`, and
+`any-in` for attributes or text nodes, the callbacks compare the
+elements themselves otherwise. A chain of `@id = 'a' or ...` would
+evaluate the attribute once per value, which is slower than the
+callback. The search in the joined string is linear, so the large
+lists keep the frozensets of `LXMLExtensions`.
+
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pyastrx.data_typing import MatchParams
+from pyastrx.xml.xpath_compiler import Token, XPathSyntaxError, tokenize
+from pyastrx.xml.xpath_parser import (
+    Path,
+    UnionExpr,
+    UnsupportedXPathError,
+    parse_xpath,
+)
+
+MAX_INLINE_VALUES = 32
+_SEPARATORS = "|,; /"
+
+# (kind, list name, values) where values is None if the list
+# can not be inlined
+ListParams = Tuple[Tuple[str, str, Optional[Tuple[str, ...]]], ...]
+
+_LIST_FUNCTIONS = {
+    "pyastrx:deny-list": "deny",
+    "pyastrx:allow-list": "allow",
+}
+
+
+def list_params(match_params: Optional[MatchParams]) -> ListParams:
+    """The hashable description of the lists used to inline a rule."""
+    if match_params is None:
+        return ()
+    params = []
+    lists_by_kind = (
+        ("deny", match_params.deny_dict),
+        ("allow", match_params.allow_dict),
+    )
+    for kind, lists in lists_by_kind:
+        if lists is None:
+            continue
+        for name, values in lists.items():
+            inline = values is not None \
+                and len(values) <= MAX_INLINE_VALUES \
+                and all(isinstance(value, str) for value in values) \
+                and join_values(values) is not None
+            params.append(
+                (kind, name, tuple(values) if inline else None))
+    return tuple(params)
+
+
+def quote(value: str) -> Optional[str]:
+    """A xpath literal of the value, None if it has both quotes."""
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    return None
+
+
+def join_values(values: Sequence[str]) -> Optional[Tuple[str, str]]:
+    """The values joined by a separator that none of them contains,
+    as a xpath literal, and the separator literal."""
+    for separator in _SEPARATORS:
+        if any(separator in value for value in values):
+            continue
+        joined = quote(separator + separator.join(values) + separator)
+        if joined is not None:
+            return joined, f"'{separator}'"
+    return None
+
+
+def is_string_nodes(expr: Any) -> bool:
+    """True if the expression selects attributes or text nodes."""
+    if isinstance(expr, UnionExpr):
+        return is_string_nodes(expr.left) and is_string_nodes(expr.right)
+    if not isinstance(expr, Path) or len(expr.steps) == 0:
+        return False
+    last_step = expr.steps[-1]
+    return last_step.axis == "attribute" or last_step.node_test == "text()"
+
+
+def is_attribute(expr: Any) -> bool:
+    """True if the expression is a single named attribute."""
+    return isinstance(expr, Path) and not expr.absolute \
+        and len(expr.steps) == 1 and expr.steps[0].axis == "attribute" \
+        and expr.steps[0].node_test != "*" \
+        and len(expr.steps[0].predicates) == 0
+
+
+def split_arguments(
+    tokens: List[Token], open_index: int
+) -> Optional[Tuple[List[Tuple[int, int]], int]]:
+    """The source ranges of the arguments of a call and the index of
+    its closing parenthesis."""
+    depth = 0
+    arguments = []
+    start = tokens[open_index].end
+    for i in range(open_index, len(tokens)):
+        token = tokens[i]
+        if token.kind != "op":
+            continue
+        if token.value in "([":
+            depth += 1
+        elif token.value in ")]":
+            depth -= 1
+            if depth == 0:
+                arguments.append((start, token.start))
+                return arguments, i
+        elif token.value == "," and depth == 1:
+            arguments.append((start, token.start))
+            start = token.end
+    return None
+
+
+def inline_call(
+    function: str, arguments: List[str],
+    lists: Dict[Tuple[str, str], Optional[Tuple[str, ...]]],
+) -> Optional[str]:
+    try:
+        parsed = [parse_xpath(argument) for argument in arguments]
+    except (XPathSyntaxError, UnsupportedXPathError):
+        return None
+    if function == "pyastrx:any-in":
+        if len(parsed) != 2 or not all(map(is_string_nodes, parsed)):
+            return None
+        left, right = (argument.strip() for argument in arguments)
+        return f"(({left}) = ({right}))"
+    if len(parsed) != 2 or not is_attribute(parsed[1]):
+        return None
+    name = arguments[0].strip()
+    if len(name) < 2 or name[0] not in "'\"" or name[-1] != name[0]:
+        return None
+    values = lists.get((_LIST_FUNCTIONS[function], name[1:-1]))
+    if values is None:
+        return None
+    attribute = arguments[1].strip()
+    if len(values) == 0:
+        return "false()" if function == "pyastrx:deny-list" \
+            else f"boolean({attribute})"
+    joined, separator = join_values(values)  # type: ignore
+    # a missing attribute is the empty string for contains
+    contains = f"contains({joined}, concat({separator}, {attribute}," \
+        + f" {separator}))"
+    # a value with the separator, e.g. 'a|b', would match several values
+    has_separator = f"contains({attribute}, {separator})"
+    if function == "pyastrx:deny-list":
+        if "" in values:
+            return f"({attribute} and not({has_separator}) and {contains})"
+        return f"(not({has_separator}) and {contains})"
+    return f"({attribute} and ({has_separator} or not({contains})))"
+
+
+@lru_cache(maxsize=4096)
+def inline_list_calls(xpath: str, lists: ListParams) -> str:
+    """Replace the calls to the list extensions that can be evaluated
+    as plain xpath. The other calls are kept as they are.
+
+    Args:
+        xpath: the rule expression
+        lists: the lists of the match params, see `list_params`
+
+    """
+    try:
+        tokens = tokenize(xpath)
+    except XPathSyntaxError:
+        return xpath
+    lists_by_key = {(kind, name): values for kind, name, values in lists}
+    replacements = []
+    i = 0
+    while i < len(tokens) - 1:
+        token = tokens[i]
+        is_call = token.kind == "name" and tokens[i + 1].value == "(" \
+            and (token.value in _LIST_FUNCTIONS
+                 or token.value == "pyastrx:any-in")
+        if not is_call:
+            i += 1
+            continue
+        split = split_arguments(tokens, i + 1)
+        if split is None:
+            return xpath
+        ranges, close_index = split
+        arguments = [
+            inline_list_calls(xpath[start:end], lists)
+            for start, end in ranges]
+        inlined = inline_call(token.value, arguments, lists_by_key)
+        if inlined is None and arguments != [
+                xpath[start:end] for start, end in ranges]:
+            # keep the call, but with its inlined arguments
+            inlined = f"{token.value}({','.join(arguments)})"
+        if inlined is not None:
+            replacements.append(
+                (token.start, tokens[close_index].end, inlined))
+        i = close_index + 1
+    for start, end, inlined in reversed(replacements):
+        xpath = xpath[:start] + inlined + xpath[end:]
+    return xpath
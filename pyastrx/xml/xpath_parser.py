@@ -0,0 +1,341 @@
+"""A parser of xpath 1.0 expressions.
+
+The expressions are parsed into a small tree of named tuples that can
+be evaluated over other trees than lxml, see `pyastrx.search.ast_search`.
+The variables, the namespace axis and the node tests for comments and
+processing instructions are not supported.
+
+"""
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from pyastrx.xml.xpath_compiler import (
+    Token,
+    XPathSyntaxError,
+    is_operator_position,
+    tokenize,
+)
+
+
+class UnsupportedXPathError(ValueError):
+    """Raised for valid xpath expressions outside of the subset."""
+
+
+class Literal(NamedTuple):
+    value: str
+
+
+class Number(NamedTuple):
+    value: float
+
+
+class FunctionCall(NamedTuple):
+    name: str
+    args: Tuple[Any, ...]
+
+
+class BinaryOp(NamedTuple):
+    op: str
+    left: Any
+    right: Any
+
+
+class Negate(NamedTuple):
+    expr: Any
+
+
+class UnionExpr(NamedTuple):
+    left: Any
+    right: Any
+
+
+class Step(NamedTuple):
+    """A location step.
+
+    Attributes:
+        axis: the axis name, e.g. child, attribute or ancestor
+        node_test: a name, `*`, `node()` or `text()`
+        predicates: the predicate expressions
+
+    """
+    axis: str
+    node_test: str
+    predicates: Tuple[Any, ...] = ()
+
+
+class Path(NamedTuple):
+    """A location path, optionally starting from a filter expression.
+
+    Attributes:
+        start: the filter expression, None for a location path
+        absolute: the path starts from the document node
+        steps: the location steps
+
+    """
+    start: Any
+    absolute: bool
+    steps: Tuple[Step, ...]
+
+
+class Filter(NamedTuple):
+    primary: Any
+    predicates: Tuple[Any, ...]
+
+
+AXES = {
+    "ancestor", "ancestor-or-self", "attribute", "child", "descendant",
+    "descendant-or-self", "following", "following-sibling", "parent",
+    "preceding", "preceding-sibling", "self",
+}
+REVERSE_AXES = {
+    "ancestor", "ancestor-or-self", "preceding", "preceding-sibling"}
+_NODE_TESTS = {"node", "text"}
+_UNSUPPORTED_NODE_TESTS = {"comment", "processing-instruction"}
+_DESCENDANT_OR_SELF = Step("descendant-or-self", "node()")
+
+
+class _Parser:
+    """Recursive descent parser following the xpath 1.0 grammar."""
+    def __init__(self, xpath: str) -> None:
+        self.xpath = xpath
+        self.tokens = tokenize(xpath)
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        pos = self.pos + offset
+        if pos < len(self.tokens):
+            return self.tokens[pos]
+        return None
+
+    def previous(self) -> Optional[Token]:
+        if self.pos == 0:
+            return None
+        return self.tokens[self.pos - 1]
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise XPathSyntaxError(f"Unexpected end of {self.xpath}")
+        self.pos += 1
+        return token
+
+    def expect(self, value: str) -> Token:
+        token = self.next()
+        if token.value != value or token.kind == "string":
+            raise XPathSyntaxError(
+                f"Expected {value!r} at {token.start} in {self.xpath}")
+        return token
+
+    def at_op(self, *values: str) -> bool:
+        token = self.peek()
+        return token is not None and token.kind == "op" \
+            and token.value in values
+
+    def at_operator_name(self, *values: str) -> bool:
+        token = self.peek()
+        return token is not None and token.kind == "name" \
+            and token.value in values \
+            and is_operator_position(self.previous())
+
+    def parse(self) -> Any:
+        expr = self.parse_or()
+        token = self.peek()
+        if token is not None:
+            raise XPathSyntaxError(
+                f"Unexpected {token.value!r} at {token.start}"
+                + f" in {self.xpath}")
+        return expr
+
+    def parse_or(self) -> Any:
+        expr = self.parse_and()
+        while self.at_operator_name("or"):
+            self.next()
+            expr = BinaryOp("or", expr, self.parse_and())
+        return expr
+
+    def parse_and(self) -> Any:
+        expr = self.parse_equality()
+        while self.at_operator_name("and"):
+            self.next()
+            expr = BinaryOp("and", expr, self.parse_equality())
+        return expr
+
+    def parse_equality(self) -> Any:
+        expr = self.parse_relational()
+        while self.at_op("=", "!="):
+            op = self.next().value
+            expr = BinaryOp(op, expr, self.parse_relational())
+        return expr
+
+    def parse_relational(self) -> Any:
+        expr = self.parse_additive()
+        while self.at_op("<", "<=", ">", ">="):
+            op = self.next().value
+            expr = BinaryOp(op, expr, self.parse_additive())
+        return expr
+
+    def parse_additive(self) -> Any:
+        expr = self.parse_multiplicative()
+        while self.at_op("+", "-"):
+            op = self.next().value
+            expr = BinaryOp(op, expr, self.parse_multiplicative())
+        return expr
+
+    def parse_multiplicative(self) -> Any:
+        expr = self.parse_unary()
+        while True:
+            if self.at_op("*") and is_operator_position(self.previous()):
+                op = self.next().value
+            elif self.at_operator_name("div", "mod"):
+                op = self.next().value
+            else:
+                return expr
+            expr = BinaryOp(op, expr, self.parse_unary())
+
+    def parse_unary(self) -> Any:
+        if self.at_op("-"):
+            self.next()
+            return Negate(self.parse_unary())
+        return self.parse_union()
+
+    def parse_union(self) -> Any:
+        expr = self.parse_path()
+        while self.at_op("|"):
+            self.next()
+            expr = UnionExpr(expr, self.parse_path())
+        return expr
+
+    def is_primary_start(self) -> bool:
+        token = self.peek()
+        if token is None:
+            return False
+        if token.kind in ("string", "number"):
+            return True
+        if token.kind == "op":
+            return token.value in ("(", "$")
+        following = self.peek(1)
+        return token.kind == "name" and following is not None \
+            and following.value == "(" \
+            and token.value not in _NODE_TESTS \
+            and token.value not in _UNSUPPORTED_NODE_TESTS
+
+    def parse_path(self) -> Any:
+        if not self.is_primary_start():
+            return self.parse_location_path()
+        primary = self.parse_primary()
+        predicates = self.parse_predicates()
+        expr = primary
+        if predicates:
+            expr = Filter(primary, predicates)
+        if not self.at_op("/", "//"):
+            return expr
+        return Path(expr, False, tuple(self.parse_relative_steps(True)))
+
+    def parse_location_path(self) -> Any:
+        if self.at_op("/"):
+            self.next()
+            if self.is_step_start():
+                return Path(
+                    None, True, tuple(self.parse_relative_steps(False)))
+            return Path(None, True, ())
+        if self.at_op("//"):
+            return Path(None, True, tuple(self.parse_relative_steps(True)))
+        return Path(None, False, tuple(self.parse_relative_steps(False)))
+
+    def is_step_start(self) -> bool:
+        token = self.peek()
+        if token is None:
+            return False
+        if token.kind == "name":
+            return True
+        return token.kind == "op" and token.value in (".", "..", "@", "*")
+
+    def parse_relative_steps(self, separator_first: bool) -> List[Step]:
+        steps: List[Step] = []
+        if not separator_first:
+            steps.append(self.parse_step())
+        while self.at_op("/", "//"):
+            if self.next().value == "//":
+                steps.append(_DESCENDANT_OR_SELF)
+            steps.append(self.parse_step())
+        return steps
+
+    def parse_step(self) -> Step:
+        token = self.next()
+        if token.kind == "op" and token.value == ".":
+            return Step("self", "node()")
+        if token.kind == "op" and token.value == "..":
+            return Step("parent", "node()")
+        axis = "child"
+        if token.kind == "op" and token.value == "@":
+            axis = "attribute"
+            token = self.next()
+        elif token.kind == "name" and self.at_op("::"):
+            if token.value == "namespace":
+                raise UnsupportedXPathError("namespace axis")
+            if token.value not in AXES:
+                raise XPathSyntaxError(f"Unknown axis {token.value}")
+            axis = token.value
+            self.next()
+            token = self.next()
+        node_test = self.parse_node_test(token)
+        return Step(axis, node_test, self.parse_predicates())
+
+    def parse_node_test(self, token: Token) -> str:
+        if token.kind == "op" and token.value == "*":
+            return "*"
+        if token.kind != "name":
+            raise XPathSyntaxError(
+                f"Expected a node test at {token.start} in {self.xpath}")
+        if self.at_op("("):
+            if token.value in _UNSUPPORTED_NODE_TESTS:
+                raise UnsupportedXPathError(f"{token.value}()")
+            if token.value not in _NODE_TESTS:
+                raise XPathSyntaxError(f"Unknown node test {token.value}")
+            self.next()
+            self.expect(")")
+            return f"{token.value}()"
+        if ":" in token.value:
+            raise UnsupportedXPathError("namespaced names")
+        return token.value
+
+    def parse_predicates(self) -> Tuple[Any, ...]:
+        predicates = []
+        while self.at_op("["):
+            self.next()
+            predicates.append(self.parse_or())
+            self.expect("]")
+        return tuple(predicates)
+
+    def parse_primary(self) -> Any:
+        token = self.next()
+        if token.kind == "string":
+            return Literal(token.value[1:-1])
+        if token.kind == "number":
+            return Number(float(token.value))
+        if token.value == "$":
+            raise UnsupportedXPathError("variables")
+        if token.value == "(":
+            expr = self.parse_or()
+            self.expect(")")
+            return expr
+        self.expect("(")
+        args = []
+        if not self.at_op(")"):
+            args.append(self.parse_or())
+            while self.at_op(","):
+                self.next()
+                args.append(self.parse_or())
+        self.expect(")")
+        return FunctionCall(token.value, tuple(args))
+
+
+def parse_xpath(xpath: str) -> Any:
+    """Parse a xpath 1.0 expression.
+
+    Raises:
+        XPathSyntaxError: if the expression is not valid
+        UnsupportedXPathError: if the expression uses variables,
+            namespaces, comments or processing instructions
+
+    """
+    return _Parser(xpath).parse()
@@ -0,0 +1,3 @@
+from symbols.legacy import old_api
+
+__all__ = ["old_api"]
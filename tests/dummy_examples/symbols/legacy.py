@@ -0,0 +1,19 @@
+from warnings import deprecated
+
+
+@deprecated("use new_api")
+def old_api(x):
+    return new_api(x)
+
+
+def new_api(x):
+    return x
+
+
+class Client:
+    @deprecated("use send")
+    def post(self, data):
+        return self.send(data)
+
+    def send(self, data):
+        return data
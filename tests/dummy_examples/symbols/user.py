@@ -0,0 +1,12 @@
+import os.path
+from symbols import old_api
+from symbols.legacy import new_api as api, Client
+from . import legacy
+
+
+def run(data):
+    old_api(data)
+    api(data)
+    legacy.old_api(data)
+    Client().post(data)
+    return os.path.join("a", "b")
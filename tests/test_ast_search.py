@@ -0,0 +1,181 @@
+import json
+
+import pytest
+from lxml import etree
+
+from pyastrx.axml.python.ast2xml import txt2axml
+from pyastrx.axml.python.ast_tree import ElementNode, txt2document
+from pyastrx.data_typing import MatchParams, RuleInfo, RulesDict
+from pyastrx.search import Repo
+from pyastrx.search.ast_search import (
+    Environment,
+    compile_ast_xpath,
+    fallback_reason,
+)
+from pyastrx.xml.xpath_extensions import (
+    LXMLExtensions,
+    __all_lxml_ext__,
+    __lxml_namespaces__,
+)
+from pyastrx.xml.xpath_parser import (
+    Path,
+    Step,
+    UnsupportedXPathError,
+    parse_xpath,
+)
+from pyastrx.xml.xpath_compiler import XPathSyntaxError
+
+
+CODE = """
+class A:
+    def f(self, x, y=[1, 2]):
+        global z
+        z = x + 1.5
+        return self.g("a", y)
+
+def g(*args):
+    return len(args) > 2
+"""
+
+
+def serialize(element):
+    """The virtual element as a tuple comparable with lxml."""
+    if not isinstance(element, ElementNode):
+        return element.string_value()
+    return (
+        element.tag,
+        element.attribute_values(),
+        [serialize(child) for child in element.iter_children()],
+    )
+
+
+def serialize_lxml(element):
+    children = [serialize_lxml(child) for child in element]
+    if element.text:
+        children.insert(0, element.text)
+    return (element.tag, dict(element.attrib), children)
+
+
+def test_parse_xpath():
+    assert parse_xpath("//a[1]") == Path(None, True, (
+        Step("descendant-or-self", "node()"),
+        Step("child", "a", (parse_xpath("1"),)),
+    ))
+    assert parse_xpath("../@b") == Path(None, False, (
+        Step("parent", "node()"), Step("attribute", "b")))
+    for xpath in ("//a[$x]", "//comment()", "//a:b", "namespace::*"):
+        with pytest.raises(UnsupportedXPathError):
+            parse_xpath(xpath)
+    with pytest.raises(XPathSyntaxError):
+        parse_xpath("//a[@b='c'")
+
+
+def test_fallback_reason():
+    assert fallback_reason("//ClassDef[pyastrx:match('.*Var', @name)]") \
+        is None
+    assert fallback_reason("//a[$x]") == "not supported: variables"
+    assert fallback_reason("//a[id('x')]") == "not supported: function id"
+
+
+def test_virtual_tree_as_axml():
+    document = txt2document(CODE)
+    axml = txt2axml(CODE, "<unknown>")
+    assert serialize(document.root) == serialize_lxml(axml)
+    orders = [
+        element.order for element in document.root.iter_descendants()
+        if isinstance(element, ElementNode)]
+    assert orders == sorted(orders)
+    assert document.root.end >= orders[-1]
+
+
+def test_same_values_as_lxml():
+    xpaths = [
+        "//FunctionDef[last()]/@name",
+        "(//Name)[3]",
+        "//Name/ancestor::FunctionDef[1]/@name",
+        "//Return/preceding-sibling::*[1]",
+        "count(//Name) > 3",
+        "sum(//Constant[@type='int']/@value)",
+        "//Name[starts-with(@id, 'a')] | //Global/names/item/text()",
+        "//arg[not(@arg = ../../args/Name/@id)]",
+        "//Constant[@value mod 2 = 1]",
+        "//Name[pyastrx:deny-list('bad', @id)]",
+        "string(//ClassDef/@name)",
+    ]
+    axml = etree.fromstring(etree.tostring(txt2axml(CODE, "<unknown>")))
+    extensions = LXMLExtensions(
+        deny_dict={"bad": ["x", "self"]}, allow_dict={})
+    evaluator = etree.XPathEvaluator(
+        axml, namespaces=__lxml_namespaces__,
+        extensions=etree.Extension(
+            extensions, __all_lxml_ext__, ns="local-ns"))
+    document = txt2document(CODE)
+    env = Environment(document, extensions)
+    for xpath in xpaths:
+        evaluate, reason = compile_ast_xpath(xpath)
+        assert reason == ""
+        expected = evaluator(xpath)
+        value = evaluate(document.root, 1, 1, env)
+        if isinstance(expected, list):
+            expected = [
+                serialize_lxml(v) if isinstance(v, etree._Element)
+                else str(v) for v in expected]
+            value = [serialize(v) for v in value]
+        assert value == expected, xpath
+
+
+def test_ast_backend_same_matches():
+    xpath2linenos = json.load(open("tests/dummy_examples/xpath2linenos.json"))
+    for filename, items in xpath2linenos.items():
+        file = f"tests/dummy_examples/{filename}"
+        for item in items:
+            xpath = item[0]
+            match_params = MatchParams(**(item[2] if len(item) > 2 else {}))
+            rules = RulesDict({
+                f"[python]{xpath}": RuleInfo(specification_name="python")})
+            ast_repo = Repo(
+                match_params=match_params, file_cache=False, backend="ast")
+            ast_info = ast_repo.load_file(file, "python")
+            assert ast_info.axml == b""
+            assert ast_repo.get_fallback_rules(rules) == {}
+            repo = Repo(match_params=match_params, file_cache=False)
+            repo.load_file(file, "python")
+            found = ast_repo.search_file(file, rules)
+            evaluated = repo.search_file(file, rules)
+            assert found.num_matches_by_expr == evaluated.num_matches_by_expr
+            for lineno, matches in evaluated.matches.items():
+                assert found.matches[lineno].match_by_expr == \
+                    matches.match_by_expr
+
+
+def test_ast_backend_fallback():
+    file = "tests/dummy_examples/globals.py"
+    rules = RulesDict({
+        f"[python]{xpath}": RuleInfo(specification_name="python")
+        for xpath in ("//Global", "//Global[comment() or true()]")
+    })
+    ast_repo = Repo(
+        match_params=MatchParams(), file_cache=False, backend="ast")
+    ast_repo.load_file(file, "python")
+    assert list(ast_repo.get_fallback_rules(rules)) == [
+        "[python]//Global[comment() or true()]"]
+    found = ast_repo.search_file(file, rules)
+    assert set(found.num_matches_by_expr.values()) == {5}
+
+
+def test_ast_backend_matches_without_location():
+    file = "tests/dummy_examples/globals.py"
+    xpaths = ("/Module", "//Module", "/Module/body", "//type_ignores",
+              "/*", "/*[1]")
+    rules = RulesDict({
+        f"[python]{xpath}": RuleInfo(specification_name="python")
+        for xpath in xpaths})
+    ast_repo = Repo(
+        match_params=MatchParams(), file_cache=False, backend="ast")
+    ast_repo.load_file(file, "python")
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_file(file, "python")
+    found = ast_repo.search_file(file, rules)
+    assert found.num_matches_by_expr == \
+        repo.search_file(file, rules).num_matches_by_expr
+    assert len(found.matches) == 0
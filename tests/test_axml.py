@@ -1,7 +1,12 @@
 from functools import partial
 
 import gast
-from pyastrx.axml.python.ast2xml import set_encoded_literal, txt2ast
+from pyastrx.axml.python.ast2xml import (
+    annotate_axml,
+    ast2xml,
+    set_encoded_literal,
+    txt2ast,
+)
 from pyastrx.axml.yaml.yaml2xml import txt2axml as yamlTxt2axml
 
 
@@ -88,3 +93,40 @@ def test_fix_yaml_and_parse():
         assert xml_fix[i].tag == xml_inv[i].tag
         assert xml_fix[i].attrib == xml_inv[i].attrib
         assert xml_fix[i].text == xml_inv[i].text
+
+
+def infered_type(location, annotation, attrs=None):
+    start_line, start_col, stop_line, stop_col = location
+    result = {
+        "location": {
+            "start": {"line": start_line, "column": start_col},
+            "stop": {"line": stop_line, "column": stop_col},
+        },
+        "annotation": annotation,
+    }
+    if attrs is not None:
+        result["attrs"] = attrs
+    return result
+
+
+def test_annotate_axml_as_typed_conversion():
+    txt = "def g(x: int) -> int:\n    y = x + 1\n    return y\n"
+    types = [
+        infered_type((1, 4, 1, 5), "def (x: int) -> int", ["is_a"]),
+        infered_type((2, 4, 2, 5), "int"),
+        infered_type((2, 8, 2, 13), "int"),
+        infered_type((2, 12, 2, 13), "Literal[1]?"),
+        infered_type((3, 11, 3, 12), "int", []),
+    ]
+    typed = ast2xml(
+        txt2ast(txt), txt_lines=txt.split("\n"), infered_types=types)
+    merged = ast2xml(txt2ast(txt))
+    annotate_axml(merged, txt, types)
+    typed_nodes = list(typed.iter())
+    merged_nodes = list(merged.iter())
+    assert [n.tag for n in typed_nodes] == [n.tag for n in merged_nodes]
+    for typed_node, merged_node in zip(typed_nodes, merged_nodes):
+        assert dict(typed_node.attrib) == dict(merged_node.attrib)
+    assert merged.xpath("//FunctionDef/@is_a") == ["1"]
+    assert merged.xpath("//Name[@id='y']/@type") == ["int", "int"]
+    assert len(merged.xpath("//annotation")) == 0
@@ -0,0 +1,357 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from pyastrx.axml.python.ast2xml import file2axml
+from pyastrx.axml.python.symbols import symbols_from_txt
+from pyastrx.inference.cache import inference_keys
+from pyastrx.data_typing import (
+    InferenceConfig,
+    MatchParams,
+    RuleInfo,
+    RulesDict,
+)
+from pyastrx.search import Repo
+from pyastrx.search import main as search_main
+from pyastrx.xml.xpath_compiler import uses_inferred_types
+
+
+def write(path, txt, mtime):
+    path.write_text(txt)
+    os.utime(path, ns=(mtime, mtime))
+    return str(path)
+
+
+def test_inference_cache(tmp_path, monkeypatch):
+    calls = []
+
+    def infer_types_pyre(files):
+        calls.append([os.path.basename(f) for f in files])
+        return [{"path": f, "types": [{"annotation": f}]} for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    base = tmp_path / "base.py"
+    files = [
+        write(base, "def f(x: int) -> int:\n    return x\n", 10**9),
+        write(tmp_path / "user.py", "from base import f\n", 10**9),
+        write(tmp_path / "other.py", "z = 1\n", 10**9),
+    ]
+    repo = Repo(
+        MatchParams(), InferenceConfig(what="pyre", run=True),
+        file_cache=False)
+    loaded, types = repo.get_infered_types(files, "python")
+    assert loaded == files
+    assert [t[0]["annotation"] for t in types] == files
+    assert calls == [["base.py", "user.py", "other.py"]]
+
+    loaded, types = repo.get_infered_types(files[1:], "python")
+    assert len(calls) == 1
+
+    # the file importing the modified one is inferred again
+    write(base, "def f(x: int) -> str:\n    return str(x)\n", 2 * 10**9)
+    loaded, types = repo.get_infered_types(files, "python")
+    assert calls[-1] == ["base.py", "user.py"]
+    assert len(types) == 3
+
+
+def test_mypy_session_updates_dependents(tmp_path):
+    pytest.importorskip("mypy")
+    from pyastrx.inference.mypy import MypySession
+    base = tmp_path / "base.py"
+    user = tmp_path / "user.py"
+    other = tmp_path / "other.py"
+    files = [
+        write(base, "def f(x: int) -> int:\n    return x\n", 10**9),
+        write(user, "from base import f\n\ny = f(1)\n", 10**9),
+        write(other, "z = 1\n", 10**9),
+    ]
+    session = MypySession()
+    assert sorted(session.update(files)) == sorted(files)
+    assert session.update(files) == []
+
+    write(other, "z = 2\n", 2 * 10**9)
+    assert session.update(files) == [files[2]]
+
+    write(base, "def f(x: int) -> str:\n    return str(x)\n", 3 * 10**9)
+    assert sorted(session.update(files)) == sorted(files[:2])
+
+
+def test_types_merged_after_the_conversion(monkeypatch):
+    filename = str(Path("tests/dummy_examples/defaults.py").resolve())
+
+    def infer_types_pyre(files):
+        info = file2axml(filename, None, "python")
+        name = info.axml.xpath("//Name")[0]
+        location = {
+            "start": {"line": int(name.get("lineno")),
+                      "column": int(name.get("col_offset"))},
+            "stop": {"line": int(name.get("end_lineno")),
+                     "column": int(name.get("end_col_offset"))},
+        }
+        types = [{"location": location, "annotation": "Inferred"}]
+        return [{"path": f, "types": types} for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    repo = Repo(
+        MatchParams(), InferenceConfig(what="pyre", run=True),
+        file_cache=False)
+    repo.load_files([filename], "python", parallel=False)
+    info = repo.cache.get(filename)
+    assert info.axml.count(b'type="Inferred"') == 1
+
+
+def test_inference_only_for_rules_with_types():
+    assert uses_inferred_types("//Call[@type='int']")
+    assert uses_inferred_types("//Name[@is_final]")
+    assert uses_inferred_types("//Name/@*")
+    assert not uses_inferred_types("//Name[contains(@id, 'type')]")
+    inference = InferenceConfig(what="mypy", run=True)
+    rules = RulesDict({
+        "[a]//Name[@id='x']": RuleInfo(specification_name="a"),
+        "[b]//Call[@fullname='f']": RuleInfo(specification_name="b"),
+    })
+    repo = Repo(
+        MatchParams(), inference, backend="ast", inference_rules=rules)
+    assert repo.backend == "xml"
+    assert not repo.should_infer("a") and repo.should_infer("b")
+    del rules["[b]//Call[@fullname='f']"]
+    repo = Repo(
+        MatchParams(), inference, backend="ast", inference_rules=rules)
+    assert repo.backend == "ast"
+    assert not repo.should_infer("b")
+    assert Repo(MatchParams(), inference).should_infer("a")
+
+
+def test_is_attribute_names():
+    nodes = pytest.importorskip("mypy.nodes")
+    from pyastrx.inference.mypy_visitor import is_attribute_names
+    names = is_attribute_names(nodes.NameExpr)
+    assert names == tuple(
+        name for name in dir(nodes.NameExpr) if name.startswith("is_"))
+    assert "is_inferred_def" in names
+    assert is_attribute_names(nodes.NameExpr) is names
+
+
+FAKE_PYRE = """#!{python}
+import json, re, sys
+files = re.findall("'([^']*)'", sys.argv[-1])
+with open({log!r}, "a") as log:
+    log.write(" ".join(files) + "\\n")
+print(json.dumps({{"response": [
+    {{"path": f, "types": [{{"annotation": f}}]}} for f in files]}}))
+"""
+
+
+def test_pyre_queries_in_chunks(tmp_path, monkeypatch):
+    from pyastrx.inference.pyre import infer_types
+    log = tmp_path / "queries.log"
+    pyre = tmp_path / "pyre"
+    pyre.write_text(FAKE_PYRE.format(python=sys.executable, log=str(log)))
+    pyre.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    files = [f"m{i}.py" for i in range(5)]
+    response, success = infer_types(files, max_files=2, jobs=2)
+    assert success
+    assert [r["path"] for r in response] == files
+    queries = sorted(log.read_text().splitlines())
+    assert queries == ["m0.py m1.py", "m2.py m3.py", "m4.py"]
+
+
+def test_mypy_session_cache(tmp_path):
+    pytest.importorskip("mypy")
+    from pyastrx.inference.mypy import MypySession
+    cache_dir = str(tmp_path / "mypy_cache")
+    files = [
+        write(tmp_path / "base.py", "def f(x: int) -> int:\n    return x\n",
+              10**9),
+        write(tmp_path / "user.py", "from base import f\n\ny = f(1)\n",
+              10**9),
+    ]
+
+    def user_type(session):
+        return str(session.manager.graph["user"].tree.names["y"].node.type)
+
+    session = MypySession(cache_dir)
+    session.update(files)
+    assert os.path.isdir(cache_dir)
+    assert user_type(session) == "int"
+    # the next session loads the cache and checks the modified files
+    write(tmp_path / "base.py", "def f(x: int) -> str:\n    return str(x)\n",
+          2 * 10**9)
+    session = MypySession(cache_dir)
+    session.update(files)
+    assert user_type(session) == "str"
+
+
+def test_scoped_inference(tmp_path, monkeypatch):
+    calls = []
+
+    def infer_types_pyre(files):
+        calls.append(sorted(os.path.basename(f) for f in files))
+        return [{"path": f, "types": []} for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    (tmp_path / "pkg").mkdir()
+    write(tmp_path / "pkg" / "__init__.py", "", 10**9)
+    files = [
+        write(tmp_path / "pkg" / "base.py", "x = 1\n", 10**9),
+        write(tmp_path / "pkg" / "mid.py", "from pkg.base import x\n", 10**9),
+        write(tmp_path / "pkg" / "top.py", "from pkg.mid import x\n", 10**9),
+        write(tmp_path / "other.py", "import pkg.top\n", 10**9),
+    ]
+    inference = InferenceConfig(
+        what="pyre", run=True, modules=["pkg.*"], max_closure=1)
+    repo = Repo(MatchParams(), inference, file_cache=False)
+    loaded, types = repo.get_infered_types(files, "python")
+    assert calls == [["base.py", "mid.py", "top.py"]]
+    assert loaded == files and types[-1] == []
+    assert repo.inference_stats.excluded == 1
+    assert repo.inference_stats.inferred == 3
+
+    symbols = {
+        f: symbols_from_txt(Path(f).read_text(), f) for f in files}
+    assert repo.get_follow_imports(files[1:2], symbols) == "normal"
+    assert repo.get_follow_imports(files[2:3], symbols) == "skip"
+    assert repo.inference_stats.skipped == sorted(files[:2])
+
+
+def test_mypyq_jsonl_cache(tmp_path, monkeypatch, capsys):
+    from pyastrx.frontend import mypyq
+    calls = []
+
+    class Session:
+        def __init__(self, cache_dir=None):
+            pass
+
+        def iter_types(self, files):
+            calls.append([os.path.basename(f) for f in files])
+            for f in files:
+                yield {"path": f, "types": [{"annotation": f}]}
+
+    monkeypatch.setattr(mypyq, "MypySession", Session)
+    monkeypatch.chdir(tmp_path)
+    base = tmp_path / "base.py"
+    files = [
+        write(base, "def f(x: int) -> int:\n    return x\n", 10**9),
+        write(tmp_path / "user.py", "from base import f\n", 10**9),
+        write(tmp_path / "other.py", "z = 1\n", 10**9),
+    ]
+    monkeypatch.setattr(sys, "argv", ["mypyq", "--jsonl", "-f"] + files)
+    mypyq.mypy_query()
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)["path"] for line in lines] == files
+    assert calls == [["base.py", "user.py", "other.py"]]
+
+    # the cached types are reused, the dependents are inferred again
+    write(base, "def f(x: int) -> str:\n    return str(x)\n", 2 * 10**9)
+    mypyq.mypy_query()
+    lines = capsys.readouterr().out.splitlines()
+    assert json.loads(lines[0]) == {
+        "path": files[2], "types": [{"annotation": files[2]}]}
+    assert calls[-1] == ["base.py", "user.py"]
+    assert list(mypyq.iter_chunks(files, 2)) == [files[:2], files[2:]]
+
+
+def test_fused_same_matches_with_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "a.py")
+    write(tmp_path / "a.py", "\n\ndef f(x: int) -> int:\n    y = x\n"
+          + "    return y\n", 10**9)
+    location = {"start": {"line": 4, "column": 4},
+                "stop": {"line": 4, "column": 5}}
+
+    def infer_types_pyre(files):
+        types = [{"location": location, "annotation": "int"}]
+        return [{"path": f, "types": types} for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    rules = RulesDict({
+        f"[python]{xpath}": RuleInfo(specification_name="python")
+        for xpath in ("//FunctionDef", "//arg/annotation", "//Name[@id]")})
+    inference = InferenceConfig(what="pyre", run=True)
+    fused_repo = Repo(
+        MatchParams(), inference, file_cache=False, fused_rules=rules)
+    fused_repo.load_files([filename], "python", parallel=False)
+    assert fused_repo.cache.get(filename).fused_spans == {}
+    repo = Repo(MatchParams(), inference, file_cache=False)
+    repo.load_files([filename], "python", parallel=False)
+    assert repo.cache.get(filename).axml.count(b'type="int"') == 1
+    fused = fused_repo.search_file(filename, rules)
+    evaluated = repo.search_file(filename, rules)
+    assert fused.num_matches_by_expr == evaluated.num_matches_by_expr
+    assert "[python]//arg/annotation" not in evaluated.num_matches_by_expr
+    for lineno, matches in evaluated.matches.items():
+        assert fused.matches[lineno].match_by_expr == matches.match_by_expr
+
+
+def test_cached_files_without_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = write(tmp_path / "a.py", "x = 1\n", 10**9)
+    location = {"start": {"line": 1, "column": 0},
+                "stop": {"line": 1, "column": 1}}
+    calls = []
+
+    def infer_types_pyre(files):
+        calls.append(files)
+        types = [{"location": location, "annotation": "int"}]
+        return [{"path": f, "types": types} for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    inference = InferenceConfig(what="pyre", run=True)
+
+    def search(xpath):
+        rules = RulesDict({
+            f"[python]{xpath}": RuleInfo(specification_name="python")})
+        repo = Repo(MatchParams(), inference, inference_rules=rules)
+        repo.load_files([filename], "python", parallel=False)
+        return repo.search_file(filename, rules).num_matches_by_expr
+
+    assert search("//Name") == {"[python]//Name": 1}
+    assert calls == []
+    # the xml cached without types is converted again
+    assert search("//Name[@type='int']") == {
+        "[python]//Name[@type='int']": 1}
+    assert len(calls) == 1
+    assert search("//Name[@type='int']") == {
+        "[python]//Name[@type='int']": 1}
+    assert len(calls) == 1
+
+
+def test_inference_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    def infer_types_pyre(files):
+        calls.append([os.path.relpath(f, tmp_path) for f in files])
+        return [
+            {"path": f, "types": [{"annotation": Path(f).read_text()}]}
+            for f in files], True
+
+    monkeypatch.setattr(search_main, "infer_types_pyre", infer_types_pyre)
+    use = "from .m import f\nx = f()\n"
+    files = []
+    for package in ("a", "b"):
+        (tmp_path / package).mkdir()
+        write(tmp_path / package / "__init__.py", "", 10**9)
+        write(tmp_path / package / "m.py", f"def f(): return '{package}'\n",
+              10**9)
+        files.append(write(tmp_path / package / "use.py", use, 10**9))
+    inference = InferenceConfig(what="pyre", run=True)
+    repo = Repo(MatchParams(), inference)
+    loaded, types = repo.get_infered_types(files, "python")
+    assert calls == [["a/use.py", "b/use.py"]]
+    cache = repo.get_inference_cache()
+    keys = inference_keys(files, {}, {}, "normal")
+    assert keys[files[0]] != keys[files[1]]
+    assert all(cache.get(keys[f]) is not None for f in files)
+
+    # a new run loading only the importer of a modified module
+    write(tmp_path / "a" / "m.py", "def f(): return 1\n", 2 * 10**9)
+    repo = Repo(MatchParams(), inference)
+    repo.get_infered_types(files[:1], "python")
+    assert calls[-1] == ["a/use.py"]
+    assert inference_keys(files[:1], {}, {}, "skip") != \
+        inference_keys(files[:1], {}, {}, "normal")
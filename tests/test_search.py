@@ -1,7 +1,27 @@
 import json
+import os
+import time
+from pathlib import Path
 
-from pyastrx.data_typing import MatchParams, RuleInfo, RulesDict
+import pytest
+
+from pyastrx.data_typing import (
+    Config,
+    InferenceConfig,
+    MatchParams,
+    RuleInfo,
+    RulesDict,
+    SearchLimits,
+    Specification,
+    Specifications,
+)
+from pyastrx.frontend.manager import Manager, SearchCancelled
+from pyastrx.frontend.preview import LivePreview
+from pyastrx.frontend.watch import WatchQueue
+from pyastrx.report.humanize import count_by_filename
 from pyastrx.search import Repo
+from pyastrx.search import main as search_main
+from pyastrx.search.repo_document import evaluate_repo
 
 
 def test_xpath_example_tags():
@@ -28,3 +48,434 @@ def test_xpath_example_tags():
                     print(linenos)
                     print(xpath)
                     assert False
+
+
+def test_search_limits():
+    """The grep-like limits should stop the search early."""
+    file = "tests/dummy_examples/globals.py"
+    rules = RulesDict({
+        "[python]//Global": RuleInfo(specification_name="python"),
+        "[python]//FunctionDef": RuleInfo(specification_name="python"),
+    })
+    repo = Repo(match_params=MatchParams())
+    repo.load_file(file, "python", normalize_ast=True)
+
+    full = repo.search_file(file, rules)
+    assert full.num_matches_by_expr["[python]//Global"] == 5
+
+    first = repo.search_file(file, rules, limits=SearchLimits(first_match=True))
+    assert list(first.num_matches_by_expr.items()) == [("[python]//Global", 1)]
+    assert list(first.matches.keys()) == [4]
+
+    files = repo.search_file(
+        file, rules, limits=SearchLimits(files_with_matches=True))
+    assert len(files.matches) == 1
+
+    count = repo.search_file(file, rules, limits=SearchLimits(count=True))
+    assert count.num_matches_by_expr == full.num_matches_by_expr
+
+    capped = repo.search_file(file, rules, limits=SearchLimits(max_matches=2))
+    assert capped.num_matches_by_expr["[python]//Global"] == 2
+
+
+def test_count_matching_lines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    file = tmp_path / "a.py"
+    file.write_text("a = b + b\nc = 1\n")
+    rule = RuleInfo(specification_name="python")
+    rules = RulesDict({
+        "[python]//Name[@id='b']": rule,
+        "[python]//Name": rule,
+    })
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_file(str(file), "python")
+    line2matches = repo.search_file(
+        str(file), rules, limits=SearchLimits(count=True))
+    assert len(line2matches.matches[1].match_by_expr) == 2
+    output, num_lines = count_by_filename(line2matches, "a.py")
+    assert (output, num_lines) == ("[bold green]a.py[/bold green]:2\n", 2)
+
+
+def test_iter_search():
+    """The streaming search should find the same matches as search_files."""
+    files = [
+        "tests/dummy_examples/globals.py",
+        "tests/dummy_examples/defaults.py",
+        "tests/dummy_examples/recursion.py",
+    ]
+    rules = RulesDict({
+        "[python]//Global": RuleInfo(specification_name="python"),
+        "[python]//defaults/*": RuleInfo(specification_name="python"),
+    })
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_files(files, "python", parallel=False)
+    expected = repo.search_files(rules, parallel=False)
+
+    ordered = dict(repo.iter_search(rules, ordered=True, buffer_size=1))
+    assert list(ordered.keys()) == list(expected.keys())
+    unordered = dict(repo.iter_search(rules))
+    assert unordered.keys() == expected.keys()
+    for filename, line2matches in unordered.items():
+        assert line2matches.num_matches_by_expr == \
+            expected[filename].num_matches_by_expr
+
+
+def test_match_spans():
+    """Each match should carry the full location of the matched node."""
+    file = "tests/dummy_examples/globals.py"
+    expr = "[python]//FunctionDef[@name='simple_def']/args//Name"
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_file(file, "python", normalize_ast=True)
+    lines2matches = repo.search_file(
+        file, RulesDict({expr: RuleInfo(specification_name="python")}))
+    match = lines2matches.matches[12].match_by_expr[expr]
+    assert match.cols_by_line == {12: [15]}
+    assert match.spans_by_line == {12: [(12, 15, 12, 16)]}
+
+
+def test_extension_stats():
+    """The extension functions are shared by the files of a search
+    and count their calls when profiled."""
+    files = [
+        f"tests/dummy_examples/{name}"
+        for name in ("mix_examples.py", "globals.py", "var_names.py")]
+    expr = "[python]//ClassDef[pyastrx:match('.*Var', @name)]"
+    rules = RulesDict({expr: RuleInfo(specification_name="python")})
+    repo = Repo(
+        match_params=MatchParams(), file_cache=False,
+        profile_extensions=True)
+    repo.load_files(files, "python", parallel=False)
+    calls = []
+    for parallel in (False, True):
+        repo.extension_stats = {}
+        file2matches = repo.search_files(rules, parallel=parallel)
+        assert sum(
+            line2matches.num_matches_by_expr.get(expr, 0)
+            for line2matches in file2matches.values()) == 2
+        assert list(repo.extension_stats) == ["lxml_match"]
+        calls.append(repo.extension_stats["lxml_match"].calls)
+    # one call by ClassDef
+    assert calls == [4, 4]
+    assert ".*Var" in repo.get_extensions(rules).patterns
+
+
+def test_symbol_index():
+    """The symbol functions resolve the imports across the files."""
+    files = [
+        f"tests/dummy_examples/symbols/{name}"
+        for name in ("__init__.py", "legacy.py", "user.py")]
+    exprs = [
+        "[python]//Call[pyastrx:is-deprecated(func/Name/@id)]",
+        "[python]//Call[pyastrx:is-deprecated(concat("
+        + "func/Attribute/value/Name/@id, '.', func/Attribute/@attr))]",
+        "[python]//Call[pyastrx:defined-in(func/Name/@id)"
+        + " = 'symbols.legacy']",
+        "[python]//Call[pyastrx:imported-as(func/Name/@id)"
+        + " = 'symbols.legacy.new_api']",
+    ]
+    rules = RulesDict({
+        expr: RuleInfo(specification_name="python") for expr in exprs})
+    for backend in ("xml", "ast"):
+        repo = Repo(
+            match_params=MatchParams(), file_cache=False, backend=backend)
+        repo.load_files(files, "python", parallel=False)
+        assert len(repo.symbol_index) == 0
+        file2matches = repo.search_files(rules, parallel=False)
+        assert len(repo.symbol_index) == 3
+        user = file2matches[str(Path(files[2]).resolve())]
+        assert user.num_matches_by_expr == dict(zip(exprs, [1, 1, 3, 1]))
+        # the re-export of the package is followed
+        assert user.matches[8].match_by_expr.keys() == {
+            exprs[0], exprs[2]}
+        symbols = repo.symbol_index.by_file[str(Path(files[2]).resolve())]
+        assert symbols.imports["legacy"] == "symbols.legacy"
+        assert repo.symbol_index.resolve("old_api", symbols)[0] == \
+            "symbols.legacy.old_api"
+
+
+def test_repo_document():
+    """One xpath over all the files gives the same matches as the
+    search of each file, and the counted tags skip the files."""
+    files = [
+        f"tests/dummy_examples/{name}"
+        for name in ("mix_examples.py", "globals.py", "var_names.py")]
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_files(files, "python", parallel=False)
+    assert repo.evaluate_repo("count(/Repo/File)") == 3
+    counts = [
+        repo.evaluate_repo(f"count(/Repo/File[{i}]//Name)")
+        for i in (1, 2, 3)]
+    assert repo.evaluate_repo("count(//Name)") == sum(counts)
+    rule = RuleInfo(specification_name="python")
+    found = repo.search_repo(RulesDict({
+        "[python]/Repo/File[.//ClassDef]//Return": rule}))
+    expected = repo.search_files(
+        RulesDict({"[python]//Return[//ClassDef]": rule}), parallel=False)
+    assert set(found) == {
+        file for file, line2matches in expected.items()
+        if line2matches.matches}
+    for file, line2matches in found.items():
+        assert list(line2matches.num_matches_by_expr.values()) == list(
+            expected[file].num_matches_by_expr.values())
+    infos = [repo.cache.get(file) for file in repo.get_files()]
+    assert all(info.tag_counts for info in infos)
+    document = repo.get_repo_document()
+    assert evaluate_repo(
+        document, "/Repo/File[.//Lambda]//Return", repo.get_extensions(
+            RulesDict({}))) == {}
+    assert all(file.document is None for file in document.files)
+    # the matches without a location up to the root are skipped
+    assert repo.evaluate_repo("count(//Module)") == 3
+    assert repo.evaluate_repo("//Module") == {
+        file: [None] for file in repo.get_files()}
+    found = repo.search_repo(RulesDict({"[python]//Module": rule}))
+    assert all(len(m.matches) == 0 for m in found.values())
+
+
+def test_watch_updates_only_the_changed_files(tmp_path, monkeypatch):
+    """The watch mode only searches again the changed files and keeps
+    the matches of the others."""
+    monkeypatch.chdir(tmp_path)
+    files = {
+        name: tmp_path / f"{name}.py" for name in ("a", "b", "c")}
+    files["a"].write_text("def f():\n    global x\n")
+    files["b"].write_text("x = 1\n")
+    (tmp_path / "notes.txt").write_text("global x\n")
+    rules = RulesDict({
+        "[python]//Global": RuleInfo(specification_name="python")})
+    specifications = Specifications({"python": Specification(
+        files=[], exclude=[], extensions=["py"], folder=str(tmp_path))})
+    config = Config(
+        rules=rules, specifications=specifications, parallel=False,
+        quiet=True, watch=True)
+    repo = Repo(MatchParams(), file_cache=False)
+    manager = Manager(config, repo)
+    manager.load_specitications()
+    manager.load_specitications()
+    assert len(repo.get_files()) == 2
+    assert manager.search()[0] == 1
+
+    searched = []
+    iter_search = repo.iter_search
+
+    def spy(rules, **kwargs):
+        searched.append(kwargs["files"])
+        return iter_search(rules, **kwargs)
+
+    repo.iter_search = spy
+    files["b"].write_text("def g():\n    global x\n")
+    os.utime(files["b"], (10**9, 10**9))
+    files["c"].write_text("def h():\n    global x\n")
+    num_matches = manager.update_files(
+        [str(files["b"]), str(files["c"]), str(tmp_path / "notes.txt")])[0]
+    assert searched == [[str(files["b"]), str(files["c"])]]
+    assert num_matches == 3
+
+    files["a"].unlink()
+    assert manager.update_files([str(files["a"])])[0] == 2
+    assert searched[-1] == []
+    assert str(files["a"]) not in repo.get_files()
+
+    # a cancelled search leaves the files for the next one
+    files["b"].write_text("x = 1\n")
+    with pytest.raises(SearchCancelled):
+        manager.update_files([str(files["b"])], lambda: True)
+    assert manager.update_files([])[0] == 1
+    assert searched[-1] == [str(files["b"])]
+
+    # a file that failed to be converted is loaded again with the next
+    # batch
+    file2axml = search_main.file2axml
+
+    def fail(filename, **kwargs):
+        raise Exception(f"Failed to convert {filename}")
+
+    monkeypatch.setattr(search_main, "file2axml", fail)
+    files["b"].write_text("def g():\n    global x\n")
+    os.utime(files["b"], (2 * 10**9, 2 * 10**9))
+    with pytest.raises(Exception, match="Failed to convert"):
+        manager.update_files([str(files["b"])])
+    assert str(files["b"]) in manager._stale
+    monkeypatch.setattr(search_main, "file2axml", file2axml)
+    assert manager.update_files([])[0] == 2
+
+
+def test_watch_queue_coalesces_the_events():
+    batches = []
+
+    def process(files, cancelled):
+        batches.append(files)
+        if len(batches) == 1:
+            queue.put("c.py")
+            assert cancelled()
+            raise SearchCancelled()
+
+    queue = WatchQueue(process, quiet_period=0.05)
+    queue.start()
+    for path in ["a.py", "b.py", "a.py"]:
+        queue.put(path)
+    for _ in range(100):
+        if len(batches) == 2:
+            break
+        time.sleep(0.02)
+    queue.stop()
+    assert batches == [["a.py", "b.py"], ["c.py"]]
+
+
+def test_watch_queue_survives_the_errors(capsys):
+    batches = []
+
+    def process(files, cancelled):
+        batches.append(files)
+        if len(batches) == 1:
+            raise Exception("Failed to convert a.py")
+
+    queue = WatchQueue(process, quiet_period=0.01)
+    queue.start()
+    queue.put("a.py")
+    for path in ("a.py", "b.py"):
+        for _ in range(100):
+            if batches and path in batches[-1]:
+                break
+            time.sleep(0.02)
+        if path == "a.py":
+            queue.put("b.py")
+    queue.stop()
+    assert batches == [["a.py"], ["b.py"]]
+    assert "Failed to convert a.py" in capsys.readouterr().out
+
+
+def test_reload_config_evaluates_only_the_new_rules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text(
+        "def f():\n    global x\n    return g(x)\n")
+    (tmp_path / "b.py").write_text("print(1)\n")
+    specifications = Specifications({"python": Specification(
+        files=[], exclude=[], extensions=["py"], folder=str(tmp_path))})
+
+    def config_of(*xpaths):
+        rules = RulesDict({
+            f"[python]{xpath}": RuleInfo(specification_name="python")
+            for xpath in xpaths})
+        return Config(
+            rules=rules, specifications=specifications, parallel=False,
+            quiet=True, watch=True)
+
+    repo = Repo(MatchParams(), file_cache=False)
+    manager = Manager(config_of("//Global", "//Return"), repo)
+    manager.load_specitications()
+    assert manager.search()[0] == 2
+
+    searched = []
+    iter_search = repo.iter_search
+
+    def spy(rules, **kwargs):
+        if len(kwargs["files"]) > 0:
+            searched.append(list(rules))
+        return iter_search(rules, **kwargs)
+
+    repo.iter_search = spy
+    config = config_of("//Global", "//Call")
+    num_matches, _, filter_rules = manager.reload_config(config)
+    assert searched == [["[python]//Call"]]
+    assert num_matches == 3
+    assert filter_rules == {"[python]//Global": 1, "[python]//Call": 2}
+    full = Repo(MatchParams(), file_cache=False)
+    full.load_specifications(specifications)
+    expected = full.search_files(config.rules, parallel=False)
+    assert manager.results.keys() == expected.keys()
+    for file, line2matches in expected.items():
+        assert manager.results[file].num_matches_by_expr == \
+            line2matches.num_matches_by_expr
+        assert list(manager.results[file].matches) == \
+            list(line2matches.matches)
+
+
+def test_live_preview(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text(
+        "def f():\n    global x\n    return g(x)\n")
+    (tmp_path / "b.py").write_text("def h():\n    global y\n")
+    specifications = Specifications({"python": Specification(
+        files=[], exclude=[], extensions=["py"], folder=str(tmp_path))})
+    config = Config(
+        rules=RulesDict({}), specifications=specifications, parallel=False,
+        quiet=True)
+    manager = Manager(config, Repo(MatchParams(), file_cache=False))
+    manager.load_specitications()
+    preview = LivePreview(manager, max_matches=1, debounce=0.01)
+
+    def wait():
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if not preview.running:
+                return
+            time.sleep(0.01)
+
+    preview.update("//Gl")
+    preview.update("//Global")
+    wait()
+    assert (preview.num_matches, preview.num_files) == (2, 2)
+    assert len(preview.matches) == 1
+    assert preview.toolbar().splitlines()[1] in (
+        "a.py:2: global x", "b.py:2: global y")
+    preview.update("//Glo[")
+    wait()
+    assert preview.toolbar().startswith("Invalid expression")
+
+    # the errors of the evaluation are shown, the thread keeps running
+    preview.update("//Name[pyastrx:deny-list('n', @id)]")
+    wait()
+    assert "deny_list" in preview.toolbar()
+    preview.update("//Global")
+    wait()
+    assert (preview.error, preview.num_matches) == ("", 2)
+
+    # a new expression without a specification is searched in all files
+    manager.set_rule("//Global")
+    assert manager.search()[0] == 2
+
+
+def test_reload_config_with_new_lists(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("x = 1\ny = 2\n")
+    specifications = Specifications({"python": Specification(
+        files=[], exclude=[], extensions=["py"], folder=str(tmp_path))})
+    rule_info = RuleInfo(specification_name="python")
+    config = Config(
+        rules=RulesDict({
+            "[python]//Name[pyastrx:deny-list('names', @id)]": rule_info,
+            "[python]//Name[@type='int']": rule_info}),
+        specifications=specifications, parallel=False, quiet=True,
+        watch=True)
+    repo = Repo(
+        MatchParams(deny_dict={"names": ["x"]}), InferenceConfig(),
+        file_cache=False)
+    manager = Manager(config, repo)
+    manager.load_specitications()
+    assert manager.search()[0] == 1
+
+    # the retained rule is searched again with the new list
+    num_matches, _, _ = manager.reload_config(
+        config, MatchParams(deny_dict={"names": ["x", "y"]}))
+    assert num_matches == 2
+    assert list(manager.results[str(tmp_path / "a.py")].matches) == [1, 2]
+
+    # the files are converted again with the new inference config
+    loaded = []
+    load_files = repo.load_files
+
+    def spy(files, *args, **kwargs):
+        converted = load_files(files, *args, **kwargs)
+        loaded.extend(converted)
+        return converted
+
+    repo.load_files = spy
+    inference = InferenceConfig(what="pyre", run=True)
+    monkeypatch.setattr(
+        search_main, "infer_types_pyre",
+        lambda files: ([{"path": f, "types": []} for f in files], True))
+    assert manager.reload_config(config, None, inference)[0] == 2
+    assert repo.inference == inference
+    assert loaded == [str(tmp_path / "a.py")]
+    assert repo.cache.get(loaded[0]).inferred
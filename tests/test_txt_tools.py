@@ -1,4 +1,5 @@
-from pyastrx.search.txt_tools import apply_context
+from pyastrx.search.txt_tools import (
+    apply_context, build_line_offsets, context_from_offsets)
 
 
 def test_apply_context():
@@ -27,3 +28,26 @@ def test_apply_context():
         (4, "    start = max(0, index - before)"),
         (5, "    end = index + 1 + after"),
     ]
+
+
+def test_context_from_offsets():
+    """The context sliced from the line offsets should be the same
+    as the one from the split lines."""
+    txt = "a = 1\r\nb = 2\n\nc = 3\nd = 4"
+    offsets = build_line_offsets(txt)
+    assert list(offsets) == [0, 7, 13, 14, 20, 26]
+    # a final line break does not add a line past the end of the file
+    assert list(build_line_offsets(txt + "\n")) == list(offsets)
+    for text in (txt, txt + "\n", txt + "\n\n", ""):
+        offsets = build_line_offsets(text)
+        lines = text.splitlines()
+        for index in range(len(lines)):
+            for before, after in ((0, 0), (1, 2), (5, 5)):
+                assert context_from_offsets(
+                    text, offsets, index, before, after
+                ) == apply_context(lines, index, before, after)
+    # the offsets of older caches kept the empty last line
+    old_offsets = build_line_offsets(txt + "\n")
+    old_offsets.append(len(txt) + 2)
+    assert context_from_offsets(txt + "\n", old_offsets, 4, 0, 5) == [
+        (5, "d = 4")]
@@ -0,0 +1,222 @@
+import json
+from pathlib import Path
+
+from pyastrx.data_typing import MatchParams, RuleInfo, RulesDict
+from pyastrx.search import Repo
+from pyastrx.xml import xpath_lists
+from pyastrx.xml.xpath_compiler import (
+    compile_rule,
+    compile_fused_rule,
+    compile_rules,
+    split_location_path,
+)
+from pyastrx.xml.xpath_lists import inline_list_calls, list_params
+
+
+def test_split_location_path():
+    assert split_location_path("//a/b[x/y]//c") == [
+        ("//", "a"), ("/", "b[x/y]"), ("//", "c")]
+    assert split_location_path(".//a/text()") == [
+        ("", "."), ("//", "a"), ("/", "text()")]
+    for xpath in ("//a | //b", "count(//a)", "(//a)[1]", "//a = 'b'"):
+        assert split_location_path(xpath) is None
+
+
+def test_compile_rule_dispatch():
+    rule = compile_rule("//Call[func/Name[@id='print']]/args")
+    assert rule.tag == "Call"
+    assert rule.dispatch_xpath == "$nodes[func/Name[@id='print']]/args"
+    rule = compile_rule(".//Constant[not(ancestor::Assign)]")
+    assert rule.tag == "Constant"
+    assert rule.descendants_only
+    # position dependent predicates can not be dispatched
+    for xpath in ("//a[1]", "//a[last()]", "//a[count(b)]", "/Module/a",
+                  "//a[@lineno - 4]", "//a[@x * 2]", "//a[@x mod 3]"):
+        assert compile_rule(xpath).tag is None
+    for xpath in ("//a[@lineno - 4 = 1]", "//a[*]", "//a[b/*]"):
+        assert compile_rule(xpath).tag == "a"
+
+
+def test_numeric_predicate_together(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    file = tmp_path / "a.py"
+    file.write_text("x = 1\ny = 2\nz = x\n\nw = y\n")
+    repo = Repo(MatchParams(), file_cache=False)
+    repo.load_file(str(file), "python")
+    rule = RuleInfo(specification_name="python")
+    numeric = "[python]//Name[@lineno - 4]"
+    alone = repo.search_file(str(file), RulesDict({numeric: rule}))
+    together = repo.search_file(
+        str(file), RulesDict({numeric: rule, "[python]//Name": rule}))
+    assert list(alone.matches) == [5]
+    assert together.num_matches_by_expr.get(numeric) == \
+        alone.num_matches_by_expr[numeric]
+
+
+def test_dispatch_same_matches():
+    """Many rules in a single search should find the same matches
+    as each rule searched alone."""
+    xpath2linenos = json.load(open("tests/dummy_examples/xpath2linenos.json"))
+    for filename in xpath2linenos.keys():
+        file = f"tests/dummy_examples/{filename}"
+        match_params = MatchParams(
+            deny_dict={"list_1": ["problematic_var_name"]},
+            allow_dict={"list_1": ["allowed_var_name1"]},
+        )
+        repo = Repo(match_params=match_params, file_cache=False)
+        repo.load_file(file, "python", normalize_ast=True)
+        rules = RulesDict({
+            f"[python]{item[0]}": RuleInfo(specification_name="python")
+            for items in xpath2linenos.values() for item in items
+        })
+        together = repo.search_file(file, rules)
+        for expression, rule_info in rules.items():
+            alone = repo.search_file(
+                file, RulesDict({expression: rule_info}))
+            assert alone.num_matches_by_expr.get(expression) == \
+                together.num_matches_by_expr.get(expression)
+
+
+def test_compile_rules_shared_prefix():
+    shared = "//FunctionDef[args/arguments/args/arg]"
+    xpaths = (
+        shared + "//Return",
+        shared + "/body/Expr",
+        "//ClassDef/body",
+    )
+    compiled = compile_rules(xpaths)
+    for xpath in xpaths[:2]:
+        assert compiled[xpath].prefix is not None
+        assert compiled[xpath].prefix.xpath == shared
+    assert compiled[xpaths[0]].suffix_xpath == "$prefix//Return"
+    assert compiled[xpaths[2]].prefix is None
+
+
+def test_shared_prefix_same_matches():
+    shared = "//ClassDef[body/FunctionDef]"
+    xpaths = (
+        shared + "/body/FunctionDef",
+        shared + "//Call[func/Attribute[value/Name[@id='self']]]",
+        shared + "//Return",
+    )
+    file = "tests/dummy_examples/recursion.py"
+    repo = Repo(match_params=MatchParams(), file_cache=False)
+    repo.load_file(file, "python", normalize_ast=True)
+    rules = RulesDict({
+        f"[python]{xpath}": RuleInfo(specification_name="python")
+        for xpath in xpaths
+    })
+    together = repo.search_file(file, rules)
+    assert all(
+        together.num_matches_by_expr[expression] > 0
+        for expression in rules.keys())
+    for expression, rule_info in rules.items():
+        alone = repo.search_file(file, RulesDict({expression: rule_info}))
+        assert alone.num_matches_by_expr[expression] == \
+            together.num_matches_by_expr[expression]
+
+
+def test_compile_fused_rule():
+    rule = compile_fused_rule("//Call[func/Name[@id='print']]/args")
+    assert rule is not None
+    assert [step.tag for step in rule.steps] == ["Call", "args"]
+    assert rule.steps[0].children == ("func/Name[@id='print']",)
+    rule = compile_fused_rule(".//ClassDef[@name='A' and body/Pass]")
+    assert rule is not None and rule.descendants_only
+    assert rule.steps[0].attributes == (("name", "A"),)
+    for xpath in ("//a[1]", "//a//b", "//a[not(b)]", "//a[@b=1]"):
+        assert compile_fused_rule(xpath) is None
+
+
+def test_fused_same_matches():
+    """The rules matched during the conversion should find
+    the same matches as the xpath evaluation."""
+    xpath2linenos = json.load(open("tests/dummy_examples/xpath2linenos.json"))
+    xpaths = [
+        "//ClassDef/body/FunctionDef",
+        "//Assign/targets/Name[@id]",
+        ".//Call/func/Attribute[value/Name[@id='self']]",
+        "/Module/body/FunctionDef",
+        "//Global/names/item",
+    ]
+    rules = RulesDict({
+        f"[python]{xpath}": RuleInfo(specification_name="python")
+        for xpath in xpaths
+    })
+    for filename in xpath2linenos.keys():
+        file = f"tests/dummy_examples/{filename}"
+        fused_repo = Repo(
+            match_params=MatchParams(), file_cache=False, fused_rules=rules)
+        fused_info = fused_repo.load_file(file, "python")
+        assert set(fused_info.fused_spans.keys()) == set(xpaths)
+        repo = Repo(match_params=MatchParams(), file_cache=False)
+        repo.load_file(file, "python")
+        fused = fused_repo.search_file(file, rules)
+        evaluated = repo.search_file(file, rules)
+        assert fused.num_matches_by_expr == evaluated.num_matches_by_expr
+        for lineno, matches in evaluated.matches.items():
+            assert fused.matches[lineno].match_by_expr == \
+                matches.match_by_expr
+
+
+def test_inline_list_calls():
+    lists = list_params(MatchParams(
+        deny_dict={
+            "small": ["a", "b|c"], "large": [str(i) for i in range(40)]},
+        allow_dict={"ok": ["x"]},
+    ))
+    assert inline_list_calls(
+        "//Name[pyastrx:deny-list('small', @id)]", lists
+    ) == "//Name[(not(contains(@id, ',')) and contains(',a,b|c,'," \
+        + " concat(',', @id, ',')))]"
+    assert inline_list_calls(
+        "//Name[pyastrx:allow-list('ok', @id)]", lists
+    ) == "//Name[(@id and (contains(@id, '|')" \
+        + " or not(contains('|x|', concat('|', @id, '|')))))]"
+    assert inline_list_calls(
+        "//n[pyastrx:any-in(../a/@id, item/text())]", lists
+    ) == "//n[((../a/@id) = (item/text()))]"
+    # large lists, missing lists and elements keep the callbacks
+    for xpath in (
+        "//Name[pyastrx:deny-list('large', @id)]",
+        "//Name[pyastrx:deny-list('missing', @id)]",
+        "//Name[pyastrx:allow-list('ok', .)]",
+        "//Name[pyastrx:allow-list('ok', ../Name/@id)]",
+        "//n[pyastrx:any-in(../a, @id)]",
+    ):
+        assert inline_list_calls(xpath, lists) == xpath
+
+
+def test_inlined_lists_same_matches(tmp_path, monkeypatch):
+    """The inlined lists should find the same matches as the
+    extension callbacks."""
+    xpath2linenos = json.load(open("tests/dummy_examples/xpath2linenos.json"))
+    cases = []
+    for filename in ("deny_list.py", "allow_list.py"):
+        xpath, _, params = xpath2linenos[filename][0]
+        file = Path(f"tests/dummy_examples/{filename}").resolve()
+        cases.append((str(file), xpath, params))
+    # the values with the separator of the joined list
+    separator = tmp_path / "separator.py"
+    separator.write_text('x = "a|b"\ny = "a"\n')
+    lists = {"l": ["a", "b"]}
+    cases += [
+        (str(separator), "//Constant[pyastrx:deny-list('l', @value)]",
+         {"deny_dict": lists}),
+        (str(separator), "//Constant[pyastrx:allow-list('l', @value)]",
+         {"allow_dict": lists}),
+    ]
+    for file, xpath, params in cases:
+        monkeypatch.chdir(Path(file).parent)
+        rules = RulesDict({
+            f"[python]{xpath}": RuleInfo(specification_name="python")})
+        num_matches = []
+        for max_inline_values in (16, 0):
+            monkeypatch.setattr(
+                xpath_lists, "MAX_INLINE_VALUES", max_inline_values)
+            repo = Repo(match_params=MatchParams(**params), file_cache=False)
+            repo.load_file(file, "python")
+            num_matches.append(
+                repo.search_file(file, rules).num_matches_by_expr)
+        assert num_matches[0] == num_matches[1]
+        assert sum(num_matches[0].values()) > 0